@@ -87,6 +87,8 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'syncdata.authentication.TokenClaimsMiddleware',
+    'syncdata.sharding.TenantMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -121,6 +123,48 @@ DATABASES = {
     }
 }
 
+# Connection pooling (psycopg 3 pool): requests check out an open, health-checked
+# connection instead of paying a TCP+TLS+auth handshake each time. Each worker
+# process holds its own pool, so DB_POOL_MAX_SIZE x workers must stay below the
+# server's max_connections. With DB_POOL=False, connections are kept open for
+# DB_CONN_MAX_AGE seconds per thread instead.
+DB_POOL = config('DB_POOL', default=True, cast=bool)
+# Connections are pinged on checkout so dropped ones are replaced, not handed out.
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+if DB_POOL:
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            # seconds a request waits for a free connection before failing
+            'timeout': config('DB_POOL_TIMEOUT', default=10, cast=float),
+            'max_idle': config('DB_POOL_MAX_IDLE', default=300, cast=float),
+            'max_lifetime': config('DB_POOL_MAX_LIFETIME', default=1800, cast=float),
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=60, cast=int)
+
+# Read replicas: comma-separated hosts sharing the primary's credentials. Views
+# wrapped with syncdata.db_routing.replica_reads read from them (GET/HEAD only,
+# back to the primary after a write); everything else uses 'default'.
+for n, host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv()), start=1):
+    DATABASES[f'replica{n}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+REPLICA_DATABASES = [alias for alias in DATABASES if alias.startswith('replica')]
+
+# Tenant shards: comma-separated alias=host pairs (same credentials as the
+# primary). TenantShard rows on 'default' assign client_ids to them; unassigned
+# clients stay on 'default'. Move clients with `manage.py move_tenant`.
+# Workers cache the assignments for SHARD_MAP_TTL seconds.
+SHARD_DATABASES = []
+for entry in config('DB_SHARDS', default='', cast=Csv()):
+    alias, _, host = entry.partition('=')
+    DATABASES[alias] = {**DATABASES['default'], 'HOST': host}
+    SHARD_DATABASES.append(alias)
+SHARD_MAP_TTL = config('SHARD_MAP_TTL', default=10, cast=int)
+
+DATABASE_ROUTERS = ['syncdata.sharding.ShardRouter', 'syncdata.db_routing.ReplicaRouter']
+
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -153,6 +197,51 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# In-process caches
+# Product/price resolution for cart adds, keyed by (client_id, product_code).
+# Entries are dropped when a bulk sync commits; the TTL bounds staleness in
+# other worker processes.
+PRODUCT_CACHE_SIZE = config('PRODUCT_CACHE_SIZE', default=5000, cast=int)
+PRODUCT_CACHE_TTL = config('PRODUCT_CACHE_TTL', default=300, cast=int)
+# Authenticated principals (user row + license), keyed by (user_id, client_id).
+# Dropped when the client's users are bulk synced or its license row changes,
+# in the process that made the change; other processes (web workers vs. the
+# refresh_licenses command) only catch up when entries expire after AUTH_CACHE_TTL.
+AUTH_CACHE_SIZE = config('AUTH_CACHE_SIZE', default=10000, cast=int)
+AUTH_CACHE_TTL = config('AUTH_CACHE_TTL', default=60, cast=int)
+
+# Stateless auth: tokens carry the license expiry and revision (lic_exp /
+# lic_rev) and are accepted without user / license queries while the revision
+# matches. Workers reload revisions every LICENSE_REVISION_TTL seconds, so a
+# revoked license is honoured within that window; deleted users keep access
+# until their license revision changes or the token expires.
+STATELESS_AUTH = config('STATELESS_AUTH', default=False, cast=bool)
+LICENSE_REVISION_TTL = config('LICENSE_REVISION_TTL', default=60, cast=int)
+
+# `manage.py refresh_licenses --loop` pulls licenses from the activation server this often
+LICENSE_REFRESH_SECONDS = config('LICENSE_REFRESH_SECONDS', default=300, cast=int)
+
+# Carts idle longer than this are removed by `manage.py purge_stale_carts`
+CART_TTL_HOURS = config('CART_TTL_HOURS', default=168, cast=int)
+
+# Incremental order feed (/api/orders/feed/): rows changed in the last few
+# seconds are held back so transactions that commit late are not skipped.
+ORDER_FEED_LAG_SECONDS = config('ORDER_FEED_LAG_SECONDS', default=5, cast=int)
+ORDER_FEED_PAGE_SIZE = config('ORDER_FEED_PAGE_SIZE', default=200, cast=int)
+
+# Live events (/api/events/, ASGI only): idle connections get a comment line
+# this often so proxies keep them open.
+EVENTS_HEARTBEAT_SECONDS = config('EVENTS_HEARTBEAT_SECONDS', default=15, cast=int)
+# Lifetime of the stream tickets (POST /api/events/ticket/) that open the events
+# URL; EventSource cannot send headers, so the ticket travels in the query string.
+EVENTS_TICKET_SECONDS = config('EVENTS_TICKET_SECONDS', default=60, cast=int)
+
+# Route add_to_cart / get_cart / get_orders / products to their async variants.
+# Enable only when serving through config.asgi; under WSGI each async view
+# would spin up its own event loop.
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+
+
 # Logging
 LOGGING = {
     'version': 1,
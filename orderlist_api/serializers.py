@@ -1,6 +1,32 @@
+from django.db.models import F
 from rest_framework import serializers
 from syncdata.models import Order, OrderItem, AccProductBatch
 
+
+def batch_lookup(orders):
+    """
+    One client-scoped query for the batches of every item on the page.
+    Returns {(client_id, productcode): AccProductBatch}, keeping the
+    highest-priced batch per code (the one carts price from). Pass it to
+    OrderSerializer as context={"batches": ...}.
+    """
+    client_ids = {order.client_id for order in orders}
+    codes = {item.product_code for order in orders for item in order.items.all()}
+    if not client_ids or not codes:
+        return {}
+    batches = (
+        AccProductBatch.objects
+        # same database the orders came from (replica / tenant shard)
+        .using(orders[0]._state.db)
+        .filter(client_id__in=client_ids, productcode__in=codes)
+        .only("productcode", "client_id", "barcode", "salesprice")
+        .order_by("client_id", "productcode", F("salesprice").desc(nulls_last=True))
+    )
+    lookup = {}
+    for batch in batches:
+        lookup.setdefault((batch.client_id, batch.productcode), batch)
+    return lookup
+
 class OrderItemSerializer(serializers.ModelSerializer):
     barcode = serializers.SerializerMethodField()
     discount = serializers.SerializerMethodField()
@@ -19,14 +45,22 @@ class OrderItemSerializer(serializers.ModelSerializer):
             "discount",
         ]
 
+    # 📌 Batch for this item: from the view's prefetched map, else one client-scoped query
+    def _batch(self, obj):
+        client_id = obj.order.client_id
+        batches = self.context.get("batches")
+        if batches is not None:
+            return batches.get((client_id, obj.product_code))
+        return AccProductBatch.objects.filter(productcode=obj.product_code, client_id=client_id).first()
+
     # 📌 Fetch barcode from batch table
     def get_barcode(self, obj):
-        batch = AccProductBatch.objects.filter(productcode=obj.product_code).first()
+        batch = self._batch(obj)
         return batch.barcode if batch else None
 
     # 📌 Fetch discounted price from batch table
     def get_discount(self, obj):
-        batch = AccProductBatch.objects.filter(productcode=obj.product_code).first()
+        batch = self._batch(obj)
         return batch.discounted_price if batch else None
 
 
@@ -46,3 +80,10 @@ class OrderSerializer(serializers.ModelSerializer):
             "created_at",
             "items",
         ]
+
+
+class OrderFeedSerializer(OrderSerializer):
+    """Order as sent by the incremental feed (any status, with change time)."""
+
+    class Meta(OrderSerializer.Meta):
+        fields = OrderSerializer.Meta.fields + ["user_id", "updated_at"]
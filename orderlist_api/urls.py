@@ -1,6 +1,8 @@
 from django.urls import path
-from .views import OrderListView
+from syncdata.db_routing import replica_reads
+from .views import OrderFeedView, OrderListView
 
 urlpatterns = [
-    path("api/orderlist/orders/", OrderListView.as_view(), name="orderlist_all_orders"),
+    path("api/orderlist/orders/", replica_reads(OrderListView.as_view()), name="orderlist_all_orders"),
+    path("api/orders/feed/", OrderFeedView.as_view(), name="orderlist_feed"),
 ]
@@ -1,12 +1,21 @@
-from django.shortcuts import render
+import json
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
 from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
 from syncdata.models import Order, OrderItem  # ← import existing models
-from .serializers import OrderSerializer
+from syncdata import order_feed, paging
+from syncdata.paging import InvalidDate, day_range
+from .serializers import OrderFeedSerializer, OrderSerializer, batch_lookup
+
+MAX_PAGE_SIZE = 500
+STREAM_CHUNK_SIZE = 500
 
 # If you’re using your existing token permission:
 try:
@@ -15,6 +24,50 @@ try:
 except Exception:
     _PERMS = []  # falls back to open if that permission isn't present
 
+def serialize_orders(orders, serializer_class=OrderSerializer):
+    """Serialize a list of orders with one batch lookup for all their items."""
+    return serializer_class(orders, many=True, context={"batches": batch_lookup(orders)}).data
+
+
+def ndjson_lines(qs, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yield one JSON line per order. Rows come from a server-side iterator and
+    are serialized chunk by chunk (items prefetched and batches looked up per
+    chunk), so memory stays flat however many orders match.
+    """
+    chunk = []
+    for order in qs.iterator(chunk_size=chunk_size):
+        chunk.append(order)
+        if len(chunk) == chunk_size:
+            yield from _encode_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield from _encode_chunk(chunk)
+
+
+async def andjson_lines(qs, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Async ndjson_lines for ASGI servers, which buffer a sync iterator whole
+    before sending it. Rows come from aiterator(); each chunk is serialized
+    in one thread hop (the batch lookup is a sync query).
+    """
+    chunk = []
+    async for order in qs.aiterator(chunk_size=chunk_size):
+        chunk.append(order)
+        if len(chunk) == chunk_size:
+            for line in await sync_to_async(list)(_encode_chunk(chunk)):
+                yield line
+            chunk = []
+    if chunk:
+        for line in await sync_to_async(list)(_encode_chunk(chunk)):
+            yield line
+
+
+def _encode_chunk(orders):
+    for row in serialize_orders(orders):
+        yield json.dumps(row, cls=JSONEncoder) + "\n"
+
+
 class OrderListView(APIView):
     permission_classes = _PERMS
 
@@ -22,19 +75,25 @@ class OrderListView(APIView):
         """
         Returns only pending orders with customer and item details.
         Optional filters:
-          - client_id
+          - client_id (the token's client_id wins when one is sent)
           - user_id
           - from_date (YYYY-MM-DD)
           - to_date   (YYYY-MM-DD)
           - order_id  (exact id)
+        Output:
+          - default: every matching order in one response
+          - limit=N [&cursor=<token>]: keyset pages on (created_at, id), newest
+            first, with next_cursor (max page size 500)
+          - stream=1: NDJSON, one order per line, streamed with constant memory
         """
         # Show only pending orders by default
         qs = Order.objects.filter(status="pending").prefetch_related(
             Prefetch("items", queryset=OrderItem.objects.all().order_by("id"))
-        ).order_by("-created_at")
+        ).order_by("-created_at", "-id")
 
-        # Filters (optional)
-        client_id = request.GET.get("client_id")
+        # Filters (optional); a token limits the caller to its own client
+        token = request.auth
+        client_id = (str(token.get("client_id") or "") if token else "").strip() or request.GET.get("client_id")
         user_id = request.GET.get("user_id")
         from_date = request.GET.get("from_date")
         to_date = request.GET.get("to_date")
@@ -44,18 +103,97 @@ class OrderListView(APIView):
             qs = qs.filter(client_id=client_id)
         if user_id:
             qs = qs.filter(user_id=user_id)
-        if from_date:
-            qs = qs.filter(created_at__date__gte=from_date)
-        if to_date:
-            qs = qs.filter(created_at__date__lte=to_date)
+        try:
+            qs = qs.filter(**day_range("created_at", from_date, to_date))
+        except InvalidDate as e:
+            return Response({"success": False, "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         if order_id:
             qs = qs.filter(id=order_id)
 
-        data = OrderSerializer(qs, many=True).data
+        if request.GET.get("stream") in ("1", "true"):
+            # bind the database chosen for this request; the body is read after the view returns
+            qs = qs.using(qs.db)
+            lines = andjson_lines(qs) if isinstance(request._request, ASGIRequest) else ndjson_lines(qs)
+            return StreamingHttpResponse(lines, content_type="application/x-ndjson")
+
+        limit = request.GET.get("limit")
+        cursor = request.GET.get("cursor")
+        if limit or cursor is not None:
+            try:
+                limit = min(int(limit or MAX_PAGE_SIZE), MAX_PAGE_SIZE)
+                if limit < 1:
+                    raise ValueError
+            except ValueError:
+                return Response({"success": False, "message": "limit must be a positive integer."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            try:
+                orders, next_cursor = paging.keyset_page(qs, cursor, limit, "created_at")
+            except paging.InvalidCursor as e:
+                return Response({"success": False, "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            data = serialize_orders(orders)
+            return Response({
+                "success": True,
+                "count": len(data),
+                "orders": data,
+                "next_cursor": next_cursor,
+                "has_next": next_cursor is not None,
+            }, status=status.HTTP_200_OK)
+
+        # Barcodes / discounts for every item on the page in one query
+        data = serialize_orders(list(qs))
         return Response({"success": True, "count": len(data), "orders": data}, status=status.HTTP_200_OK)
 
 
 
+class OrderFeedView(APIView):
+    permission_classes = _PERMS
+
+    def get(self, request):
+        """
+        Incremental order feed for the desktop ERP.
+        Query:
+          - since     watermark from the previous response (omit for a full snapshot)
+          - client_id required unless the token carries it
+          - limit     max orders / deletions per response (default ORDER_FEED_PAGE_SIZE)
+        Returns orders created or changed (any status) and tombstones for orders
+        deleted after the watermark, plus the next watermark. Keep polling with
+        the new watermark while has_more is true.
+        """
+        token = request.auth
+        client_id = (str(token.get("client_id") or "") if token else "").strip() or request.GET.get("client_id")
+        if not client_id:
+            return Response({"success": False, "message": "client_id is required."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = int(request.GET.get("limit") or 0)
+            if limit < 0:
+                raise ValueError
+            limit = min(limit, MAX_PAGE_SIZE) or None
+        except ValueError:
+            return Response({"success": False, "message": "limit must be a positive integer."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            orders, tombstones, watermark, has_more = order_feed.changes_since(
+                client_id, request.GET.get("since"), limit
+            )
+        except paging.InvalidCursor as e:
+            return Response({"success": False, "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "success": True,
+            "orders": serialize_orders(orders, OrderFeedSerializer),
+            "deleted": [
+                {"id": t.order_id, "order_number": t.order_number, "deleted_at": t.deleted_at}
+                for t in tombstones
+            ],
+            "watermark": watermark,
+            "has_more": has_more,
+        }, status=status.HTTP_200_OK)
+
+
+
 
 
 
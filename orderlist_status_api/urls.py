@@ -1,6 +1,7 @@
 from django.urls import path
-from .views import OrderStatusUpdateView
+from .views import OrderBulkStatusUpdateView, OrderStatusUpdateView
 
 urlpatterns = [
     path("update/", OrderStatusUpdateView.as_view(), name="order_status_update"),
+    path("bulk-update/", OrderBulkStatusUpdateView.as_view(), name="order_status_bulk_update"),
 ]
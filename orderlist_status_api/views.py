@@ -1,13 +1,13 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from syncdata.models import Order  # Use the existing Order model
-from syncdata.permissions import TokenOnlyPermission
-from rest_framework.views import APIView
-from rest_framework.response import Response
-from rest_framework import status
 from syncdata.models import Order
-from syncdata.permissions import TokenOnlyPermission
+from syncdata.permissions import ClientTokenPermission, TokenOnlyPermission
+from syncdata import order_store, versioning
+
+ORDER_STATUSES = ("pending", "completed", "cancelled")
+MAX_BULK_ORDERS = 500
+
 
 class OrderStatusUpdateView(APIView):
     permission_classes = [TokenOnlyPermission]
@@ -18,11 +18,11 @@ class OrderStatusUpdateView(APIView):
         Required:
             - order_id
             - status (pending | completed | cancelled)
-            - client_id
+            - client_id (taken from the token when one is sent)
         """
         order_id = request.data.get("order_id")
         new_status = request.data.get("status")
-        client_id = request.data.get("client_id")
+        client_id = (request.auth.get("client_id") if request.auth else None) or request.data.get("client_id")
 
         # Validate input
         if not order_id or not new_status or not client_id:
@@ -31,27 +31,86 @@ class OrderStatusUpdateView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        if new_status not in ["pending", "completed", "cancelled"]:
+        if new_status not in ORDER_STATUSES:
             return Response(
                 {"success": False, "message": "Invalid status. Choose pending, completed, or cancelled."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
         try:
-            # Update only if the order belongs to this client
-            order = Order.objects.get(id=order_id, client_id=client_id)
-
-            order.status = new_status
-            order.save()
+            # Update only if the order belongs to this client (sales rollups follow the status)
+            order_store.set_status(order_id, new_status, client_id=client_id)
+            versioning.bump_version(client_id, versioning.ORDERS)
 
             return Response(
                 {"success": True, "message": f"Order status updated to {new_status}."},
                 status=status.HTTP_200_OK
             )
 
-        except Order.DoesNotExist:
+        except order_store.InvalidOrderId:
+            return Response(
+                {"success": False, "message": "order_id must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except order_store.OrderNotFound:
             return Response(
                 {"success": False, "message": "Order not found for this client."},
                 status=status.HTTP_404_NOT_FOUND
             )
 
+
+class OrderBulkStatusUpdateView(APIView):
+    permission_classes = [ClientTokenPermission]
+
+    def post(self, request):
+        """
+        API to update the status of many orders at once.
+        Required:
+            - order_ids (list, max 500)
+            - status (pending | completed | cancelled)
+        Only orders of the token's client_id are changed. Completed and
+        cancelled orders cannot be moved back; they are reported as "locked".
+        Response "results" maps each order id to updated | locked | not_found.
+        """
+        order_ids = request.data.get("order_ids")
+        new_status = request.data.get("status")
+        client_id = request.auth.get("client_id")
+
+        # Validate input
+        if not order_ids or not new_status or not isinstance(order_ids, list):
+            return Response(
+                {"success": False, "message": "order_ids (list) and status are required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if new_status not in ORDER_STATUSES:
+            return Response(
+                {"success": False, "message": "Invalid status. Choose pending, completed, or cancelled."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if len(order_ids) > MAX_BULK_ORDERS:
+            return Response(
+                {"success": False, "message": f"At most {MAX_BULK_ORDERS} orders per request."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            results = order_store.bulk_set_status(client_id, order_ids, new_status)
+        except order_store.InvalidOrderId:
+            return Response(
+                {"success": False, "message": "order_ids must be integers."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        updated = sum(1 for result in results.values() if result == "updated")
+        if updated:
+            versioning.bump_version(client_id, versioning.ORDERS)
+
+        return Response(
+            {
+                "success": True,
+                "message": f"{updated} of {len(results)} orders updated to {new_status}.",
+                "results": {str(order_id): result for order_id, result in results.items()},
+            },
+            status=status.HTTP_200_OK
+        )
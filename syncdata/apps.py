@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class SyncdataConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'syncdata'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from syncdata.authentication import invalidate_client_principals, license_revisions
+        from syncdata.models import ClientLicense
+
+        # license sync and admin edits: drop cached auth principals of the client
+        # and re-check the revisions stateless tokens are compared against
+        def license_changed(sender, instance, **kwargs):
+            invalidate_client_principals(instance.client_id)
+            license_revisions.expire()
+
+        post_save.connect(license_changed, sender=ClientLicense, dispatch_uid='license_changed_save')
+        post_delete.connect(license_changed, sender=ClientLicense, dispatch_uid='license_changed_delete')
@@ -1,14 +1,142 @@
 # File: syncdata/authentication.py
 
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.models import TokenUser
 from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, Token
 from rest_framework.exceptions import AuthenticationFailed
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from syncdata import sharding
+from syncdata.cache import BoundedCache
 from syncdata.models import AccUsers, ClientLicense
 import logging
+import threading
+import time
+from datetime import timedelta
 
 logger = logging.getLogger(__name__)
 
+# (user_id, client_id) -> (AccUsers row, ClientLicense row or None). Users only
+# change on bulk sync and licenses on license sync / admin edits, which
+# invalidate the client's entries; the TTL bounds staleness in other workers.
+principal_cache = BoundedCache(
+    'auth_principals',
+    maxsize=getattr(settings, 'AUTH_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'AUTH_CACHE_TTL', 60),
+)
+
+
+def invalidate_client_principals(client_id):
+    """Forget cached principals of one client (users re-synced or license changed)."""
+    return principal_cache.invalidate_where(lambda key: key[1] == client_id)
+
+
+def check_license(lic, client_id):
+    """Raise AuthenticationFailed unless lic is an active, unexpired license."""
+    if lic is None:
+        logger.warning("No license found for client_id=%s", client_id)
+        raise AuthenticationFailed(
+            "No license found for this client. Please contact support.",
+            code="license_not_found"
+        )
+    if not lic.is_valid():
+        logger.warning("License expired or inactive for client_id=%s", client_id)
+        raise AuthenticationFailed(
+            "License expired or inactive. Please contact support.",
+            code="license_expired"
+        )
+
+
+class LicenseRevisions:
+    """
+    Per-process map of client_id -> current revision of its active license,
+    for the stateless auth mode (STATELESS_AUTH). Reloaded with one query per
+    database every LICENSE_REVISION_TTL seconds, and on the next check after a
+    license row changes in this process. A token whose lic_rev differs from
+    the map (license renewed, deactivated or removed) takes the DB path.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._revisions = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self.accepted = 0
+        self.fallbacks = 0
+
+    def fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def ensure_fresh(self):
+        """
+        Reload if stale, once: concurrent callers wait for the reload in
+        progress instead of each querying every database.
+        """
+        if self.fresh():
+            return
+        with self._reload_lock:
+            if not self.fresh():
+                self.reload()
+
+    def reload(self):
+        revisions = {}
+        for alias in sharding.database_aliases():
+            revisions.update(
+                ClientLicense.objects.using(alias).filter(is_active=True).values_list('client_id', 'revision')
+            )
+        with self._lock:
+            self._revisions = revisions
+            self._loaded_at = time.monotonic()
+
+    def expire(self):
+        """Force a reload on the next check (a license row changed)."""
+        with self._lock:
+            self._loaded_at = None
+
+    def accepts(self, token, client_id):
+        """Whether the token's license claims match the loaded map (call ensure_fresh() first)."""
+        lic_rev, lic_exp = token.get('lic_rev'), token.get('lic_exp')
+        ok = (
+            lic_rev is not None and lic_exp is not None and lic_exp > time.time()
+            and self._revisions.get(client_id) == lic_rev
+        )
+        with self._lock:
+            if ok:
+                self.accepted += 1
+            else:
+                self.fallbacks += 1
+        return ok
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': getattr(settings, 'STATELESS_AUTH', False),
+                'clients': len(self._revisions),
+                'accepted': self.accepted,
+                'fallbacks': self.fallbacks,
+            }
+
+
+license_revisions = LicenseRevisions(ttl=getattr(settings, 'LICENSE_REVISION_TTL', 60))
+
+
+def license_claims(lic):
+    """Claims LoginView embeds in stateless mode: license expiry (epoch seconds) and revision."""
+    return {'lic_exp': int(lic.expires_at.timestamp()), 'lic_rev': lic.revision}
+
+
 class CustomJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        # reuse the token TokenClaimsMiddleware already validated for this request
+        token = getattr(request._request, "token", None)
+        if token is None:
+            return super().authenticate(request)
+        return self.get_user(token), token
+
     def get_user(self, validated_token):
         """
         Resolve the user from the validated token.
@@ -18,6 +146,8 @@ class CustomJWTAuthentication(JWTAuthentication):
          - Accept common client_id claim names ('client_id', 'client', 'cid').
          - If client_id is missing, try to resolve by user_id only but fail if ambiguous.
          - Provide clear AuthenticationFailed messages (no ambiguous DB errors).
+         - STATELESS_AUTH: a token whose lic_exp / lic_rev claims are still
+           current is accepted without DB lookups (as a TokenUser).
         """
         user_id = validated_token.get(api_settings.USER_ID_CLAIM)
         if not user_id:
@@ -34,31 +164,27 @@ class CustomJWTAuthentication(JWTAuthentication):
                 client_id = str(v).strip()
                 break
 
-        # If we have client_id, do a precise lookup by both fields
+        # Stateless mode: signature, expiry and license revision are enough
+        if client_id and getattr(settings, 'STATELESS_AUTH', False):
+            license_revisions.ensure_fresh()
+            if license_revisions.accepts(validated_token, client_id):
+                return TokenUser(validated_token)
+
+        # If we have client_id, do a precise lookup by both fields (cached)
         if client_id:
-            users_qs = AccUsers.objects.filter(id=user_id, client_id=client_id)
-            user = users_qs.first()
-            if not user:
-                # explicit fail: exact pair not found
-                logger.warning("Auth failed: no AccUsers row for id=%s client_id=%s", user_id, client_id)
-                raise AuthenticationFailed("User not found for provided client_id", code="user_not_found_client")
-
-            # 🆕 LICENSE CHECK
-            try:
-                lic = ClientLicense.objects.get(client_id=client_id)
-                if not lic.is_valid():
-                    logger.warning("License expired or inactive for client_id=%s", client_id)
-                    raise AuthenticationFailed(
-                        "License expired or inactive. Please contact support.",
-                        code="license_expired"
-                    )
-            except ClientLicense.DoesNotExist:
-                logger.warning("No license found for client_id=%s", client_id)
-                raise AuthenticationFailed(
-                    "No license found for this client. Please contact support.",
-                    code="license_not_found"
-                )
+            principal = principal_cache.get((user_id, client_id))
+            if principal is None:
+                user = AccUsers.objects.filter(id=user_id, client_id=client_id).first()
+                if not user:
+                    # explicit fail: exact pair not found
+                    logger.warning("Auth failed: no AccUsers row for id=%s client_id=%s", user_id, client_id)
+                    raise AuthenticationFailed("User not found for provided client_id", code="user_not_found_client")
+                principal = (user, ClientLicense.objects.filter(client_id=client_id).first())
+                principal_cache.set((user_id, client_id), principal)
 
+            # 🆕 LICENSE CHECK (expiry is evaluated on every request, cached or not)
+            user, lic = principal
+            check_license(lic, client_id)
             return user
 
         # No client_id in token: try to resolve by user_id only, but guard against duplicates
@@ -76,4 +202,134 @@ class CustomJWTAuthentication(JWTAuthentication):
             )
 
         # exactly 1 row -> OK
-        return users_qs.first()
\ No newline at end of file
+        return users_qs.first()
+
+def _raw_bearer(request):
+    auth_header = request.META.get("HTTP_AUTHORIZATION", "")
+    if auth_header.startswith("Bearer "):
+        return auth_header.split(" ", 1)[1].strip()
+    return ""
+
+
+class StreamTicket(Token):
+    """
+    Short-lived token that only opens the live events stream. EventSource
+    cannot send headers, so the credential travels in the URL (and from there
+    into access logs and browser history); a ticket is useless elsewhere
+    (token_type 'stream' is rejected as an access token) and expires after
+    EVENTS_TICKET_SECONDS.
+    """
+    token_type = "stream"
+    lifetime = timedelta(seconds=getattr(settings, "EVENTS_TICKET_SECONDS", 60))
+
+    # access token claims carried over, so the stream is authorized like the API
+    CLAIMS = (api_settings.USER_ID_CLAIM, "client_id", "role", "lic_exp", "lic_rev")
+
+    @classmethod
+    def for_access_token(cls, access):
+        ticket = cls()
+        for claim in cls.CLAIMS:
+            if claim in access:
+                ticket[claim] = access[claim]
+        return ticket
+
+
+def token_claims(token):
+    """Normalized identity claims of a validated token."""
+    return {
+        "user_id": str(token.get(api_settings.USER_ID_CLAIM) or "").strip(),
+        "client_id": str(token.get("client_id") or "").strip(),
+        "role": str(token.get("role") or "").strip().lower(),
+    }
+
+
+class TokenClaimsMiddleware:
+    """
+    Decodes and validates the Bearer token once per request. request.token is
+    the AccessToken (None when absent) and request.claims its normalized
+    user_id / client_id / role (see token_claims). Views, DRF authentication
+    and the tenant router read these instead of decoding the header again.
+
+    A Bearer header that does not validate (forged, expired, wrong type) gets
+    401 here, as DRF views already answered. Otherwise the plain JSON views
+    would treat it as "no token" and trust identity sent in the request.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _decode(self, request):
+        """Set request.token / request.claims; returns False if the header holds an invalid token."""
+        request.token = None
+        request.claims = None
+        raw = _raw_bearer(request)
+        if raw:
+            try:
+                request.token = AccessToken(raw)
+            except TokenError:
+                return False
+            request.claims = token_claims(request.token)
+        return True
+
+    def _rejected(self):
+        response = JsonResponse(
+            {"detail": "Given token not valid for any token type", "code": "token_not_valid"}, status=401,
+        )
+        response["WWW-Authenticate"] = 'Bearer realm="api"'
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._decode(request):
+            return self._rejected()
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not self._decode(request):
+            return self._rejected()
+        return await self.get_response(request)
+
+
+async def aauthenticate(request, token=None):
+    """
+    Async counterpart of CustomJWTAuthentication for plain async views (DRF
+    views are sync-only): validates the Bearer token (or uses `token`, e.g. a
+    StreamTicket), then checks the user row and the client license (same
+    cache, async ORM on a miss). Returns the validated token's claims; raises
+    AuthenticationFailed.
+    """
+    if token is None:
+        token = getattr(request, "token", None)
+    if token is None:
+        try:
+            token = AccessToken(_raw_bearer(request))
+        except TokenError:
+            raise AuthenticationFailed("Invalid or missing token", code="token_not_valid")
+
+    user_id = str(token.get(api_settings.USER_ID_CLAIM) or "").strip()
+    client_id = str(token.get("client_id") or "").strip()
+    if not user_id or not client_id:
+        raise AuthenticationFailed("Token must include user_id and client_id", code="claims_missing")
+
+    if getattr(settings, 'STATELESS_AUTH', False):
+        if not license_revisions.fresh():
+            await sync_to_async(license_revisions.ensure_fresh)()
+        if license_revisions.accepts(token, client_id):
+            return token
+
+    principal = principal_cache.get((user_id, client_id))
+    if principal is None:
+        user = await AccUsers.objects.filter(id=user_id, client_id=client_id).afirst()
+        if not user:
+            logger.warning("Auth failed: no AccUsers row for id=%s client_id=%s", user_id, client_id)
+            raise AuthenticationFailed("User not found for provided client_id", code="user_not_found_client")
+        principal = (user, await ClientLicense.objects.filter(client_id=client_id).afirst())
+        principal_cache.set((user_id, client_id), principal)
+
+    check_license(principal[1], client_id)
+    return token
@@ -0,0 +1,470 @@
+import logging
+from decimal import Decimal, InvalidOperation
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from syncdata.cache import BoundedCache
+from syncdata.models import AccProduct, AccProductBatch, Cart, CartItem
+
+logger = logging.getLogger(__name__)
+
+# Price tiers on acc_productbatch, in fallback order
+PRICE_KEYS = ('cost', 'salesprice', 'bmrp', 'secondprice', 'thirdprice', 'fourthprice')
+
+# (client_id, product_code) -> resolved product; catalog rows only change on bulk sync
+product_cache = BoundedCache(
+    'products',
+    maxsize=getattr(settings, 'PRODUCT_CACHE_SIZE', 5000),
+    ttl=getattr(settings, 'PRODUCT_CACHE_TTL', 300),
+)
+
+
+def _as_decimal(value, places):
+    """Normalize a DB numeric (Decimal on PostgreSQL, float on SQLite) to a fixed-scale Decimal."""
+    if value is None:
+        return None
+    try:
+        return Decimal(str(value)).quantize(Decimal(1).scaleb(-places))
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+
+
+# ---------------- product / price resolution ----------------
+def resolve_product(client_id, product_code):
+    """
+    Resolve name, barcode and price tiers for one product (cached, else one query).
+
+    The highest-priced batch wins when a product has several. Returns None if
+    the product does not exist for this client; 'has_batch' is False when the
+    product exists but has no batch row.
+    """
+    return resolve_products(client_id, [product_code]).get(product_code)
+
+
+async def aresolve_product(client_id, product_code):
+    """Async resolve_product; cache hits are answered without leaving the event loop."""
+    product = product_cache.get((client_id, product_code))
+    if product is None:
+        product = (await sync_to_async(_fetch_products)(client_id, [product_code])).get(product_code)
+        if product is not None:
+            product_cache.set((client_id, product_code), product)
+    return product
+
+
+def invalidate_client_products(client_id):
+    """Forget cached products of one client (called after a bulk sync commits)."""
+    return product_cache.invalidate_where(lambda key: key[0] == client_id)
+
+
+def resolve_products(client_id, product_codes):
+    """
+    Resolve several product codes (see resolve_product). Cached codes skip the
+    catalog tables; the rest are fetched together in one query.
+    Returns {code: product dict}.
+    """
+    products = {}
+    missing = []
+    for code in product_codes:
+        cached = product_cache.get((client_id, code))
+        if cached is None:
+            missing.append(code)
+        else:
+            products[code] = cached
+    if missing:
+        fetched = _fetch_products(client_id, missing)
+        for code, product in fetched.items():
+            product_cache.set((client_id, code), product)
+        products.update(fetched)
+    return products
+
+
+def _fetch_products(client_id, product_codes):
+    """Load products with their highest-priced batch from acc_product / acc_productbatch."""
+    product_table = AccProduct._meta.db_table
+    batch_table = AccProductBatch._meta.db_table
+    price_cols = ', '.join(f'b.{key}' for key in PRICE_KEYS)
+    placeholders = ', '.join(['%s'] * len(product_codes))
+
+    with connections[router.db_for_read(AccProduct)].cursor() as cursor:
+        cursor.execute(
+            f"SELECT p.code, p.name, b.productcode, b.barcode, {price_cols} "
+            f"FROM {product_table} p "
+            f"LEFT JOIN {batch_table} b ON b.productcode = p.code AND b.client_id = p.client_id "
+            f"WHERE p.client_id = %s AND p.code IN ({placeholders}) "
+            f"ORDER BY p.code, b.salesprice DESC NULLS LAST",
+            [client_id, *product_codes],
+        )
+        rows = cursor.fetchall()
+
+    products = {}
+    for code, name, batch_code, barcode, *prices in rows:
+        if code in products:
+            continue  # first row per code is the highest-priced batch
+        products[code] = {
+            'name': name or '',
+            'has_batch': batch_code is not None,
+            'barcode': barcode,
+            'prices': {key: _as_decimal(val, 3) for key, val in zip(PRICE_KEYS, prices)},
+        }
+    return products
+
+
+def pick_unit_price(prices, price_key=None):
+    """Return the requested price tier, falling back through PRICE_KEYS to the first non-null tier."""
+    preferred = [price_key] if price_key and price_key != 'all' else []
+    for key in preferred + list(PRICE_KEYS):
+        val = prices.get(key)
+        if val is not None:
+            return val
+    return Decimal('0')
+
+
+# ---------------- cart upserts ----------------
+def upsert_cart(cursor, client_id, user_id, customer_name, customer_phone='', customer_address=''):
+    """Get-or-create the cart row in one statement; touches updated_at. Returns the cart id."""
+    table = Cart._meta.db_table
+    now = timezone.now()
+    cursor.execute(
+        f"INSERT INTO {table} "
+        f"(customer_name, customer_phone, customer_address, created_at, updated_at, user_id, client_id, "
+        f"item_count, total_quantity, total_amount) "
+        f"VALUES (%s, %s, %s, %s, %s, %s, %s, 0, 0, 0) "
+        f"ON CONFLICT (customer_name, user_id, client_id) DO UPDATE SET updated_at = excluded.updated_at "
+        f"RETURNING id",
+        [customer_name, customer_phone, customer_address, now, now, user_id, client_id],
+    )
+    return cursor.fetchone()[0]
+
+
+def upsert_cart_adding(cursor, client_id, user_id, customer_name, product_code, quantity, unit_price,
+                       customer_phone='', customer_address=''):
+    """
+    upsert_cart for a single-product add: the same statement also shifts the
+    cart totals by what adding `quantity` at `unit_price` does to the
+    product's line, read in subqueries while the cart row is locked. Returns
+    (cart id, (line id, quantity, unit_price) as read, all None if there was
+    no line) for add_line(expect=...) to check.
+    """
+    table = Cart._meta.db_table
+    line_sql = f"FROM {CartItem._meta.db_table} WHERE cart_id = {table}.id AND product_code = %s"
+    now = timezone.now()
+    cursor.execute(
+        f"INSERT INTO {table} "
+        f"(customer_name, customer_phone, customer_address, created_at, updated_at, user_id, client_id, "
+        f"item_count, total_quantity, total_amount) "
+        f"VALUES (%s, %s, %s, %s, %s, %s, %s, 1, %s, ROUND(%s * %s, 2)) "
+        f"ON CONFLICT (customer_name, user_id, client_id) DO UPDATE SET updated_at = excluded.updated_at, "
+        f"item_count = {table}.item_count + CASE WHEN EXISTS (SELECT 1 {line_sql}) THEN 0 ELSE 1 END, "
+        f"total_quantity = {table}.total_quantity + %s, "
+        f"total_amount = {table}.total_amount + ROUND((COALESCE((SELECT quantity {line_sql}), 0) + %s) * %s, 2) "
+        f"- COALESCE((SELECT ROUND(quantity * unit_price, 2) {line_sql}), 0) "
+        f"RETURNING id, (SELECT id {line_sql}), (SELECT quantity {line_sql}), (SELECT unit_price {line_sql})",
+        [customer_name, customer_phone, customer_address, now, now, user_id, client_id,
+         quantity, quantity, unit_price,
+         product_code, quantity, product_code, quantity, unit_price, product_code,
+         product_code, product_code, product_code],
+    )
+    row = cursor.fetchone()
+    return row[0], tuple(row[1:])
+
+
+def refresh_totals(cursor, cart_id):
+    """
+    Recompute item_count / total_quantity / total_amount of one cart from its
+    lines in a single UPDATE (line totals rounded to 2dp like the API output).
+    Used by the multi-line paths and whenever add_to_cart's incremental shift
+    cannot be trusted. Returns the cart's client_id and new totals, or None if
+    the cart is gone.
+    """
+    table = Cart._meta.db_table
+    items = CartItem._meta.db_table
+    cursor.execute(
+        f"UPDATE {table} SET (item_count, total_quantity, total_amount) = ("
+        f"SELECT COUNT(*), COALESCE(SUM(quantity), 0), COALESCE(SUM(ROUND(quantity * unit_price, 2)), 0) "
+        f"FROM {items} WHERE cart_id = {table}.id"
+        f"), updated_at = %s WHERE id = %s "
+        f"RETURNING client_id, item_count, total_quantity, total_amount",
+        [timezone.now(), cart_id],
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return {
+        'client_id': row[0],
+        'item_count': row[1],
+        'total_quantity': _as_decimal(row[2], 3),
+        'total_amount': _as_decimal(row[3], 2),
+    }
+
+
+def add_line(cursor, cart_id, product_code, product_name, quantity, unit_price, expect=None):
+    """
+    Insert a cart line or add `quantity` to the existing one in a single
+    statement, so concurrent taps on the same product never lose an increment.
+    With `expect` (from upsert_cart_adding) an existing line is only updated
+    if it still holds the quantity and unit_price read there. Returns the
+    resulting line as a dict, or None if `expect` did not match.
+    """
+    table = CartItem._meta.db_table
+    guard_sql, params = "", [cart_id, product_code, product_name, quantity, unit_price]
+    if expect is not None:
+        guard_sql = f"WHERE {table}.quantity = %s AND {table}.unit_price = %s "
+        params.extend(expect[1:])
+    cursor.execute(
+        f"INSERT INTO {table} "
+        f"(cart_id, product_code, product_name, quantity, unit_price, discount_pct, discounted_total) "
+        f"VALUES (%s, %s, %s, %s, %s, 0, 0) "
+        f"ON CONFLICT (cart_id, product_code) DO UPDATE SET "
+        f"quantity = {table}.quantity + excluded.quantity, "
+        f"unit_price = excluded.unit_price, "
+        f"product_name = excluded.product_name "
+        f"{guard_sql}"
+        f"RETURNING id, product_code, product_name, quantity, unit_price",
+        params,
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    item_id, code, name, qty, price = row
+    return {
+        'id': item_id,
+        'product_code': code,
+        'product_name': name,
+        'quantity': _as_decimal(qty, 3),
+        'unit_price': _as_decimal(price, 2),
+    }
+
+
+def delete_empty_line(cursor, item_id):
+    """Drop a line whose quantity fell to zero or below (guarded against concurrent re-increments)."""
+    cursor.execute(
+        f"DELETE FROM {CartItem._meta.db_table} WHERE id = %s AND quantity <= 0",
+        [item_id],
+    )
+    return cursor.rowcount > 0
+
+
+def add_to_cart(client_id, user_id, customer_name, product_code, product_name, quantity, unit_price,
+                customer_phone='', customer_address=''):
+    """
+    Upsert the cart and its line for one product inside one transaction: two
+    statements, the first shifting the cart totals by the line delta.
+    Returns (cart_id, line); line is None when the resulting quantity was <= 0
+    and the line was removed.
+
+    On PostgreSQL the cart upsert's subqueries read the statement snapshot, so
+    if it waited on the cart lock behind another change to the same line it
+    shifted by a stale delta; the guarded line upsert then misses (or inserts
+    a line the shift thought existed) and the totals are recomputed under the
+    lock. Removing an emptied line recomputes them as well.
+    """
+    alias = router.db_for_write(CartItem)
+    with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+        cart_id, expect = upsert_cart_adding(cursor, client_id, user_id, customer_name, product_code,
+                                             quantity, unit_price, customer_phone, customer_address)
+        line = add_line(cursor, cart_id, product_code, product_name, quantity, unit_price, expect=expect)
+        in_step = line is not None and expect[0] in (None, line['id'])
+        if line is None:
+            line = add_line(cursor, cart_id, product_code, product_name, quantity, unit_price)
+        if (line['quantity'] or Decimal('0')) <= 0 and delete_empty_line(cursor, line['id']):
+            line, in_step = None, False
+        if not in_step:
+            refresh_totals(cursor, cart_id)
+    return cart_id, line
+
+
+# ---------------- batched mutations ----------------
+class CartOperationError(Exception):
+    """A batched cart operation is malformed or references an unknown product."""
+
+    def __init__(self, message, index=None, status=400):
+        super().__init__(message)
+        self.index = index
+        self.status = status
+
+
+CART_OPS = ('add', 'set', 'remove')
+
+
+def _parse_quantity(value, index):
+    try:
+        return Decimal(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        raise CartOperationError(f'operations[{index}]: invalid quantity', index)
+
+
+def fold_operations(operations):
+    """
+    Collapse an ordered list of add / set / remove operations into one final
+    effect per product_code, preserving first-seen order:
+
+      {'mode': 'add', 'quantity': delta, 'unit_price': <Decimal|None>, 'price_key': ...}
+      {'mode': 'set', 'quantity': absolute, 'unit_price': <Decimal|None>, 'price_key': ...}
+      {'mode': 'remove'}
+
+    A 'set' carrying a unit_price/price_key also reprices an existing line; a
+    plain 'set' only changes its quantity (like /api/cart/update/).
+    """
+    if not isinstance(operations, list) or not operations:
+        raise CartOperationError('operations must be a non-empty list')
+
+    effects = {}
+    for index, op in enumerate(operations):
+        if not isinstance(op, dict):
+            raise CartOperationError(f'operations[{index}] must be an object', index)
+        kind = (op.get('op') or '').strip().lower()
+        code = op.get('product_code')
+        if kind not in CART_OPS:
+            raise CartOperationError(f'operations[{index}]: op must be one of {", ".join(CART_OPS)}', index)
+        if not code:
+            raise CartOperationError(f'operations[{index}]: product_code is required', index)
+
+        if kind == 'remove':
+            effects[code] = {'mode': 'remove'}
+            continue
+
+        quantity = _parse_quantity(op.get('quantity', '1'), index)
+        unit_price = op.get('unit_price')
+        if unit_price is not None:
+            try:
+                unit_price = Decimal(str(unit_price))
+            except (InvalidOperation, TypeError, ValueError):
+                raise CartOperationError(f'operations[{index}]: invalid unit_price', index)
+        pricing = {'unit_price': unit_price, 'price_key': op.get('price_key'), 'reprice': True}
+        if kind == 'set' and unit_price is None and not op.get('price_key'):
+            pricing['reprice'] = False
+
+        prev = effects.get(code)
+        if kind == 'set':
+            effect = {'mode': 'set', 'quantity': quantity, **pricing}
+            if prev and prev['mode'] != 'remove' and not pricing['reprice'] and prev.get('reprice'):
+                # keep the price an earlier add/set in this batch asked for
+                effect.update(unit_price=prev['unit_price'], price_key=prev['price_key'], reprice=True)
+        elif prev is None:
+            effect = {'mode': 'add', 'quantity': quantity, **pricing}
+        elif prev['mode'] == 'remove':
+            effect = {'mode': 'set', 'quantity': quantity, **pricing}
+        else:
+            effect = {**prev, 'quantity': prev['quantity'] + quantity, **pricing}
+        effects[code] = effect
+
+    return effects
+
+
+def _upsert_lines(cursor, cart_id, rows, conflict_sql):
+    """Multi-row INSERT of (product_code, name, quantity, unit_price) with the given conflict action."""
+    if not rows:
+        return
+    table = CartItem._meta.db_table
+    values = ', '.join(['(%s, %s, %s, %s, %s, 0, 0)'] * len(rows))
+    params = []
+    for code, name, quantity, unit_price in rows:
+        params.extend([cart_id, code, name, quantity, unit_price])
+    cursor.execute(
+        f"INSERT INTO {table} "
+        f"(cart_id, product_code, product_name, quantity, unit_price, discount_pct, discounted_total) "
+        f"VALUES {values} "
+        f"ON CONFLICT (cart_id, product_code) DO UPDATE SET {conflict_sql.format(table=table)}",
+        params,
+    )
+
+
+def apply_operations(client_id, user_id, customer_name, operations, customer_phone='', customer_address=''):
+    """
+    Apply a batch of cart operations in one transaction with a constant number
+    of statements, whatever the number of lines. Returns the cart id (None if
+    the batch only removed lines from a cart that does not exist).
+    """
+    effects = fold_operations(operations)
+
+    priced = [code for code, eff in effects.items() if eff['mode'] != 'remove']
+    products = resolve_products(client_id, priced)
+    for code in priced:
+        product = products.get(code)
+        if product is None or not product['has_batch']:
+            raise CartOperationError(f'Product with code "{code}" not found in database', status=404)
+
+    def price_for(code, eff):
+        if eff['unit_price'] is not None:
+            return eff['unit_price']
+        return pick_unit_price(products[code]['prices'], eff['price_key'])
+
+    add_rows, set_repriced, set_rows, removed = [], [], [], []
+    for code, eff in effects.items():
+        if eff['mode'] == 'remove' or (eff['mode'] == 'set' and eff['quantity'] <= 0):
+            removed.append(code)
+            continue
+        row = (code, products[code]['name'], eff['quantity'], price_for(code, eff))
+        if eff['mode'] == 'add':
+            add_rows.append(row)
+        elif eff['reprice']:
+            set_repriced.append(row)
+        else:
+            set_rows.append(row)
+
+    alias = router.db_for_write(CartItem)
+    table = CartItem._meta.db_table
+    with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+        if add_rows or set_repriced or set_rows:
+            cart_id = upsert_cart(cursor, client_id, user_id, customer_name, customer_phone, customer_address)
+        else:
+            cursor.execute(
+                f"SELECT id FROM {Cart._meta.db_table} WHERE customer_name = %s AND user_id = %s AND client_id = %s",
+                [customer_name, user_id, client_id],
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cart_id = row[0]
+
+        _upsert_lines(cursor, cart_id, add_rows,
+                      "quantity = {table}.quantity + excluded.quantity, unit_price = excluded.unit_price, "
+                      "product_name = excluded.product_name")
+        _upsert_lines(cursor, cart_id, set_repriced,
+                      "quantity = excluded.quantity, unit_price = excluded.unit_price")
+        _upsert_lines(cursor, cart_id, set_rows, "quantity = excluded.quantity")
+
+        # explicit removals plus any line an add drove to zero or below
+        params = [cart_id]
+        condition = "quantity <= 0"
+        if removed:
+            condition += f" OR product_code IN ({', '.join(['%s'] * len(removed))})"
+            params.extend(removed)
+        cursor.execute(f"DELETE FROM {table} WHERE cart_id = %s AND ({condition})", params)
+        refresh_totals(cursor, cart_id)
+
+    return cart_id
+
+
+def remove_lines(cart_id, product_codes):
+    """Delete the given product lines from a cart in one statement; returns rows removed."""
+    alias = router.db_for_write(CartItem)
+    with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+        deleted = CartItem.objects.using(alias).filter(cart_id=cart_id, product_code__in=product_codes).delete()[0]
+        refresh_totals(cursor, cart_id)
+    return deleted
+
+
+def set_line_quantity(item_id, quantity, client_id=None):
+    """
+    Set the quantity of one cart line (optionally only if its cart belongs to
+    client_id) and refresh its cart totals. Returns the owning cart's
+    client_id, or None if the line does not exist.
+    """
+    alias = router.db_for_write(CartItem)
+    client_sql, params = "", [quantity, item_id]
+    if client_id is not None:
+        client_sql = f" AND cart_id IN (SELECT id FROM {Cart._meta.db_table} WHERE client_id = %s)"
+        params.append(client_id)
+    with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {CartItem._meta.db_table} SET quantity = %s WHERE id = %s{client_sql} RETURNING cart_id",
+            params,
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return refresh_totals(cursor, row[0])['client_id']
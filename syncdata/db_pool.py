@@ -0,0 +1,34 @@
+from django.db import connections
+
+# psycopg_pool counters reported as-is
+_COUNTERS = (
+    'pool_min', 'pool_max', 'pool_size', 'pool_available', 'requests_waiting',
+    'requests_num', 'requests_queued', 'requests_errors', 'connections_num', 'connections_lost',
+)
+
+
+def pool_stats():
+    """
+    Per-alias statistics of the connection pools in this worker process:
+    in_use / waiting right now, and cumulative checkout counts and latency.
+    Aliases without OPTIONS['pool'] (or not yet connected) are skipped.
+    """
+    stats = {}
+    for alias in connections:
+        if not connections.settings[alias].get('OPTIONS', {}).get('pool'):
+            continue
+        # DatabaseWrapper.pool would create the pool; look it up without doing so
+        pool = getattr(connections[alias], '_connection_pools', {}).get(alias)
+        if pool is None:
+            continue
+
+        raw = pool.get_stats()
+        entry = {key: raw.get(key, 0) for key in _COUNTERS}
+        entry['in_use'] = entry['pool_size'] - entry['pool_available']
+        # mean checkout latency over every request (queued ones add their wait time)
+        checkouts = raw.get('requests_num', 0)
+        entry['avg_wait_ms'] = round(raw.get('requests_wait_ms', 0) / checkouts, 2) if checkouts else 0.0
+        connects = raw.get('connections_num', 0)
+        entry['avg_connect_ms'] = round(raw.get('connections_ms', 0) / connects, 2) if connects else 0.0
+        stats[alias] = entry
+    return stats
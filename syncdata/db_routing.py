@@ -0,0 +1,82 @@
+"""
+Read-replica routing.
+
+Views wrapped with @replica_reads serve their GET/HEAD ORM reads from one of
+settings.REPLICA_DATABASES (one replica per request, so the request sees a
+single snapshot). The first write in such a request pins the rest of it to
+the primary, so it reads its own writes. Every other view, and every write,
+uses the primary. Raw SQL that picks its alias with router.db_for_read /
+db_for_write follows the same rules.
+"""
+import random
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+# Methods whose reads may go to a replica; anything else may write, and a
+# read before that write (e.g. an existence check) must see the primary.
+READ_METHODS = ('GET', 'HEAD')
+
+_request_state = ContextVar('replica_request_state', default=None)
+
+
+class _RequestState:
+    __slots__ = ('alias', 'pinned')
+
+    def __init__(self):
+        self.alias = None
+        self.pinned = False
+
+
+def replica_reads(view_func):
+    """Let the reads of a safe-method request to this view go to a replica."""
+    if iscoroutinefunction(view_func):
+        async def _view_wrapper(request, *args, **kwargs):
+            if request.method not in READ_METHODS:
+                return await view_func(request, *args, **kwargs)
+            token = _request_state.set(_RequestState())
+            try:
+                return await view_func(request, *args, **kwargs)
+            finally:
+                _request_state.reset(token)
+    else:
+        def _view_wrapper(request, *args, **kwargs):
+            if request.method not in READ_METHODS:
+                return view_func(request, *args, **kwargs)
+            token = _request_state.set(_RequestState())
+            try:
+                return view_func(request, *args, **kwargs)
+            finally:
+                _request_state.reset(token)
+    _view_wrapper.replica_reads = True
+    return wraps(view_func)(_view_wrapper)
+
+
+class ReplicaRouter:
+    """Sends reads inside @replica_reads requests to a replica until the request writes."""
+
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        if state is None or state.pinned or not settings.REPLICA_DATABASES:
+            return None
+        if state.alias is None:
+            state.alias = random.choice(settings.REPLICA_DATABASES)
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.pinned = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas are populated by replication, never migrated directly
+        if db in settings.REPLICA_DATABASES:
+            return False
+        return None
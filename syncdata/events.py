@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Events buffered per subscriber before it is considered stuck and told to resync
+QUEUE_SIZE = 100
+
+
+class Subscription:
+    """One SSE connection: an asyncio queue bound to the event loop serving it."""
+
+    def __init__(self, client_id, loop):
+        self.client_id = client_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.overflowed = False
+
+    def _deliver(self, event):
+        # runs on self.loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # drop the backlog and ask the client for a full refresh instead
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(('resync', {}))
+
+    async def get(self):
+        event = await self.queue.get()
+        self.overflowed = False
+        return event
+
+
+class Broker:
+    """
+    In-process fan-out of per-client notifications. publish() may be called
+    from any thread (sync views run in worker threads under ASGI); delivery is
+    handed to each subscriber's event loop. Only subscribers connected to this
+    worker process are reached: with several workers, a client misses the
+    events of changes served by the other workers. Run the events endpoint
+    with a single worker or treat events as a hint next to periodic reloads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)  # client_id -> {Subscription}
+
+    def subscribe(self, client_id):
+        subscription = Subscription(client_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers[client_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.client_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.client_id]
+
+    def publish(self, client_id, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(client_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._deliver, (event, data))
+            except RuntimeError:
+                # loop already closed; the connection is going away
+                self.unsubscribe(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clients': len(self._subscribers),
+                'subscribers': sum(len(subs) for subs in self._subscribers.values()),
+            }
+
+
+broker = Broker()
@@ -1,22 +1,44 @@
 import requests
 import logging
-from syncdata.models import ClientLicense
+import time as monotonic_time
+from collections import defaultdict
+from datetime import datetime, time
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.timezone import make_aware
+
+from syncdata.authentication import invalidate_client_principals, license_revisions
+from syncdata.models import ClientLicense, LicenseSyncState, TenantShard, new_license_revision
+from syncdata import sharding
 
 ACTIVATION_URL = "https://activate.imcbs.com/mobileapp/api/project/glassx/"
 
+# ClientLicense columns refreshed from the activation server
+LICENSE_FIELDS = ("license_key", "is_active", "expires_at")
+
 logger = logging.getLogger(__name__)
 
 
+class LicenseFetchError(Exception):
+    """The activation server could not be reached or returned no usable data."""
+
+
 def fetch_licenses_from_server():
+    """Customer entries from the activation server; raises LicenseFetchError."""
     try:
         response = requests.get(ACTIVATION_URL, timeout=5)
         data = response.json()
-        if data.get("success"):
-            return data.get("customers", [])
-        return []
     except Exception as e:
-        logger.error("Failed to fetch licenses from server: %s", e)
-        return []
+        raise LicenseFetchError(f"Failed to fetch licenses from server: {e}") from e
+    if not data.get("success"):
+        raise LicenseFetchError("Activation server reported failure")
+    customers = data.get("customers", [])
+    if not customers:
+        # never treat an empty answer as "every license was revoked"
+        raise LicenseFetchError("No customers returned from activation server")
+    return customers
 
 
 def validate_client_license(client_id):
@@ -29,54 +51,138 @@ def validate_client_license(client_id):
         return False, "No license found for this client"
 
 
-def sync_licenses_from_server():
-    from django.utils.dateparse import parse_date
-    from django.utils.timezone import make_aware
-    from datetime import datetime, time
-
-    customers = fetch_licenses_from_server()
-
-    if not customers:
-        logger.warning("No customers returned from activation server.")
-        return
-
-    valid_client_ids = []  # ✅ track valid clients from API
+def parse_license(customer):
+    """(client_id, {field: value}) for one activation server entry, or None if unusable."""
+    client_id = customer.get("client_id")
+    license_key = customer.get("license_key")
 
-    for customer in customers:
-        client_id = customer.get("client_id")
-        license_key = customer.get("license_key")
+    validity = customer.get("license_validity", {})
+    expiry_date = validity.get("expiry_date")
+    is_expired = validity.get("is_expired", True)
 
-        validity = customer.get("license_validity", {})
-        expiry_date = validity.get("expiry_date")
-        is_expired = validity.get("is_expired", True)
+    status = customer.get("status", "")
+    is_active = (status.strip().lower() == "active") and not is_expired
 
-        status = customer.get("status", "")
-        is_active = (status.strip().lower() == "active") and not is_expired
+    if not client_id or not license_key or not expiry_date:
+        logger.warning("Skipping customer entry with missing fields: %s", customer)
+        return None
 
-        if not client_id or not license_key or not expiry_date:
-            logger.warning("Skipping customer entry with missing fields: %s", customer)
-            continue
+    parsed_date = parse_date(expiry_date)
+    if not parsed_date:
+        logger.warning("Could not parse expiry_date '%s' for client_id=%s", expiry_date, client_id)
+        return None
 
-        parsed_date = parse_date(expiry_date)
-        if not parsed_date:
-            logger.warning("Could not parse expiry_date '%s' for client_id=%s", expiry_date, client_id)
-            continue
+    return client_id, {
+        "license_key": license_key,
+        "is_active": is_active,
+        "expires_at": make_aware(datetime.combine(parsed_date, time.max)),
+    }
 
-        parsed_expiry = make_aware(datetime.combine(parsed_date, time.max))
 
-        ClientLicense.objects.update_or_create(
-            client_id=client_id,
-            defaults={
-                "license_key": license_key,
-                "is_active": is_active,
-                "expires_at": parsed_expiry,
+def sync_licenses_from_server():
+    """
+    Mirror the activation server into client_licenses: one bulk upsert of the
+    rows that changed and one delete of the rows that do not belong there,
+    per database. A license lives only in its client's current database, so
+    the copy left behind by `move_tenant --keep-source` is removed too.
+    Returns (upserted, deleted).
+
+    Auth caches are per process: the invalidations below only reach the
+    process running the sync. Web workers see a change once their entries
+    expire (AUTH_CACHE_TTL / LICENSE_REVISION_TTL).
+    """
+    licenses = {}
+    for customer in fetch_licenses_from_server():
+        parsed = parse_license(customer)
+        if parsed:
+            licenses[parsed[0]] = parsed[1]
+
+    # read the placement fresh: a long-running refresher must not follow a stale shard map
+    placement = {}
+    if sharding.sharding_enabled():
+        placement = dict(TenantShard.objects.using(DEFAULT_DB_ALIAS).values_list('client_id', 'alias'))
+    by_alias = defaultdict(dict)
+    for client_id, values in licenses.items():
+        by_alias[placement.get(client_id, DEFAULT_DB_ALIAS)][client_id] = values
+
+    upserted = deleted = 0
+    for alias in sharding.database_aliases():
+        wanted = by_alias.get(alias, {})
+        with transaction.atomic(using=alias):
+            current = {
+                row["client_id"]: row
+                for row in ClientLicense.objects.using(alias).values("client_id", *LICENSE_FIELDS)
             }
+            changed = [
+                ClientLicense(client_id=client_id, revision=new_license_revision(), **values)
+                for client_id, values in wanted.items()
+                if client_id not in current
+                or any(current[client_id][field] != values[field] for field in LICENSE_FIELDS)
+            ]
+            if changed:
+                ClientLicense.objects.using(alias).bulk_create(
+                    changed,
+                    update_conflicts=True,
+                    unique_fields=["client_id"],
+                    update_fields=[*LICENSE_FIELDS, "revision", "updated_at"],
+                )
+            stale = [client_id for client_id in current if client_id not in wanted]
+            if stale:
+                ClientLicense.objects.using(alias).filter(client_id__in=stale).delete()
+
+        # bulk_create sends no post_save; deletes are covered by the signal too, but be explicit
+        # (this process only; see the docstring)
+        for client_id in [lic.client_id for lic in changed] + stale:
+            invalidate_client_principals(client_id)
+        upserted += len(changed)
+        deleted += len(stale)
+
+    if upserted or deleted:
+        license_revisions.expire()
+    logger.info("Licenses synced: %d listed, %d upserted, %d removed", len(licenses), upserted, deleted)
+    return upserted, deleted
+
+
+def refresh_licenses():
+    """
+    Run one license sync and record its outcome (time, duration, error) in
+    LicenseSyncState. Failures keep the existing rows. Returns the state row.
+    """
+    started_at = timezone.now()
+    started = monotonic_time.monotonic()
+    state, _ = LicenseSyncState.objects.using(DEFAULT_DB_ALIAS).get_or_create(pk=1)
+    try:
+        upserted, deleted = sync_licenses_from_server()
+    except Exception as e:
+        logger.error("License refresh failed: %s", e)
+        state.last_error = str(e)
+    else:
+        state.last_success_at = timezone.now()
+        state.last_error = ""
+        state.upserted = upserted
+        state.deleted = deleted
+        state.licenses = sum(
+            ClientLicense.objects.using(alias).count() for alias in sharding.database_aliases()
         )
-
-        valid_client_ids.append(client_id)  # ✅ add to valid list
-        logger.info("License synced for client_id=%s | active=%s | expires=%s", client_id, is_active, parsed_expiry)
-
-    # ✅ THIS IS THE KEY LINE - deletes anyone not in the API response
-    deleted, _ = ClientLicense.objects.exclude(client_id__in=valid_client_ids).delete()
-    if deleted:
-        logger.info("Removed %d stale licenses not in API response.", deleted)
\ No newline at end of file
+    state.last_attempt_at = started_at
+    state.last_duration_ms = int((monotonic_time.monotonic() - started) * 1000)
+    state.save(using=DEFAULT_DB_ALIAS)
+    return state
+
+
+def license_sync_status():
+    """Last refresh outcome, for the metrics endpoint (None before the first run)."""
+    state = LicenseSyncState.objects.using(DEFAULT_DB_ALIAS).filter(pk=1).first()
+    if state is None:
+        return None
+    age = (timezone.now() - state.last_success_at).total_seconds() if state.last_success_at else None
+    return {
+        "last_success_at": state.last_success_at,
+        "last_attempt_at": state.last_attempt_at,
+        "last_duration_ms": state.last_duration_ms,
+        "last_error": state.last_error or None,
+        "seconds_since_success": round(age) if age is not None else None,
+        "licenses": state.licenses,
+        "upserted": state.upserted,
+        "deleted": state.deleted,
+    }
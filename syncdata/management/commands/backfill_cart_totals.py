@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from syncdata import cart_store, sharding
+from syncdata.models import Cart
+
+
+class Command(BaseCommand):
+    help = "Recompute the maintained item_count / total_quantity / total_amount of every cart."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        refreshed = 0
+        for alias in sharding.database_aliases():
+            cart_ids = list(Cart.objects.using(alias).order_by('id').values_list('id', flat=True))
+            for start in range(0, len(cart_ids), batch_size):
+                with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                    for cart_id in cart_ids[start:start + batch_size]:
+                        cart_store.refresh_totals(cursor, cart_id)
+            refreshed += len(cart_ids)
+
+        self.stdout.write(self.style.SUCCESS(f"Refreshed totals for {refreshed} carts"))
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Closed-loop HTTP load test against a running server: N concurrent "
+        "clients replay a mix of the hot endpoints for a fixed time and report "
+        "throughput and latency. Run it once against the WSGI deployment and "
+        "once against ASGI with ASYNC_VIEWS=True to compare, e.g.\n"
+        "  gunicorn config.wsgi -w 4 --threads 8\n"
+        "  ASYNC_VIEWS=True uvicorn config.asgi:application --workers 4"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_url', help="e.g. http://127.0.0.1:8000")
+        parser.add_argument('--client-id', required=True)
+        parser.add_argument('--user-id', required=True)
+        parser.add_argument('--role', default='admin')
+        parser.add_argument('--product-code', required=True, help="A product with a batch, used for cart adds.")
+        parser.add_argument('--concurrency', type=int, default=200)
+        parser.add_argument('--duration', type=float, default=30.0, help="Seconds to run.")
+        parser.add_argument('--endpoints', default='cart,orders,products,add',
+                            help="Comma-separated mix of: cart, orders, products, add.")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['base_url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError("base_url must be http://host[:port]")
+
+        token = AccessToken()
+        token['user_id'] = options['user_id']
+        token['client_id'] = options['client_id']
+        token['role'] = options['role']
+
+        requests = self._requests(options, str(token))
+        mix = [requests[name] for name in options['endpoints'].split(',') if name in requests]
+        if not mix:
+            raise CommandError("No known endpoints in --endpoints")
+
+        results = asyncio.run(self._run(url.hostname, url.port or 80, mix, options))
+        self._report(results, options)
+
+    def _requests(self, options, token):
+        client, user = options['client_id'], options['user_id']
+        auth = {'Authorization': f'Bearer {token}'}
+        body = json.dumps({
+            'user_id': user, 'client_id': client, 'customer_name': 'Benchmark',
+            'product_code': options['product_code'], 'quantity': 1,
+        })
+        return {
+            'cart': ('GET', f'/api/cart/get/?user_id={user}&client_id={client}&customer_name=Benchmark', {}, None),
+            'orders': ('GET', '/api/orders/get/?per_page=20', auth, None),
+            'products': ('GET', '/products/', auth, None),
+            'add': ('POST', '/api/cart/add/', {'Content-Type': 'application/json'}, body),
+        }
+
+    async def _run(self, host, port, mix, options):
+        deadline = time.monotonic() + options['duration']
+        latencies, errors = [], []
+
+        async def worker(offset):
+            n = offset
+            while time.monotonic() < deadline:
+                method, path, headers, body = mix[n % len(mix)]
+                n += 1
+                started = time.monotonic()
+                try:
+                    status = await self._request(host, port, method, path, headers, body)
+                except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                    errors.append(type(e).__name__)
+                    continue
+                if status >= 400:
+                    errors.append(str(status))
+                    continue
+                latencies.append(time.monotonic() - started)
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker(i) for i in range(options['concurrency'])))
+        return latencies, errors, time.monotonic() - started
+
+    async def _request(self, host, port, method, path, headers, body):
+        """One HTTP/1.1 request on a fresh connection (Connection: close); returns the status code."""
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            payload = body.encode('utf-8') if body else b''
+            lines = [f'{method} {path} HTTP/1.1', f'Host: {host}', 'Connection: close',
+                     f'Content-Length: {len(payload)}']
+            lines += [f'{key}: {value}' for key, value in headers.items()]
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + payload)
+            await writer.drain()
+            status_line = await reader.readline()
+            status = int(status_line.split()[1])
+            await reader.read()  # drain headers and body until the server closes
+            return status
+        finally:
+            writer.close()
+
+    def _report(self, results, options):
+        latencies, errors, elapsed = results
+        done = len(latencies)
+        self.stdout.write(f"concurrency={options['concurrency']} duration={elapsed:.1f}s endpoints={options['endpoints']}")
+        self.stdout.write(f"requests ok: {done}  errors: {len(errors)}  throughput: {done / elapsed:.1f} req/s")
+        if latencies:
+            latencies.sort()
+            pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+            self.stdout.write(
+                f"latency ms: mean {statistics.mean(latencies) * 1000:.1f}  p50 {pct(0.50):.1f}  "
+                f"p95 {pct(0.95):.1f}  p99 {pct(0.99):.1f}  max {latencies[-1] * 1000:.1f}"
+            )
+        if errors:
+            counts = {}
+            for error in errors:
+                counts[error] = counts.get(error, 0) + 1
+            self.stdout.write(f"errors by kind: {counts}")
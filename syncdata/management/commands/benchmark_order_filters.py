@@ -0,0 +1,126 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from syncdata.models import Order
+from syncdata.paging import day_range
+
+BENCH_CLIENT = 'BENCH0'
+BENCH_USER = 'u0'
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic order table inside a transaction that is rolled back, "
+        "then print query plans for the order listing filters: the old "
+        "__date lookups without the composite indexes versus the half-open "
+        "ranges with them. Safe to run against a staging copy; nothing is kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1_000_000, help="Synthetic orders to seed.")
+        parser.add_argument('--clients', type=int, default=50, help="Distinct client_ids to spread orders over.")
+        parser.add_argument('--days', type=int, default=7, help="Width of the from_date..to_date window.")
+
+    def handle(self, *args, **options):
+        alias = router.db_for_write(Order)
+        connection = connections[alias]
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            self.stderr.write(f"Unsupported database vendor: {connection.vendor}")
+            return
+
+        with transaction.atomic(using=alias):
+            self.stdout.write(f"Seeding {options['orders']:,} orders on '{alias}' ({connection.vendor})...")
+            self._seed(connection, options['orders'], options['clients'])
+
+            to_day = timezone.localdate()
+            from_day = to_day - timedelta(days=options['days'] - 1)
+            from_date, to_date = from_day.isoformat(), to_day.isoformat()
+
+            self._drop_indexes(connection)
+            self._analyze(connection)
+            self.stdout.write(self.style.MIGRATE_HEADING("\nBEFORE: __date lookups, no composite indexes"))
+            self._report(alias, self._old_queries(from_date, to_date))
+
+            self._create_indexes(connection)
+            self._analyze(connection)
+            self.stdout.write(self.style.MIGRATE_HEADING("\nAFTER: half-open ranges, composite indexes"))
+            self._report(alias, self._new_queries(from_date, to_date))
+
+            transaction.set_rollback(True, using=alias)
+        self.stdout.write(self.style.SUCCESS("\nRolled back; no benchmark rows were kept."))
+
+    # ---------------- queries ----------------
+    def _old_queries(self, from_date, to_date):
+        dates = {'updated_at__date__gte': from_date, 'updated_at__date__lte': to_date}
+        return self._listing_queries(dates, {'created_at__date__gte': from_date, 'created_at__date__lte': to_date})
+
+    def _new_queries(self, from_date, to_date):
+        return self._listing_queries(
+            day_range('updated_at', from_date, to_date),
+            day_range('created_at', from_date, to_date),
+        )
+
+    def _listing_queries(self, updated, created):
+        orders = Order.objects.order_by('-updated_at', '-id')
+        return [
+            ("admin listing (client + date range)",
+             orders.filter(client_id=BENCH_CLIENT, **updated)[:20]),
+            ("rep listing (client + user + date range)",
+             orders.filter(client_id=BENCH_CLIENT, user_id=BENCH_USER, **updated)[:20]),
+            ("pending order list (client + status + date range)",
+             Order.objects.filter(client_id=BENCH_CLIENT, status='pending', **created).order_by('-created_at')[:20]),
+            ("listing count (client + date range)",
+             Order.objects.filter(client_id=BENCH_CLIENT, **updated).order_by().values('id')),
+        ]
+
+    def _report(self, alias, queries):
+        analyze = connections[alias].vendor == 'postgresql'
+        for label, queryset in queries:
+            self.stdout.write(f"\n-- {label}")
+            plan = queryset.using(alias).explain(analyze=True) if analyze else queryset.using(alias).explain()
+            self.stdout.write(plan)
+
+    # ---------------- setup ----------------
+    def _seed(self, connection, count, clients):
+        table = Order._meta.db_table
+        columns = "order_number, customer_name, total_amount, status, created_at, updated_at, user_id, client_id"
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    f"INSERT INTO {table} ({columns}) "
+                    f"SELECT 'BENCH-' || g, 'Customer ' || (g %% 5000), (g %% 1000)::numeric, "
+                    f"(ARRAY['pending', 'completed', 'cancelled'])[1 + g %% 3], "
+                    f"now() - (g %% 525600) * interval '1 minute', now() - (g %% 525600) * interval '1 minute', "
+                    f"'u' || (g %% 20), 'BENCH' || (g %% %s) "
+                    f"FROM generate_series(1, %s) AS g",
+                    [clients, count],
+                )
+            else:
+                cursor.execute(
+                    f"WITH RECURSIVE seq(g) AS (SELECT 1 UNION ALL SELECT g + 1 FROM seq WHERE g < %s) "
+                    f"INSERT INTO {table} ({columns}) "
+                    f"SELECT 'BENCH-' || g, 'Customer ' || (g %% 5000), g %% 1000, "
+                    f"CASE g %% 3 WHEN 0 THEN 'pending' WHEN 1 THEN 'completed' ELSE 'cancelled' END, "
+                    f"datetime('now', '-' || (g %% 525600) || ' minutes'), "
+                    f"datetime('now', '-' || (g %% 525600) || ' minutes'), "
+                    f"'u' || (g %% 20), 'BENCH' || (g %% %s) FROM seq",
+                    [count, clients],
+                )
+
+    def _drop_indexes(self, connection):
+        with connection.cursor() as cursor:
+            for index in Order._meta.indexes:
+                cursor.execute(f"DROP INDEX IF EXISTS {connection.ops.quote_name(index.name)}")
+
+    def _create_indexes(self, connection):
+        schema_editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for index in Order._meta.indexes:
+                cursor.execute(str(index.create_sql(Order, schema_editor)))
+
+    def _analyze(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {Order._meta.db_table}")
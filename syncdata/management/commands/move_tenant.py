@@ -0,0 +1,138 @@
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, transaction
+
+from syncdata import sharding
+from syncdata.models import TenantShard
+
+
+class Command(BaseCommand):
+    help = (
+        "Move one client's rows to another database (tenant shard) while the "
+        "service keeps running. The client's writes are paused (503 with "
+        "Retry-After) for the duration of the copy; its reads keep being served "
+        "from the old database, and other clients are not affected. Then the "
+        "shard map is switched and the old copy is deleted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('client_id')
+        parser.add_argument('target', help="Database alias to move to: 'default' or one of SHARD_DATABASES.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows read and inserted per round trip.")
+        parser.add_argument('--grace', type=float, default=None,
+                            help="Seconds to wait for every worker to see a shard map change "
+                                 "(default: SHARD_MAP_TTL + 2).")
+        parser.add_argument('--keep-source', action='store_true', help="Leave the old copy in place.")
+
+    def handle(self, *args, **options):
+        client_id = options['client_id'].strip()
+        target = options['target']
+        if not sharding.sharding_enabled():
+            raise CommandError("No shards configured (DB_SHARDS).")
+        if target not in sharding.database_aliases():
+            raise CommandError(f"Unknown database '{target}'; expected one of {sharding.database_aliases()}")
+
+        source = sharding.route_for(client_id, use_cache=False)[0]
+        if source == target:
+            raise CommandError(f"{client_id} is already on '{target}'")
+        grace = options['grace'] if options['grace'] is not None else settings.SHARD_MAP_TTL + 2
+        models = self._models()
+
+        self._set_route(client_id, source, read_only=True)
+        self.stdout.write(f"{client_id}: writes paused on '{source}'; waiting {grace:g}s for workers to notice...")
+        time.sleep(grace)
+
+        try:
+            counts = self._copy(client_id, source, target, models, options['chunk_size'])
+        except Exception as e:
+            self._set_route(client_id, source, read_only=False)
+            if isinstance(e, IntegrityError):
+                raise CommandError(
+                    f"Copy to '{target}' failed: {e}. Row ids must not collide between databases; "
+                    f"give each database its own id range before moving clients."
+                )
+            raise
+
+        self._set_route(client_id, target, read_only=False)
+        for model, count in counts.items():
+            self.stdout.write(f"  {model._meta.db_table}: {count}")
+        self.stdout.write(self.style.SUCCESS(f"{client_id}: now served from '{target}'"))
+
+        if options['keep_source']:
+            return
+        # readers that resolved the old route before the switch finish first
+        time.sleep(grace)
+        deleted = self._delete(client_id, source, models)
+        self.stdout.write(f"Deleted {deleted} rows of {client_id} from '{source}'")
+
+    def _models(self):
+        """Sharded models, parents before the child tables that reference them."""
+        models = [model for model in apps.get_app_config('syncdata').get_models() if sharding.is_sharded(model)]
+        return sorted(models, key=lambda model: model in sharding.CHILD_CLIENT_LOOKUPS)
+
+    def _set_route(self, client_id, alias, read_only):
+        TenantShard.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+            client_id=client_id, defaults={'alias': alias, 'read_only': read_only}
+        )
+        sharding.invalidate(client_id)
+
+    def _copy(self, client_id, source, target, models, chunk_size):
+        counts = {}
+        with transaction.atomic(using=target):
+            # leftovers of an earlier, interrupted move
+            self._delete_rows(client_id, target, models)
+            for model in models:
+                fields = model._meta.concrete_fields
+                rows = (
+                    model.objects.using(source)
+                    .filter(**sharding.client_filter(model, client_id))
+                    .order_by('pk')
+                    .values_list(*[field.attname for field in fields])
+                )
+                batch, counts[model] = [], 0
+                for row in rows.iterator(chunk_size=chunk_size):
+                    batch.append(row)
+                    if len(batch) == chunk_size:
+                        counts[model] += self._insert(target, model, batch)
+                        batch = []
+                if batch:
+                    counts[model] += self._insert(target, model, batch)
+
+            # rows were inserted with explicit ids; move the id sequences past them
+            connection = connections[target]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(sql)
+        return counts
+
+    def _insert(self, alias, model, rows):
+        """
+        Insert rows as stored, column for column. bulk_create() would run
+        pre_save() and stamp auto_now / auto_now_add fields with the time of
+        the move, rewriting the client's order and cart history.
+        """
+        connection = connections[alias]
+        fields = model._meta.concrete_fields
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(field.column) for field in fields)
+        placeholders = ', '.join(['%s'] * len(fields))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})",
+                [[field.get_db_prep_save(value, connection) for field, value in zip(fields, row)] for row in rows],
+            )
+        return len(rows)
+
+    def _delete(self, client_id, alias, models):
+        with transaction.atomic(using=alias):
+            return self._delete_rows(client_id, alias, models)
+
+    def _delete_rows(self, client_id, alias, models):
+        deleted = 0
+        for model in reversed(models):
+            deleted += model.objects.using(alias).filter(**sharding.client_filter(model, client_id)).delete()[0]
+        return deleted
@@ -0,0 +1,105 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils import timezone
+
+from syncdata import sharding, versioning
+from syncdata.models import Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete carts idle for longer than the TTL in small batches (one short "
+        "transaction per batch). Meant to run from cron, e.g. hourly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ttl-hours', type=int, default=getattr(settings, 'CART_TTL_HOURS', 168),
+            help="Carts not updated for this many hours are purged (default: CART_TTL_HOURS).",
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help="Carts deleted per transaction.")
+        parser.add_argument('--max-batches', type=int, default=0, help="Stop after this many batches (0 = no limit).")
+        parser.add_argument('--pause', type=float, default=0.1, help="Seconds to sleep between batches.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be purged.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['ttl_hours'])
+
+        if options['dry_run']:
+            count = items = 0
+            for alias in sharding.database_aliases():
+                count += Cart.objects.using(alias).filter(updated_at__lt=cutoff).count()
+                items += CartItem.objects.using(alias).filter(cart__updated_at__lt=cutoff).count()
+            self.stdout.write(f"Would purge {count} carts / {items} cart items idle since before {cutoff:%Y-%m-%d %H:%M}")
+            return
+
+        totals = {'batches': 0, 'carts': 0, 'items': 0, 'bytes': 0}
+        measure_bytes = any(
+            connections[alias].vendor == 'postgresql' for alias in sharding.database_aliases()
+        )
+
+        # every shard holds carts; max_batches caps the whole run
+        for alias in sharding.database_aliases():
+            if not self._purge(alias, cutoff, totals, options):
+                break
+
+        # logical row size; disk space is only reusable after VACUUM
+        deleted_bytes = f"{totals['bytes'] / 1024:.1f} KiB" if measure_bytes else "n/a"
+        self.stdout.write(self.style.SUCCESS(
+            f"Purged {totals['carts']} carts and {totals['items']} cart items "
+            f"in {totals['batches']} batches; approx. row bytes deleted: {deleted_bytes}"
+        ))
+
+    def _purge(self, alias, cutoff, totals, options):
+        """Purge one database in batches; returns False once --max-batches is reached."""
+        stale = Cart.objects.using(alias).filter(updated_at__lt=cutoff)
+        measure_bytes = connections[alias].vendor == 'postgresql'
+
+        while True:
+            with transaction.atomic(using=alias):
+                # skip carts a rep is touching right now; they are no longer stale anyway
+                batch = list(
+                    stale.select_for_update(skip_locked=True)
+                    .order_by('updated_at')
+                    .values_list('id', 'client_id')[:options['batch_size']]
+                )
+                if not batch:
+                    return True
+                cart_ids = [cart_id for cart_id, _ in batch]
+
+                if measure_bytes:
+                    totals['bytes'] += self._row_bytes(alias, cart_ids)
+
+                _, per_model = Cart.objects.using(alias).filter(id__in=cart_ids).delete()
+                totals['carts'] += per_model.get(Cart._meta.label, 0)
+                totals['items'] += per_model.get(CartItem._meta.label, 0)
+
+                for client_id in {client_id for _, client_id in batch}:
+                    # the version row lives in the client's shard
+                    with sharding.tenant(client_id):
+                        versioning.bump_version(client_id, versioning.CARTS)
+
+            totals['batches'] += 1
+            self.stdout.write(f"Batch {totals['batches']} on '{alias}': purged {len(cart_ids)} carts")
+            if options['max_batches'] and totals['batches'] >= options['max_batches']:
+                return False
+            if options['pause']:
+                time.sleep(options['pause'])
+
+    def _row_bytes(self, alias, cart_ids):
+        """Approximate data size (pg_column_size) of the cart and cart item rows about to be deleted (PostgreSQL only)."""
+        placeholders = ', '.join(['%s'] * len(cart_ids))
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                f"SELECT "
+                f"(SELECT COALESCE(SUM(pg_column_size(c.*)), 0) FROM {Cart._meta.db_table} c "
+                f"WHERE c.id IN ({placeholders})) + "
+                f"(SELECT COALESCE(SUM(pg_column_size(i.*)), 0) FROM {CartItem._meta.db_table} i "
+                f"WHERE i.cart_id IN ({placeholders}))",
+                cart_ids + cart_ids,
+            )
+            return int(cursor.fetchone()[0] or 0)
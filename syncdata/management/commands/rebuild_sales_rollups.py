@@ -0,0 +1,91 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from syncdata import rollups, sharding
+from syncdata.models import Order, OrderItem, SalesDailyCustomer, SalesDailyProduct, SalesDailyUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the daily sales rollups from orders / order_items. Use once "
+        "after deploying the rollup tables, or to repair drift after orders "
+        "were edited outside the API (e.g. in the admin)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client-id', help="Only rebuild this client (default: every client with orders).")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows read per database round trip.")
+
+    def handle(self, *args, **options):
+        rebuilt = 0
+        # each shard rebuilds the clients whose orders it holds
+        for alias in sharding.database_aliases():
+            orders = Order.objects.using(alias).order_by()
+            if options['client_id']:
+                orders = orders.filter(client_id=options['client_id'])
+            client_ids = list(orders.values_list('client_id', flat=True).distinct())
+
+            for client_id in client_ids:
+                with transaction.atomic(using=alias):
+                    counts = self._rebuild(alias, client_id, options['chunk_size'])
+                self.stdout.write(
+                    f"{client_id} ({alias}): {counts[0]} user-days, {counts[1]} product-days, "
+                    f"{counts[2]} customer-days"
+                )
+            rebuilt += len(client_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt sales rollups for {rebuilt} client(s)"))
+
+    def _rebuild(self, alias, client_id, chunk_size):
+        users = defaultdict(lambda: [0, Decimal('0'), Decimal('0')])
+        customers = defaultdict(lambda: [0, Decimal('0')])
+        products = defaultdict(lambda: [Decimal('0'), Decimal('0')])
+
+        orders = (
+            Order.objects.using(alias)
+            .filter(client_id=client_id)
+            .exclude(status__in=rollups.EXCLUDED_STATUSES)
+            .order_by()
+        )
+        for user_id, customer_name, created_at, total in orders.values_list(
+            'user_id', 'customer_name', 'created_at', 'total_amount'
+        ).iterator(chunk_size=chunk_size):
+            day = timezone.localdate(created_at)
+            users[(day, user_id)][0] += 1
+            users[(day, user_id)][2] += total or 0
+            customers[(day, customer_name)][0] += 1
+            customers[(day, customer_name)][1] += total or 0
+
+        lines = (
+            OrderItem.objects.using(alias)
+            .filter(order__client_id=client_id)
+            .exclude(order__status__in=rollups.EXCLUDED_STATUSES)
+            .order_by()
+            .values_list('order__user_id', 'order__created_at', 'product_code', 'quantity', 'total_price')
+        )
+        for user_id, created_at, code, qty, line_total in lines.iterator(chunk_size=chunk_size):
+            day = timezone.localdate(created_at)
+            users[(day, user_id)][1] += qty or 0
+            products[(day, code)][0] += qty or 0
+            products[(day, code)][1] += line_total or 0
+
+        for model in (SalesDailyUser, SalesDailyProduct, SalesDailyCustomer):
+            model.objects.using(alias).filter(client_id=client_id).delete()
+
+        SalesDailyUser.objects.using(alias).bulk_create([
+            SalesDailyUser(client_id=client_id, day=day, user_id=user_id,
+                           order_count=n, quantity=qty, total_amount=total)
+            for (day, user_id), (n, qty, total) in users.items()
+        ], batch_size=1000)
+        SalesDailyProduct.objects.using(alias).bulk_create([
+            SalesDailyProduct(client_id=client_id, day=day, product_code=code, quantity=qty, total_amount=total)
+            for (day, code), (qty, total) in products.items()
+        ], batch_size=1000)
+        SalesDailyCustomer.objects.using(alias).bulk_create([
+            SalesDailyCustomer(client_id=client_id, day=day, customer_name=name, order_count=n, total_amount=total)
+            for (day, name), (n, total) in customers.items()
+        ], batch_size=1000)
+        return len(users), len(products), len(customers)
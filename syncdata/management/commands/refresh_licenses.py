@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from syncdata.license_check import refresh_licenses
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh client_licenses from the activation server (bulk upsert of the "
+        "changed rows, delete of clients no longer listed). Run once from cron, "
+        "or with --loop as a long-running background process. Logins only read "
+        "the local table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep refreshing every --interval seconds.")
+        parser.add_argument(
+            '--interval', type=int, default=getattr(settings, 'LICENSE_REFRESH_SECONDS', 300),
+            help="Seconds between refreshes with --loop (default: LICENSE_REFRESH_SECONDS).",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            state = refresh_licenses()
+            if state.last_error:
+                self.stderr.write(f"License refresh failed after {state.last_duration_ms} ms: {state.last_error}")
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Licenses refreshed in {state.last_duration_ms} ms: {state.licenses} total, "
+                    f"{state.upserted} upserted, {state.deleted} removed"
+                ))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -1,3 +1,4 @@
+import time
 from decimal import Decimal
 from django.db import models
 from django.contrib.auth.models import User
@@ -126,6 +127,14 @@ class Order(models.Model):
     class Meta:
         db_table = 'orders'
         ordering = ['-created_at']
+        indexes = [
+            # get_orders: admin / level3 listing and date ranges
+            models.Index(fields=['client_id', 'updated_at'], name='orders_client_updated_idx'),
+            # get_orders: a rep's own orders
+            models.Index(fields=['client_id', 'user_id', 'updated_at'], name='orders_client_user_upd_idx'),
+            # status filters and the pending order list (newest first)
+            models.Index(fields=['client_id', 'status', 'created_at'], name='orders_client_status_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -147,6 +156,7 @@ class OrderItem(models.Model):
 
     class Meta:
         db_table = 'order_items'
+        unique_together = ('order', 'product_code')
 
 
 # ─── Cart Management ──────────────────────────────────────────────────────────
@@ -160,10 +170,18 @@ class Cart(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     user_id = models.CharField(max_length=30)
     client_id = models.CharField(max_length=50)
-    
+
+    # maintained by syncdata.cart_store in the same transaction as every line change
+    item_count = models.IntegerField(default=0)
+    total_quantity = models.DecimalField(max_digits=14, decimal_places=3, default=Decimal('0.000'))
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
     class Meta:
         db_table = 'carts'
         unique_together = ('customer_name', 'user_id', 'client_id')
+        indexes = [
+            models.Index(fields=['updated_at'], name='carts_updated_at_idx'),  # stale cart sweeper
+        ]
 
 
 class CartItem(models.Model):
@@ -186,8 +204,80 @@ class CartItem(models.Model):
         unique_together = ('cart', 'product_code')
 
 
+# ─── Change Tracking ──────────────────────────────────────────────────────────
+
+class DataVersion(models.Model):
+    """Per-client counter bumped on every write to a data scope (customers, carts, orders)."""
+    client_id = models.CharField(max_length=50)
+    scope = models.CharField(max_length=20)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'data_versions'
+        unique_together = ('client_id', 'scope')
+
+
+class OrderTombstone(models.Model):
+    """Record of a deleted order, so incremental feeds can tell clients to drop it."""
+    order_id = models.IntegerField()
+    order_number = models.CharField(max_length=50)
+    client_id = models.CharField(max_length=50)
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'order_tombstones'
+        indexes = [
+            models.Index(fields=['client_id', 'deleted_at', 'id'], name='tombstones_client_deleted_idx'),
+        ]
+
+
+# ─── Sales Rollups ────────────────────────────────────────────────────────────
+# Maintained by syncdata.rollups in the same transaction as every order write;
+# cancelled orders are excluded. `day` is the local order date (created_at).
+
+class SalesDailyUser(models.Model):
+    client_id = models.CharField(max_length=50)
+    day = models.DateField()
+    user_id = models.CharField(max_length=30)
+    order_count = models.IntegerField(default=0)
+    quantity = models.DecimalField(max_digits=16, decimal_places=3, default=Decimal('0.000'))
+    total_amount = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        db_table = 'sales_daily_users'
+        unique_together = ('client_id', 'day', 'user_id')
+
+
+class SalesDailyProduct(models.Model):
+    client_id = models.CharField(max_length=50)
+    day = models.DateField()
+    product_code = models.CharField(max_length=30)
+    quantity = models.DecimalField(max_digits=16, decimal_places=3, default=Decimal('0.000'))
+    total_amount = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        db_table = 'sales_daily_products'
+        unique_together = ('client_id', 'day', 'product_code')
+
+
+class SalesDailyCustomer(models.Model):
+    client_id = models.CharField(max_length=50)
+    day = models.DateField()
+    customer_name = models.CharField(max_length=250)
+    order_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        db_table = 'sales_daily_customers'
+        unique_together = ('client_id', 'day', 'customer_name')
+
+
 # ─── Licensing ────────────────────────────────────────────────────────────────
 
+def new_license_revision():
+    return time.time_ns() // 1_000_000
+
 class ClientLicense(models.Model):
     client_id = models.CharField(max_length=50, unique=True)
     license_key = models.CharField(max_length=100, unique=True)
@@ -195,13 +285,49 @@ class ClientLicense(models.Model):
     expires_at = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # changes on every write (epoch ms); tokens issued in stateless auth mode carry it as lic_rev
+    revision = models.BigIntegerField(default=0)
 
     class Meta:
         db_table = 'client_licenses'
 
+    def save(self, *args, **kwargs):
+        self.revision = new_license_revision()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'revision'}
+        super().save(*args, **kwargs)
+
     def is_valid(self):
         from django.utils import timezone
         return self.is_active and self.expires_at > timezone.now()
 
     def __str__(self):
-        return f"{self.client_id} — {'✅ Active' if self.is_valid() else '❌ Expired/Inactive'}"
\ No newline at end of file
+        return f"{self.client_id} — {'✅ Active' if self.is_valid() else '❌ Expired/Inactive'}"
+
+
+class LicenseSyncState(models.Model):
+    """Outcome of the last license refresh (`manage.py refresh_licenses`); a single row, pk=1."""
+    last_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_success_at = models.DateTimeField(null=True, blank=True)
+    last_duration_ms = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    licenses = models.IntegerField(default=0)
+    upserted = models.IntegerField(default=0)
+    deleted = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'license_sync_state'
+
+# ─── Tenant Shards ────────────────────────────────────────────────────────────
+
+class TenantShard(models.Model):
+    """Database alias holding a client's rows (see syncdata.sharding); clients without a row use 'default'."""
+    client_id = models.CharField(max_length=50, unique=True)
+    alias = models.CharField(max_length=50, default='default')
+    # set by `manage.py move_tenant` while the client's rows are copied; writes get 503
+    read_only = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'tenant_shards'
@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from syncdata import paging
+from syncdata.models import Order, OrderItem, OrderTombstone
+
+# A watermark is "<orders position>.<tombstones position>"; either part may be
+# empty (start of that stream). Positions are paging cursors, which never
+# contain '.'.
+SEPARATOR = '.'
+
+
+def split_watermark(token):
+    """(orders cursor, tombstones cursor) of a watermark; raises paging.InvalidCursor."""
+    if not token:
+        return '', ''
+    parts = token.split(SEPARATOR)
+    if len(parts) != 2:
+        raise paging.InvalidCursor('Invalid watermark')
+    for part in parts:
+        if part:
+            paging.decode_cursor(part)
+    return parts[0], parts[1]
+
+
+def _advance(rows, field, current):
+    if not rows:
+        return current
+    last = rows[-1]
+    return paging.encode_cursor(getattr(last, field), last.id)
+
+
+def changes_since(client_id, since, limit=None):
+    """
+    Orders created or changed, and orders deleted, after the `since`
+    watermark for one client, oldest first on (updated_at, id) /
+    (deleted_at, id). Rows newer than ORDER_FEED_LAG_SECONDS are held back
+    so a transaction that commits late with an earlier timestamp is still
+    picked up by the next poll.
+
+    Returns (orders, tombstones, watermark, has_more). Passing `watermark`
+    back as `since` resumes exactly after the last row returned.
+    """
+    limit = limit or settings.ORDER_FEED_PAGE_SIZE
+    orders_cursor, tombstones_cursor = split_watermark(since)
+    horizon = timezone.now() - timedelta(seconds=settings.ORDER_FEED_LAG_SECONDS)
+
+    orders_qs = (
+        Order.objects.filter(client_id=client_id, updated_at__lt=horizon)
+        .order_by('updated_at', 'id')
+        .prefetch_related(Prefetch('items', queryset=OrderItem.objects.order_by('id')))
+    )
+    orders = list(paging.after_cursor(orders_qs, orders_cursor, 'updated_at', descending=False)[:limit + 1])
+
+    tombstones_qs = (
+        OrderTombstone.objects.filter(client_id=client_id, deleted_at__lt=horizon)
+        .order_by('deleted_at', 'id')
+    )
+    tombstones = list(
+        paging.after_cursor(tombstones_qs, tombstones_cursor, 'deleted_at', descending=False)[:limit + 1]
+    )
+
+    has_more = len(orders) > limit or len(tombstones) > limit
+    orders, tombstones = orders[:limit], tombstones[:limit]
+    watermark = SEPARATOR.join([
+        _advance(orders, 'updated_at', orders_cursor),
+        _advance(tombstones, 'deleted_at', tombstones_cursor),
+    ])
+    return orders, tombstones, watermark, has_more
@@ -0,0 +1,398 @@
+import logging
+from decimal import Decimal
+
+from django.db import connections, router, transaction
+from django.db.models import Count, DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from syncdata import rollups
+from syncdata.models import CartItem, Order, OrderItem, OrderTombstone
+
+logger = logging.getLogger(__name__)
+
+# Orders in these statuses can no longer be edited or deleted
+LOCKED_STATUSES = ('completed',)
+# Bulk status changes leave orders in these statuses as they are
+FINAL_STATUSES = ('completed', 'cancelled')
+
+
+class OrderNotFound(Exception):
+    """The order or order item does not exist."""
+
+
+class OrderLocked(Exception):
+    """The order is completed and cannot be modified."""
+
+
+class InvalidOrderId(ValueError):
+    """An order id is missing or not an integer."""
+
+
+def parse_order_id(value):
+    """int order id from request data; raises InvalidOrderId."""
+    if isinstance(value, bool):
+        raise InvalidOrderId(value)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise InvalidOrderId(value)
+
+
+# ---------------- listing ----------------
+ORDER_LIST_FIELDS = (
+    'id', 'order_number', 'customer_name', 'customer_phone', 'customer_address',
+    'total_amount', 'status', 'created_at', 'updated_at', 'user_id',
+)
+ITEM_LIST_FIELDS = ('order_id', 'id', 'product_code', 'product_name', 'quantity', 'unit_price', 'total_price')
+
+
+def with_item_stats(queryset):
+    """
+    values() rows of ORDER_LIST_FIELDS plus item_count / total_quantity,
+    computed in SQL by correlated subqueries (only evaluated for the rows
+    actually fetched, and ignored by COUNT(*)).
+    """
+    lines = OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+    zero = Value(Decimal('0'), output_field=DecimalField(max_digits=14, decimal_places=3))
+    return queryset.values(*ORDER_LIST_FIELDS).annotate(
+        item_count=Coalesce(Subquery(lines.annotate(n=Count('id')).values('n')), 0),
+        total_quantity=Coalesce(Subquery(lines.annotate(q=Sum('quantity')).values('q')), zero),
+    )
+
+
+def _items_query(order_ids):
+    return OrderItem.objects.filter(order_id__in=order_ids).order_by('order_id', 'id').values_list(*ITEM_LIST_FIELDS)
+
+
+def items_by_order(order_ids):
+    """All lines of the given orders in one query, as {order_id: [row tuple, ...]} ordered by id."""
+    grouped = {order_id: [] for order_id in order_ids}
+    if not order_ids:
+        return grouped
+    for row in _items_query(order_ids):
+        grouped[row[0]].append(row)
+    return grouped
+
+
+async def aitems_by_order(order_ids):
+    """Async items_by_order."""
+    grouped = {order_id: [] for order_id in order_ids}
+    if not order_ids:
+        return grouped
+    async for row in _items_query(order_ids):
+        grouped[row[0]].append(row)
+    return grouped
+
+
+def cart_lines(cart_id, ratio):
+    """
+    Read a cart's lines in one query and price them for an order:
+    (product_code, product_name, quantity, unit_price, discounted line total).
+    """
+    lines = []
+    rows = CartItem.objects.filter(cart_id=cart_id).values_list(
+        'product_code', 'product_name', 'quantity', 'unit_price'
+    )
+    for code, name, qty, price in rows:
+        qty = qty or Decimal('0')
+        price = price or Decimal('0')
+        orig_total = (qty * price).quantize(Decimal('0.01'))
+        discounted = (orig_total * (Decimal('1') - ratio)).quantize(Decimal('0.01'))
+        lines.append((code, name, qty, price, discounted))
+    return lines
+
+
+def merge_lines(cursor, order_id, lines, discount_pct):
+    """
+    Merge priced lines into an order with one multi-row upsert keyed by
+    (order, product_code): quantities and line totals add up, the latest
+    unit price and discount win.
+    """
+    if not lines:
+        return
+    table = OrderItem._meta.db_table
+    values = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(lines))
+    params = []
+    for code, name, qty, price, total in lines:
+        params.extend([order_id, code, name, qty, price, discount_pct, total])
+    cursor.execute(
+        f"INSERT INTO {table} "
+        f"(order_id, product_code, product_name, quantity, unit_price, discount_pct, total_price) "
+        f"VALUES {values} "
+        f"ON CONFLICT (order_id, product_code) DO UPDATE SET "
+        f"quantity = {table}.quantity + excluded.quantity, "
+        f"unit_price = excluded.unit_price, "
+        f"discount_pct = excluded.discount_pct, "
+        f"total_price = {table}.total_price + excluded.total_price",
+        params,
+    )
+
+
+def refresh_total(cursor, order_id):
+    """Set an order's total_amount to the SQL sum of its line totals; returns the new total."""
+    table = Order._meta.db_table
+    items = OrderItem._meta.db_table
+    cursor.execute(
+        f"UPDATE {table} SET total_amount = ("
+        f"SELECT COALESCE(SUM(total_price), 0) FROM {items} WHERE order_id = {table}.id"
+        f"), updated_at = %s WHERE id = %s RETURNING total_amount",
+        [timezone.now(), order_id],
+    )
+    row = cursor.fetchone()
+    return Decimal(str(row[0])).quantize(Decimal('0.01')) if row else None
+
+
+def _header(order):
+    return tuple(getattr(order, field) for field in rollups.HEADER_FIELDS)
+
+
+def place_from_cart(order, cart, discount_pct, ratio, new_order=False):
+    """
+    Move every line of `cart` into `order` and delete the cart, with a fixed
+    number of queries whatever the line count. Must run inside a transaction
+    (with `order` locked if it already existed). Returns the order's new
+    total_amount.
+    """
+    lines = cart_lines(cart.id, ratio)
+    old_total = order.total_amount or Decimal('0')
+    with connections[router.db_for_write(OrderItem)].cursor() as cursor:
+        merge_lines(cursor, order.id, lines, discount_pct)
+        total = refresh_total(cursor, order.id)
+        if rollups.counts(order.status):
+            rollups.record(
+                cursor, _header(order),
+                orders=1 if new_order else 0,
+                quantity=sum((qty for _, _, qty, _, _ in lines), Decimal('0')),
+                amount=total - old_total,
+                products=[(code, qty, line_total) for code, _, qty, _, line_total in lines],
+            )
+    cart.delete()
+    return total
+
+
+# ---------------- single-order mutations ----------------
+def _from_db(connection, model, names, values):
+    """Convert raw cursor values the way the ORM would (SQLite hands back text datetimes and floats)."""
+    row = {}
+    for name, value in zip(names, values):
+        col = model._meta.get_field(name).get_col(model._meta.db_table)
+        for converter in connection.ops.get_db_converters(col) + col.get_db_converters(connection):
+            value = converter(value, col, connection)
+        row[name] = value
+    return row
+
+
+# What _shift_for_item returns, in this order
+SHIFT_ORDER_FIELDS = ('id', 'status', *rollups.HEADER_FIELDS, 'total_amount')
+SHIFT_LINE_FIELDS = ('product_code', 'quantity', 'total_price')
+
+
+def _shift_for_item(connection, cursor, item_id, client_id, line_total_sql, params):
+    """
+    Add (line_total_sql - the line's current total_price) to the total of the
+    order holding line item_id, in one UPDATE that locks the order row first,
+    like every other order write. RETURNING carries the order's status, rollup
+    header and new total plus the line's product_code, quantity and
+    total_price as the UPDATE read them. Raises OrderNotFound (also when the
+    order is not client_id's) or OrderLocked; callers run inside a transaction,
+    so raising undoes the shift. Returns (order row, line row, raw line values).
+    """
+    items = OrderItem._meta.db_table
+    line_sql = f"FROM {items} WHERE id = %s"
+    client_sql, client_params = (" AND client_id = %s", [client_id]) if client_id is not None else ("", [])
+    cursor.execute(
+        f"UPDATE {Order._meta.db_table} SET total_amount = total_amount + "
+        f"(SELECT {line_total_sql} - COALESCE(total_price, 0) {line_sql}), updated_at = %s "
+        f"WHERE id = (SELECT order_id {line_sql}){client_sql} "
+        f"RETURNING {', '.join(SHIFT_ORDER_FIELDS)}, (SELECT product_code {line_sql}), "
+        f"(SELECT COALESCE(quantity, 0) {line_sql}), (SELECT COALESCE(total_price, 0) {line_sql})",
+        [*params, item_id, timezone.now(), item_id, *client_params, item_id, item_id, item_id],
+    )
+    row = cursor.fetchone()
+    if row is None:
+        raise OrderNotFound
+    split = len(SHIFT_ORDER_FIELDS)
+    order = _from_db(connection, Order, SHIFT_ORDER_FIELDS, row[:split])
+    if order['status'] in LOCKED_STATUSES:
+        raise OrderLocked
+    return order, _from_db(connection, OrderItem, SHIFT_LINE_FIELDS, row[split:]), row[split + 1:]
+
+
+def _edit_item(item_id, client_id, line_total_sql, params, apply):
+    """
+    Shared by update_item and delete_item: shift the order total by the line's
+    change, then run `apply(cursor, raw quantity, raw total_price)`, one
+    statement conditioned on the line still holding the values the shift read,
+    which returns the line's new (quantity, total_price) or None if it matched
+    nothing. Two statements, plus the rollup upserts when the order counts.
+
+    On PostgreSQL the shift's subqueries read the statement snapshot, so if it
+    waited on the order lock behind another edit of the same line it saw the
+    line as it was before; apply then misses, and a second shift (now under
+    the lock, with a fresh snapshot) swaps the stale line total for the
+    current one before applying again.
+    """
+    alias = router.db_for_write(OrderItem)
+    connection = connections[alias]
+    with transaction.atomic(using=alias), connection.cursor() as cursor:
+        order, line, raw = _shift_for_item(connection, cursor, item_id, client_id, line_total_sql, params)
+        while (new := apply(cursor, *raw)) is None:
+            order, line, raw = _shift_for_item(connection, cursor, item_id, client_id, '%s', [raw[1]])
+        if rollups.counts(order['status']):
+            qty_delta, amount_delta = new[0] - line['quantity'], new[1] - line['total_price']
+            rollups.record(cursor, tuple(order[field] for field in rollups.HEADER_FIELDS),
+                           quantity=qty_delta, amount=amount_delta,
+                           products=[(line['product_code'], qty_delta, amount_delta)])
+    return {'order_id': order['id'], 'client_id': order['client_id'], 'total_amount': order['total_amount']}
+
+
+def update_item(item_id, quantity, client_id=None):
+    """
+    Change one line's quantity (optionally only on client_id's orders) and
+    shift the order total by the line delta: two statements whatever the
+    order size (see _edit_item). Line totals are rounded to 2dp in SQL.
+    Returns {'order_id', 'client_id', 'total_amount'}.
+    """
+    line_total_sql = "ROUND(COALESCE(unit_price, 0) * %s, 2)"
+
+    def apply(cursor, old_quantity, old_total):
+        cursor.execute(
+            f"UPDATE {OrderItem._meta.db_table} SET quantity = %s, total_price = {line_total_sql} "
+            f"WHERE id = %s AND COALESCE(quantity, 0) = %s AND COALESCE(total_price, 0) = %s "
+            f"RETURNING total_price",
+            [quantity, quantity, item_id, old_quantity, old_total],
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return quantity, _from_db(cursor.db, OrderItem, ['total_price'], row)['total_price']
+
+    return _edit_item(item_id, client_id, line_total_sql, [quantity], apply)
+
+
+def delete_item(item_id, client_id=None):
+    """Delete one line and subtract it from the order total. Scoped, costed and returns like update_item."""
+    def apply(cursor, old_quantity, old_total):
+        cursor.execute(
+            f"DELETE FROM {OrderItem._meta.db_table} "
+            f"WHERE id = %s AND COALESCE(quantity, 0) = %s AND COALESCE(total_price, 0) = %s",
+            [item_id, old_quantity, old_total],
+        )
+        return (Decimal('0'), Decimal('0')) if cursor.rowcount else None
+
+    return _edit_item(item_id, client_id, '0', [], apply)
+
+
+def _lock_orders(alias, order_ids, client_id=None):
+    """Lock orders and return {id: {'status', 'total_amount', 'header'}} for those that exist."""
+    # id order, so concurrent bulk updates lock overlapping orders in the same order
+    qs = Order.objects.using(alias).select_for_update().filter(id__in=order_ids).order_by('id')
+    if client_id is not None:
+        qs = qs.filter(client_id=client_id)
+    locked = {}
+    for row in qs.values('id', 'status', 'total_amount', *rollups.HEADER_FIELDS):
+        row['header'] = tuple(row[field] for field in rollups.HEADER_FIELDS)
+        locked[row.pop('id')] = row
+    return locked
+
+
+def _rollup_status_change(cursor, order_id, row, new_status):
+    """Add or remove an order's sales when a status change crosses EXCLUDED_STATUSES."""
+    was, now = rollups.counts(row['status']), rollups.counts(new_status)
+    if was != now:
+        rollups.record_order(cursor, order_id, row['header'], row['total_amount'], 1 if now else -1)
+
+
+def _apply_status(alias, cursor, order_ids, status, client_id=None, final=()):
+    """
+    Shared by set_status and bulk_set_status: lock the orders, then move them
+    to `status` in one UPDATE. With `final`, its WHERE clause carries the
+    transition rule (orders in those statuses keep their status). The locking
+    read supplies each row's previous status, total and rollup header, which
+    RETURNING cannot, and tells 'locked' from 'not_found'.
+    Returns ({order_id: 'updated' | 'locked' | 'not_found'}, locked rows).
+    """
+    existing = _lock_orders(alias, order_ids, client_id)
+    updated = set()
+    if existing:
+        ids = list(existing)
+        params = [status, timezone.now(), *ids]
+        client_sql = guard_sql = ""
+        if client_id is not None:
+            client_sql = "client_id = %s AND "
+            params.insert(2, client_id)
+        if final:
+            guard_sql = f" AND (status NOT IN ({', '.join(['%s'] * len(final))}) OR status = %s)"
+            params.extend([*final, status])
+        cursor.execute(
+            f"UPDATE {Order._meta.db_table} SET status = %s, updated_at = %s "
+            f"WHERE {client_sql}id IN ({', '.join(['%s'] * len(ids))}){guard_sql} "
+            f"RETURNING id",
+            params,
+        )
+        updated = {row[0] for row in cursor.fetchall()}
+        for order_id in sorted(updated):
+            _rollup_status_change(cursor, order_id, existing[order_id], status)
+    results = {
+        order_id: 'updated' if order_id in updated else 'locked' if order_id in existing else 'not_found'
+        for order_id in order_ids
+    }
+    return results, existing
+
+
+def set_status(order_id, status, client_id=None):
+    """
+    Set an order's status (optionally only if it belongs to client_id) and
+    keep the sales rollups in step. Any transition is allowed, as before the
+    bulk endpoint; staff use it to reopen cancelled orders. Returns its
+    client_id; raises InvalidOrderId or OrderNotFound.
+    """
+    order_id = parse_order_id(order_id)
+    alias = router.db_for_write(Order)
+    with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+        results, existing = _apply_status(alias, cursor, [order_id], status, client_id)
+    if results[order_id] == 'not_found':
+        raise OrderNotFound
+    return existing[order_id]['header'][0]
+
+
+def bulk_set_status(client_id, order_ids, status):
+    """
+    Move many of a client's orders to `status` in one UPDATE. Orders in
+    FINAL_STATUSES keep their status ('locked'); the rule is enforced in the
+    UPDATE's WHERE clause. Raises InvalidOrderId.
+    Returns {order_id: 'updated' | 'locked' | 'not_found'}.
+    """
+    order_ids = list(dict.fromkeys(parse_order_id(order_id) for order_id in order_ids))
+    if not order_ids:
+        return {}
+    alias = router.db_for_write(Order)
+    with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+        return _apply_status(alias, cursor, order_ids, status, client_id, final=FINAL_STATUSES)[0]
+
+
+def delete_order(order_id, client_id=None):
+    """
+    Delete a non-completed order (optionally only if it belongs to client_id)
+    and its lines, leaving a tombstone for the order feed. Returns its
+    client_id; raises OrderNotFound or OrderLocked.
+    """
+    alias = router.db_for_write(Order)
+    qs = Order.objects.using(alias).select_for_update().filter(id=order_id)
+    if client_id is not None:
+        qs = qs.filter(client_id=client_id)
+    with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+        row = qs.values('status', 'order_number', 'total_amount', *rollups.HEADER_FIELDS).first()
+        if row is None:
+            raise OrderNotFound
+        client_id, status, order_number = row['client_id'], row['status'], row['order_number']
+        if status in LOCKED_STATUSES:
+            raise OrderLocked
+        if rollups.counts(status):
+            header = tuple(row[field] for field in rollups.HEADER_FIELDS)
+            rollups.record_order(cursor, order_id, header, row['total_amount'], -1)
+        cursor.execute(f"DELETE FROM {OrderItem._meta.db_table} WHERE order_id = %s", [order_id])
+        cursor.execute(f"DELETE FROM {Order._meta.db_table} WHERE id = %s", [order_id])
+        OrderTombstone.objects.using(alias).create(order_id=order_id, order_number=order_number, client_id=client_id)
+    return client_id
@@ -0,0 +1,130 @@
+import base64
+import json
+from datetime import datetime, time, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from syncdata.cache import BoundedCache
+
+# (client_id, scope version, filter key) -> exact row count. The data version
+# is part of the key, so any write makes old entries unreachable.
+count_cache = BoundedCache('list_counts', maxsize=2000)
+
+
+class InvalidCursor(ValueError):
+    """A pagination cursor could not be decoded."""
+
+
+class InvalidDate(ValueError):
+    """A YYYY-MM-DD filter value could not be parsed."""
+
+
+def encode_cursor(value, pk):
+    """Opaque, URL-safe token for a (datetime, id) keyset position."""
+    raw = json.dumps({'t': value.isoformat(), 'i': pk}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; raises InvalidCursor."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        value = parse_datetime(data['t'])
+        pk = int(data['i'])
+    except (ValueError, TypeError, KeyError, UnicodeError):
+        raise InvalidCursor('Invalid cursor')
+    if value is None:
+        raise InvalidCursor('Invalid cursor')
+    return value, pk
+
+
+def _get(row, name):
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+
+def after_cursor(queryset, token, field, descending=True):
+    """Restrict a queryset ordered by (field, id) to rows strictly after the cursor position."""
+    if not token:
+        return queryset
+    value, pk = decode_cursor(token)
+    op = 'lt' if descending else 'gt'
+    return queryset.filter(Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'id__{op}': pk}))
+
+
+def _page_with_cursor(rows, per_page, field):
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(_get(rows[-1], field), _get(rows[-1], 'id'))
+    return rows, next_cursor
+
+
+def keyset_page(queryset, token, per_page, field, descending=True):
+    """
+    One page of a queryset already ordered by (field, id) in the given
+    direction. Costs a single indexed range scan however deep the page is.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    rows = list(after_cursor(queryset, token, field, descending)[:per_page + 1])
+    return _page_with_cursor(rows, per_page, field)
+
+
+async def akeyset_page(queryset, token, per_page, field, descending=True):
+    """Async keyset_page."""
+    rows = [row async for row in after_cursor(queryset, token, field, descending)[:per_page + 1]]
+    return _page_with_cursor(rows, per_page, field)
+
+
+def cached_count(queryset, client_id, version, key):
+    """COUNT(*) of queryset, reused until the client's data version changes."""
+    cache_key = (client_id, version, key)
+    count = count_cache.get(cache_key)
+    if count is None:
+        count = queryset.count()
+        count_cache.set(cache_key, count)
+    return count
+
+
+async def acached_count(queryset, client_id, version, key):
+    """Async cached_count."""
+    cache_key = (client_id, version, key)
+    count = count_cache.get(cache_key)
+    if count is None:
+        count = await queryset.acount()
+        count_cache.set(cache_key, count)
+    return count
+
+
+def parse_day(value):
+    """date for a YYYY-MM-DD string; raises InvalidDate."""
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise InvalidDate(f'Invalid date: {value}')
+    return day
+
+
+def _midnight(day):
+    """Aware datetime for the start of day in the current time zone."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def day_range(field, from_date=None, to_date=None):
+    """
+    Filter kwargs for whole local days from_date..to_date (inclusive) as a
+    half-open range on the raw column: field >= start of from_date and
+    field < start of the day after to_date. Unlike field__date lookups this
+    keeps the column bare, so a (..., field) index can serve it.
+    Raises InvalidDate for values that are not YYYY-MM-DD.
+    """
+    lookups = {}
+    if from_date:
+        lookups[f'{field}__gte'] = _midnight(parse_day(from_date))
+    if to_date:
+        lookups[f'{field}__lt'] = _midnight(parse_day(to_date) + timedelta(days=1))
+    return lookups
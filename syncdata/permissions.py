@@ -7,6 +7,19 @@ class TokenOnlyPermission(BasePermission):
     Allows access only if a valid token is present.
     """
 
+# NOTE: module-level, so TokenOnlyPermission keeps BasePermission's allow-all
+# check; the ERP pull and app views rely on that. New endpoints that need a
+# token use ClientTokenPermission.
 def has_permission(self, request, view):
     token = request.auth
     return isinstance(token, dict) and 'user_id' in token and 'client_id' in token
+
+
+class ClientTokenPermission(BasePermission):
+    """
+    Allows access only if a valid token carrying user_id and client_id is present.
+    """
+
+    def has_permission(self, request, view):
+        token = request.auth
+        return token is not None and bool(token.get('user_id')) and bool(token.get('client_id'))
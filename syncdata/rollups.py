@@ -0,0 +1,89 @@
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.utils import timezone
+
+from syncdata.models import OrderItem, SalesDailyCustomer, SalesDailyProduct, SalesDailyUser
+
+logger = logging.getLogger(__name__)
+
+# Orders in these statuses do not count towards sales
+EXCLUDED_STATUSES = ('cancelled',)
+
+# Order fields record() needs, in this order
+HEADER_FIELDS = ('client_id', 'user_id', 'customer_name', 'created_at')
+
+
+def counts(status):
+    """Whether an order in `status` contributes to the rollups."""
+    return (status or '').strip().lower() not in EXCLUDED_STATUSES
+
+
+def _dec(value):
+    return Decimal(str(value)) if value is not None else Decimal('0')
+
+
+def _upsert(cursor, table, keys, adds, rows):
+    """
+    Multi-row INSERT ... ON CONFLICT (keys) that adds `adds` columns onto
+    existing rows. Rows are written in conflict-key order so concurrent
+    orders touching the same rows lock them in the same order (no deadlock).
+    """
+    if not rows:
+        return
+    rows = sorted(rows, key=lambda row: tuple(row[:len(keys)]))
+    columns = list(keys) + list(adds)
+    values = ', '.join(['(' + ', '.join(['%s'] * len(columns)) + ')'] * len(rows))
+    updates = ', '.join(f"{col} = {table}.{col} + excluded.{col}" for col in adds)
+    cursor.execute(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES {values} "
+        f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}",
+        [value for row in rows for value in row],
+    )
+
+
+def record(cursor, header, orders=0, quantity=0, amount=0, products=()):
+    """
+    Add deltas for one order to the three daily rollups.
+    header: (client_id, user_id, customer_name, created_at) of the order.
+    products: iterable of (product_code, quantity delta, amount delta).
+    Runs on `cursor`, so it commits or rolls back with the order write.
+    """
+    client_id, user_id, customer_name, created_at = header
+    day = timezone.localdate(created_at)
+    quantity, amount = _dec(quantity), _dec(amount)
+
+    if orders or quantity or amount:
+        _upsert(cursor, SalesDailyUser._meta.db_table,
+                ('client_id', 'day', 'user_id'), ('order_count', 'quantity', 'total_amount'),
+                [(client_id, day, user_id, orders, quantity, amount)])
+        _upsert(cursor, SalesDailyCustomer._meta.db_table,
+                ('client_id', 'day', 'customer_name'), ('order_count', 'total_amount'),
+                [(client_id, day, customer_name, orders, amount)])
+
+    merged = defaultdict(lambda: [Decimal('0'), Decimal('0')])
+    for code, qty, line_amount in products:
+        merged[code][0] += _dec(qty)
+        merged[code][1] += _dec(line_amount)
+    _upsert(cursor, SalesDailyProduct._meta.db_table,
+            ('client_id', 'day', 'product_code'), ('quantity', 'total_amount'),
+            [(client_id, day, code, qty, line_amount) for code, (qty, line_amount) in merged.items()
+             if qty or line_amount])
+
+
+def record_order(cursor, order_id, header, total_amount, sign):
+    """Add (sign=1) or remove (sign=-1) an order's whole contribution, reading its lines in SQL."""
+    cursor.execute(
+        f"SELECT product_code, SUM(quantity), SUM(total_price) FROM {OrderItem._meta.db_table} "
+        f"WHERE order_id = %s GROUP BY product_code",
+        [order_id],
+    )
+    lines = [(code, _dec(qty), _dec(line_amount)) for code, qty, line_amount in cursor.fetchall()]
+    record(
+        cursor, header,
+        orders=sign,
+        quantity=sign * sum((qty for _, qty, _ in lines), Decimal('0')),
+        amount=sign * _dec(total_amount),
+        products=[(code, sign * qty, sign * line_amount) for code, qty, line_amount in lines],
+    )
@@ -0,0 +1,236 @@
+"""
+Tenant sharding by client_id.
+
+Every syncdata table except the shard directory holds rows of a single client
+per row, so a client's data can live in its own database. TenantShard rows on
+'default' map client_ids to database aliases (settings.SHARD_DATABASES);
+unmapped clients stay on 'default'.
+
+TenantMiddleware resolves the request's client_id (token claim decoded by
+TokenClaimsMiddleware, then the client_id query param) and ShardRouter sends
+every query on a sharded model to that client's database. Views that can get
+the client only from the JSON body are wrapped with `tenant_scoped`, which
+parses it and refuses the request rather than falling back to 'default'. Code running outside a request
+(management commands, background jobs) wraps its work in `tenant(client_id)`.
+With no shards configured the router steps aside and nothing is looked up.
+"""
+import json
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.http import JsonResponse
+
+from syncdata.cache import BoundedCache
+from syncdata.models import CartItem, OrderItem, TenantShard
+
+logger = logging.getLogger(__name__)
+
+# Models that are not partitioned by client (always on 'default')
+GLOBAL_MODELS = ('tenantshard', 'client', 'licensesyncstate')
+
+# Sharded models whose client_id lives on the parent row: model -> lookup
+CHILD_CLIENT_LOOKUPS = {
+    OrderItem: 'order__client_id',
+    CartItem: 'cart__client_id',
+}
+
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+# client_id -> (alias, read_only); the TTL bounds how long other workers keep
+# routing to the old database after a move
+shard_map = BoundedCache('tenant_shards', maxsize=10000, ttl=settings.SHARD_MAP_TTL)
+
+_current_client = ContextVar('shard_client_id', default=None)
+
+
+def sharding_enabled():
+    return bool(settings.SHARD_DATABASES)
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'syncdata' and model._meta.model_name not in GLOBAL_MODELS
+
+
+def client_filter(model, client_id):
+    """Queryset filter selecting one client's rows of a sharded model."""
+    return {CHILD_CLIENT_LOOKUPS.get(model, 'client_id'): client_id}
+
+
+def database_aliases():
+    """'default' plus every shard: where sharded tables exist."""
+    return [DEFAULT_DB_ALIAS] + [alias for alias in settings.SHARD_DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+def route_for(client_id, use_cache=True):
+    """(alias, read_only) for a client, from the TenantShard directory."""
+    key = str(client_id).strip()
+    route = shard_map.get(key) if use_cache else None
+    if route is None:
+        row = (
+            TenantShard.objects.using(DEFAULT_DB_ALIAS)
+            .filter(client_id=key)
+            .values_list('alias', 'read_only')
+            .first()
+        )
+        route = tuple(row) if row else (DEFAULT_DB_ALIAS, False)
+        shard_map.set(key, route)
+    return route
+
+
+def invalidate(client_id):
+    shard_map.invalidate_where(lambda key: key == str(client_id).strip())
+
+
+@contextmanager
+def tenant(client_id):
+    """Route sharded queries in this block to client_id's database."""
+    token = _current_client.set(str(client_id).strip() if client_id else None)
+    try:
+        yield
+    finally:
+        _current_client.reset(token)
+
+
+def current_client():
+    return _current_client.get()
+
+
+class ShardRouter:
+    """Routes sharded models to the database of the current (or hinted) client."""
+
+    def _route(self, model, hints):
+        if not sharding_enabled() or not is_sharded(model):
+            return None
+        client_id = getattr(hints.get('instance'), 'client_id', None) or _current_client.get()
+        if not client_id:
+            return None
+        alias = route_for(client_id)[0]
+        # 'default' is left to the next router (read replicas)
+        return None if alias == DEFAULT_DB_ALIAS else alias
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        dbs = {obj1._state.db, obj2._state.db}
+        if len(dbs) > 1 and dbs & set(settings.SHARD_DATABASES):
+            return False
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == 'syncdata' and model_name in GLOBAL_MODELS:
+            return db == DEFAULT_DB_ALIAS
+        return None
+
+
+def request_client_id(request):
+    """client_id of a request from its token claim or query string (never the body)."""
+    claims = getattr(request, 'claims', None)  # set by TokenClaimsMiddleware
+    if claims and claims['client_id']:
+        return claims['client_id']
+    return request.GET.get('client_id') or None
+
+
+def body_client_id(request):
+    """client_id field of a JSON request body, or None."""
+    if request.method not in UNSAFE_METHODS or request.content_type != 'application/json':
+        return None
+    try:
+        body = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    if isinstance(body, dict) and body.get('client_id'):
+        return str(body['client_id'])
+    return None
+
+
+def writes_paused(request, client_id):
+    """503 + Retry-After for an unsafe request while the client is being moved, else None."""
+    if request.method not in UNSAFE_METHODS or not route_for(client_id)[1]:
+        return None
+    response = JsonResponse(
+        {'success': False, 'error': 'Client data is being moved; retry shortly.'}, status=503
+    )
+    response['Retry-After'] = str(settings.SHARD_MAP_TTL)
+    return response
+
+
+def _tenant_missing():
+    return JsonResponse(
+        {'success': False, 'error': 'client_id is required (token or request body).'}, status=400
+    )
+
+
+def tenant_scoped(view_func):
+    """
+    For views that find rows by id or may only get client_id in the JSON body
+    (cart and order changes): with sharding enabled, a request whose client is
+    not known from the token or query string is resolved from the body, and
+    answered 400 if that fails too, instead of reading or writing 'default'
+    where another client's row may have the same id. Only these views pay for
+    parsing the body here.
+    """
+    def resolve(request):
+        if not sharding_enabled() or current_client():
+            return None, None
+        client_id = body_client_id(request)
+        if not client_id:
+            return None, _tenant_missing()
+        return client_id, None
+
+    if iscoroutinefunction(view_func):
+        async def _view_wrapper(request, *args, **kwargs):
+            client_id, error = resolve(request)
+            if error or not client_id:
+                return error or await view_func(request, *args, **kwargs)
+            with tenant(client_id):
+                paused = await sync_to_async(writes_paused)(request, client_id)
+                return paused or await view_func(request, *args, **kwargs)
+    else:
+        def _view_wrapper(request, *args, **kwargs):
+            client_id, error = resolve(request)
+            if error or not client_id:
+                return error or view_func(request, *args, **kwargs)
+            with tenant(client_id):
+                return writes_paused(request, client_id) or view_func(request, *args, **kwargs)
+    return wraps(view_func)(_view_wrapper)
+
+
+class TenantMiddleware:
+    """
+    Sets the current client for the request (token claim, else client_id
+    query param) so ShardRouter can route its queries, and rejects writes for
+    a client while it is being moved. Views whose client may only be in the
+    body resolve it themselves (tenant_scoped, or tenant() in the view).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        client_id = request_client_id(request) if sharding_enabled() else None
+        if not client_id:
+            return self.get_response(request)
+        with tenant(client_id):
+            return writes_paused(request, client_id) or self.get_response(request)
+
+    async def __acall__(self, request):
+        client_id = request_client_id(request) if sharding_enabled() else None
+        if not client_id:
+            return await self.get_response(request)
+        with tenant(client_id):
+            return await sync_to_async(writes_paused)(request, client_id) or await self.get_response(request)
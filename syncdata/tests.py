@@ -1,3 +1,991 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections, router
+from django.db.models import F
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from syncdata import cart_store, license_check, order_store, paging, rollups, sharding, versioning
+from syncdata.authentication import (
+    StreamTicket, TokenClaimsMiddleware, license_claims, license_revisions, principal_cache,
+)
+from syncdata.db_routing import replica_reads
+from syncdata.models import (
+    AccMaster, AccProduct, AccProductBatch, AccUsers, Cart, CartItem, ClientLicense, DataVersion,
+    ManualCustomer, Order, OrderItem, SalesDailyCustomer, SalesDailyProduct, SalesDailyUser, TenantShard,
+)
+from syncdata.views import async_views, order_views
+
+
+def bearer(user_id='u1', client_id='C1', role='admin'):
+    token = AccessToken()
+    token['user_id'] = user_id
+    token['client_id'] = client_id
+    token['role'] = role
+    return f'Bearer {token}'
+
+
+class UnmanagedTablesMixin:
+    """Creates the tables of the unmanaged (ERP-owned) models a test case needs."""
+    unmanaged_models = ()
+    unmanaged_databases = (DEFAULT_DB_ALIAS,)
+
+    @classmethod
+    def setUpClass(cls):
+        for alias in cls.unmanaged_databases:
+            with connections[alias].schema_editor() as editor:
+                for model in cls.unmanaged_models:
+                    editor.create_model(model)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in cls.unmanaged_databases:
+            with connections[alias].schema_editor() as editor:
+                for model in cls.unmanaged_models:
+                    editor.delete_model(model)
+
+
+def create_user(user_id='u1', client_id='C1'):
+    """An AccUsers row with a valid license, so bearer() tokens authenticate."""
+    AccUsers.objects.create(id=user_id, pass_field='pw', role='admin', client_id=client_id)
+    ClientLicense.objects.get_or_create(
+        client_id=client_id, defaults={'license_key': f'K-{client_id}', 'expires_at': timezone.now() + timedelta(days=30)},
+    )
+
+
+class GetOrdersQueryBudgetTests(TestCase):
+    """get_orders must cost the same number of queries whatever the page size."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for n in range(20):
+            order = Order.objects.create(
+                order_number=f'ORD-{n}', customer_name=f'Customer {n}',
+                user_id='u1', client_id='C1', total_amount=Decimal('30.00'),
+            )
+            for code in ('P1', 'P2', 'P3'):
+                OrderItem.objects.create(
+                    order=order, product_code=code, product_name=code,
+                    quantity=Decimal('2.000'), unit_price=Decimal('5.00'), total_price=Decimal('10.00'),
+                )
+
+    def setUp(self):
+        paging.count_cache.clear()
+
+    def get_orders(self, **params):
+        return self.client.get('/api/orders/get/', params, HTTP_AUTHORIZATION=bearer())
+
+    def test_page_of_twenty_orders_query_budget(self):
+        # version lookup (ETag), COUNT(*), order rows, items for the page
+        with self.assertNumQueries(4):
+            response = self.get_orders(per_page=20)
+        self.assertEqual(response.status_code, 200)
+        orders = response.json()['orders']
+        self.assertEqual(len(orders), 20)
+        self.assertEqual(orders[0]['item_count'], 3)
+        self.assertEqual(orders[0]['total_quantity'], 6.0)
+        self.assertEqual(len(orders[0]['items']), 3)
+
+    def test_query_budget_independent_of_page_size(self):
+        with self.assertNumQueries(4):
+            self.get_orders(per_page=5)
+        # same filters and data version: COUNT(*) is served from the count cache
+        with self.assertNumQueries(3):
+            self.get_orders(per_page=20)
+
+    def test_cursor_pages_skip_count_unless_requested(self):
+        # version lookup, order rows, items
+        with self.assertNumQueries(3):
+            first = self.get_orders(cursor='', per_page=8).json()
+        next_cursor = first['pagination']['next_cursor']
+        self.assertNotIn('total_count', first['pagination'])
+        with self.assertNumQueries(3):
+            second = self.get_orders(cursor=next_cursor, per_page=8).json()
+        first_ids = {order['id'] for order in first['orders']}
+        second_ids = {order['id'] for order in second['orders']}
+        self.assertEqual(len(second_ids), 8)
+        self.assertFalse(first_ids & second_ids)
+
+
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaRoutingTests(SimpleTestCase):
+    """Reads in @replica_reads GET requests go to the replica until the request writes."""
+
+    def route(self, method='get', write=False):
+        @replica_reads
+        def view(request):
+            aliases = [router.db_for_read(Order)]
+            if write:
+                router.db_for_write(Order)
+                aliases.append(router.db_for_read(Order))
+            return aliases
+        return view(getattr(RequestFactory(), method)('/'))
+
+    def test_get_reads_from_replica(self):
+        self.assertEqual(self.route(), ['replica'])
+
+    def test_reads_after_write_stay_on_primary(self):
+        self.assertEqual(self.route(write=True), ['replica', 'default'])
+
+    def test_unsafe_methods_use_primary(self):
+        self.assertEqual(self.route(method='post'), ['default'])
+
+    def test_undecorated_reads_use_primary(self):
+        self.assertEqual(router.db_for_read(Order), 'default')
+
+
+@override_settings(SHARD_DATABASES=['shard1'])
+class ShardRoutingTests(TestCase):
+    """Sharded models follow the current client's TenantShard; the directory stays on default."""
+
+    def setUp(self):
+        sharding.shard_map.clear()
+        TenantShard.objects.create(client_id='BIG', alias='shard1')
+
+    def test_mapped_client_routes_to_its_shard(self):
+        with sharding.tenant('BIG'):
+            self.assertEqual(router.db_for_read(Order), 'shard1')
+            self.assertEqual(router.db_for_write(OrderItem), 'shard1')
+            self.assertEqual(router.db_for_read(TenantShard), 'default')
+
+    def test_unmapped_client_and_no_client_use_default(self):
+        with sharding.tenant('SMALL'):
+            self.assertEqual(router.db_for_read(Order), 'default')
+        self.assertEqual(router.db_for_read(Order), 'default')
+
+    def test_instance_hint_wins(self):
+        with sharding.tenant('SMALL'):
+            self.assertEqual(router.db_for_write(Order, instance=Order(client_id='BIG')), 'shard1')
+
+    def test_id_only_changes_without_a_client_are_refused(self):
+        order = Order.objects.create(order_number='ORD-1', customer_name='C', user_id='u1', client_id='SMALL')
+        response = self.client.post('/api/orders/delete/', {'order_id': order.id}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(Order.objects.filter(id=order.id).exists())
+
+        response = self.client.post(
+            '/api/orders/delete/', {'order_id': order.id, 'client_id': 'SMALL'}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Order.objects.filter(id=order.id).exists())
+
+    def test_middleware_does_not_parse_bodies(self):
+        request = RequestFactory().post('/sync/bulk/', {'client_id': 'BIG'}, content_type='application/json')
+        request.claims = None
+        self.assertIsNone(sharding.request_client_id(request))
+        self.assertEqual(sharding.body_client_id(request), 'BIG')
+
+
+class PrincipalCacheInvalidationTests(TestCase):
+    """Cached auth principals of a client are dropped whenever its license row changes."""
+
+    def setUp(self):
+        principal_cache.clear()
+        self.license = ClientLicense.objects.create(
+            client_id='C1', license_key='K1', expires_at=timezone.now() + timedelta(days=30),
+        )
+        principal_cache.set(('u1', 'C1'), ('user', self.license))
+        principal_cache.set(('u1', 'C2'), ('user', None))
+
+    def test_license_save_invalidates_client(self):
+        self.license.is_active = False
+        self.license.save()
+        self.assertIsNone(principal_cache.get(('u1', 'C1')))
+        self.assertIsNotNone(principal_cache.get(('u1', 'C2')))
+
+    def test_license_delete_invalidates_client(self):
+        ClientLicense.objects.filter(client_id='C1').delete()
+        self.assertIsNone(principal_cache.get(('u1', 'C1')))
+
+
+class StatelessLicenseClaimsTests(TestCase):
+    """Tokens with lic_rev / lic_exp claims are accepted only while the license revision is current."""
+    databases = '__all__'
+
+    def setUp(self):
+        self.license = ClientLicense.objects.create(
+            client_id='C1', license_key='K1', expires_at=timezone.now() + timedelta(days=30),
+        )
+        self.token = AccessToken()
+        for claim, value in license_claims(self.license).items():
+            self.token[claim] = value
+        license_revisions.reload()
+
+    def test_current_revision_is_accepted(self):
+        self.assertTrue(license_revisions.accepts(self.token, 'C1'))
+        self.assertFalse(license_revisions.accepts(self.token, 'C2'))
+
+    def test_concurrent_stale_checks_reload_once(self):
+        def slow_reload():
+            time.sleep(0.05)
+            license_revisions._loaded_at = time.monotonic()
+
+        license_revisions.expire()
+        with mock.patch.object(license_revisions, 'reload', side_effect=slow_reload) as reload:
+            threads = [threading.Thread(target=license_revisions.ensure_fresh) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(reload.call_count, 1)
+
+    def test_license_change_revokes_old_tokens(self):
+        self.license.is_active = False
+        self.license.save()
+        self.assertFalse(license_revisions.fresh())
+        license_revisions.reload()
+        self.assertFalse(license_revisions.accepts(self.token, 'C1'))
+
+
+class TokenClaimsMiddlewareTests(SimpleTestCase):
+    """The Bearer token is decoded once and its claims override identity sent in the request."""
+
+    def _claims(self, header):
+        request = RequestFactory().get('/api/cart/', {'user_id': 'u9', 'client_id': 'C9'}, HTTP_AUTHORIZATION=header)
+        TokenClaimsMiddleware(lambda req: None)(request)
+        return request
+
+    def test_valid_token_sets_claims(self):
+        request = self._claims(bearer(role=' Admin '))
+        self.assertEqual(request.claims, {'user_id': 'u1', 'client_id': 'C1', 'role': 'admin'})
+        self.assertEqual(order_views.request_identity(request, request.GET), ('u1', 'C1'))
+
+    def test_invalid_token_is_rejected(self):
+        request = RequestFactory().get('/api/cart/', HTTP_AUTHORIZATION='Bearer not-a-jwt')
+        response = TokenClaimsMiddleware(lambda req: self.fail('view reached'))(request)
+        self.assertEqual(response.status_code, 401)
+        self.assertIsNone(request.claims)
+
+    def test_request_values_only_without_a_token(self):
+        request = self._claims('')
+        self.assertIsNone(request.claims)
+        self.assertEqual(order_views.request_identity(request, request.GET), ('u9', 'C9'))
+
+
+class PurgeStaleCartsTests(TestCase):
+    """purge_stale_carts deletes only carts idle past the TTL, in batches of --batch-size."""
+    databases = '__all__'
+
+    def setUp(self):
+        for n in range(5):
+            cart = Cart.objects.create(customer_name=f'Old {n}', user_id='u1', client_id='C1')
+            CartItem.objects.create(cart=cart, product_code='P1', product_name='P1', unit_price=1)
+        Cart.objects.update(updated_at=timezone.now() - timedelta(hours=48))
+        self.fresh = Cart.objects.create(customer_name='Fresh', user_id='u1', client_id='C1')
+
+    def purge(self, *args):
+        out = StringIO()
+        call_command('purge_stale_carts', '--ttl-hours=24', '--pause=0', *args, stdout=out)
+        return out.getvalue()
+
+    def test_only_carts_past_the_cutoff_are_deleted(self):
+        output = self.purge('--batch-size=2')
+        self.assertEqual(list(Cart.objects.values_list('id', flat=True)), [self.fresh.id])
+        self.assertFalse(CartItem.objects.exists())
+        self.assertIn('Purged 5 carts and 5 cart items in 3 batches', output)
+
+    def test_max_batches_stops_early(self):
+        self.purge('--batch-size=2', '--max-batches=1')
+        self.assertEqual(Cart.objects.count(), 4)
+
+    def test_dry_run_deletes_nothing(self):
+        output = self.purge('--dry-run')
+        self.assertIn('Would purge 5 carts / 5 cart items', output)
+        self.assertEqual(Cart.objects.count(), 6)
+
+
+class OrderStatusTransitionTests(UnmanagedTablesMixin, TestCase):
+    """Bulk status changes leave completed / cancelled orders alone; single changes may reopen them."""
+    unmanaged_models = (AccUsers,)
+
+    def setUp(self):
+        principal_cache.clear()
+        create_user()
+        self.orders = {
+            status: Order.objects.create(
+                order_number=f'ORD-{status}', customer_name='Customer', user_id='u1',
+                client_id='C1', total_amount=Decimal('10.00'), status=status,
+            )
+            for status in ('pending', 'completed', 'cancelled')
+        }
+        self.other = Order.objects.create(
+            order_number='ORD-other', customer_name='Customer', user_id='u1',
+            client_id='C2', total_amount=Decimal('10.00'),
+        )
+
+    def test_single_change_can_reopen_a_cancelled_order(self):
+        cancelled = self.orders['cancelled']
+        self.assertEqual(order_store.set_status(cancelled.id, 'pending', client_id='C1'), 'C1')
+        cancelled.refresh_from_db()
+        self.assertEqual(cancelled.status, 'pending')
+        # the reopened order counts towards sales again
+        self.assertEqual(SalesDailyUser.objects.get(client_id='C1', user_id='u1').order_count, 1)
+        with self.assertRaises(order_store.OrderNotFound):
+            order_store.set_status(self.other.id, 'pending', client_id='C1')
+
+    def test_bulk_uses_the_same_guard(self):
+        ids = [order.id for order in self.orders.values()] + [self.other.id]
+        results = order_store.bulk_set_status('C1', ids, 'pending')
+        self.assertEqual(
+            [results[order_id] for order_id in ids], ['updated', 'locked', 'locked', 'not_found'],
+        )
+
+    def test_invalid_order_ids_are_rejected(self):
+        for value in (None, '', 'abc'):
+            with self.assertRaises(order_store.InvalidOrderId):
+                order_store.set_status(value, 'pending')
+        with self.assertRaises(order_store.InvalidOrderId):
+            order_store.bulk_set_status('C1', [1, 'x'], 'pending')
+
+    def test_single_endpoint_keeps_the_body_client_contract(self):
+        url = '/api/order-status/update/'
+        body = {'order_id': self.orders['pending'].id, 'status': 'completed', 'client_id': 'C1'}
+        create_user('u2', 'C2')
+        token = bearer(user_id='u2', client_id='C2')
+        response = self.client.post(url, body, content_type='application/json', HTTP_AUTHORIZATION=token)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.post(url, body, content_type='application/json').status_code, 200)
+
+    def test_bulk_endpoint_requires_a_token_and_uses_its_client(self):
+        url = '/api/order-status/bulk-update/'
+        body = {'order_ids': [self.other.id], 'status': 'completed', 'client_id': 'C2'}
+        self.assertEqual(self.client.post(url, body, content_type='application/json').status_code, 401)
+        response = self.client.post(url, body, content_type='application/json', HTTP_AUTHORIZATION=bearer())
+        self.assertEqual(response.json()['results'], {str(self.other.id): 'not_found'})
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.status, 'pending')
+
+
+class RollupUpsertOrderTests(SimpleTestCase):
+    """Rollup rows are upserted in conflict-key order whatever the cart line order."""
+
+    class Cursor:
+        def execute(self, sql, params):
+            self.params = params
+
+    def test_rows_sorted_by_conflict_key(self):
+        cursor = self.Cursor()
+        rows = [('C1', 'd', 'P3', 1, 1), ('C1', 'd', 'P1', 2, 2), ('C1', 'd', 'P2', 3, 3)]
+        rollups._upsert(cursor, 'sales_daily_products', ('client_id', 'day', 'product_code'),
+                        ('quantity', 'total_amount'), rows)
+        self.assertEqual(cursor.params[2::5], ['P1', 'P2', 'P3'])
+
+
+class LicenseRefreshTests(TestCase):
+    """The background refresh upserts only changed licenses, removes unlisted ones and survives outages."""
+    databases = '__all__'
+
+    def customer(self, client_id, status='Active', expiry='2099-12-31'):
+        return {
+            'client_id': client_id, 'license_key': f'K-{client_id}', 'status': status,
+            'license_validity': {'expiry_date': expiry, 'is_expired': False},
+        }
+
+    def sync(self, *customers):
+        with mock.patch.object(license_check, 'fetch_licenses_from_server', return_value=list(customers)):
+            return license_check.sync_licenses_from_server()
+
+    def test_only_changes_are_written(self):
+        ClientLicense.objects.create(client_id='GONE', license_key='K', expires_at=timezone.now())
+        self.assertEqual(self.sync(self.customer('C1'), self.customer('C2')), (2, 1))
+        self.assertEqual(self.sync(self.customer('C1'), self.customer('C2')), (0, 0))
+        self.assertEqual(self.sync(self.customer('C1'), self.customer('C2', status='Inactive')), (1, 0))
+        self.assertFalse(ClientLicense.objects.get(client_id='C2').is_active)
+        self.assertFalse(ClientLicense.objects.filter(client_id='GONE').exists())
+
+    def test_failed_fetch_keeps_licenses_and_records_error(self):
+        self.sync(self.customer('C1'))
+        error = license_check.LicenseFetchError('activation server down')
+        with mock.patch.object(license_check, 'fetch_licenses_from_server', side_effect=error):
+            state = license_check.refresh_licenses()
+        self.assertEqual(state.last_error, 'activation server down')
+        self.assertTrue(ClientLicense.objects.filter(client_id='C1').exists())
+
+
+class StreamTicketTests(UnmanagedTablesMixin, TestCase):
+    """The events stream is opened with a short-lived ticket, never with the access token."""
+    unmanaged_models = (AccUsers,)
+
+    def setUp(self):
+        principal_cache.clear()
+        create_user()
+
+    def test_ticket_carries_identity_and_is_single_purpose(self):
+        response = self.client.post('/api/events/ticket/', HTTP_AUTHORIZATION=bearer())
+        self.assertEqual(response.status_code, 200)
+        ticket = StreamTicket(response.json()['ticket'])
+        self.assertEqual((ticket['user_id'], ticket['client_id']), ('u1', 'C1'))
+        with self.assertRaises(TokenError):
+            AccessToken(response.json()['ticket'])
+
+    def test_ticket_requires_a_token(self):
+        self.assertEqual(self.client.post('/api/events/ticket/').status_code, 401)
+
+    def test_access_token_is_not_a_ticket(self):
+        with self.assertRaises(TokenError):
+            StreamTicket(bearer().split(' ', 1)[1])
+
+
+class ClientScopedOrderChangesTests(TestCase):
+    """Id-based cart and order changes only reach rows of the caller's client."""
+
+    def setUp(self):
+        self.order = Order.objects.create(
+            order_number='ORD-C2', customer_name='C', user_id='u2', client_id='C2', total_amount=Decimal('10.00'),
+        )
+        self.item = OrderItem.objects.create(
+            order=self.order, product_code='P1', product_name='P1',
+            quantity=Decimal('1.000'), unit_price=Decimal('10.00'), total_price=Decimal('10.00'),
+        )
+        cart = Cart.objects.create(customer_name='C', user_id='u2', client_id='C2')
+        self.cart_item = CartItem.objects.create(cart=cart, product_code='P1', product_name='P1', unit_price=1)
+
+    def post(self, url, body, **extra):
+        return self.client.post(url, body, content_type='application/json', **extra)
+
+    def test_other_clients_rows_are_not_found(self):
+        for url, body in (
+            ('/api/orders/delete/', {'order_id': self.order.id}),
+            ('/api/orders/update-status/', {'order_id': self.order.id, 'status': 'completed'}),
+            ('/api/orders/update-item/', {'item_id': self.item.id, 'quantity': '5'}),
+            ('/api/orders/delete-item/', {'item_id': self.item.id}),
+            ('/api/cart/update/', {'item_id': self.cart_item.id, 'quantity': '5'}),
+        ):
+            response = self.post(url, dict(body, client_id='C2'), HTTP_AUTHORIZATION=bearer(client_id='C1'))
+            self.assertEqual(response.status_code, 404, url)
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.total_amount), ('pending', Decimal('10.00')))
+        self.cart_item.refresh_from_db()
+        self.assertEqual(self.cart_item.quantity, Decimal('1.000'))
+
+    def test_invalid_token_does_not_fall_back_to_the_body(self):
+        expired = AccessToken()
+        expired['user_id'], expired['client_id'] = 'u2', 'C2'
+        expired.set_exp(lifetime=-timedelta(minutes=1))
+        for header in ('Bearer forged', f'Bearer {expired}'):
+            response = self.post('/api/orders/delete/', {'order_id': self.order.id, 'client_id': 'C2'},
+                                 HTTP_AUTHORIZATION=header)
+            self.assertEqual(response.status_code, 401)
+        self.assertTrue(Order.objects.filter(id=self.order.id).exists())
+
+    def test_client_is_required(self):
+        self.assertEqual(self.post('/api/orders/delete/', {'order_id': self.order.id}).status_code, 400)
+        response = self.post('/api/orders/delete/', {'order_id': self.order.id, 'client_id': 'C2'})
+        self.assertEqual(response.status_code, 200)
+
+
+class ConditionalGetTests(TestCase):
+    """Cart and order reads answer a matching If-None-Match with 304 until the client's data changes."""
+
+    def setUp(self):
+        Order.objects.create(
+            order_number='ORD-1', customer_name='C', user_id='u1', client_id='C1', total_amount=Decimal('10.00'),
+        )
+
+    def revalidate(self, url, params, **extra):
+        first = self.client.get(url, params, **extra)
+        self.assertEqual(first.status_code, 200)
+        second = self.client.get(url, params, HTTP_IF_NONE_MATCH=first['ETag'], **extra)
+        return first, second
+
+    def test_unchanged_data_is_not_modified(self):
+        for url, params, extra in (
+            ('/api/cart/get/', {'user_id': 'u1', 'client_id': 'C1'}, {}),
+            ('/api/orders/get/', {}, {'HTTP_AUTHORIZATION': bearer()}),
+        ):
+            first, second = self.revalidate(url, params, **extra)
+            self.assertEqual(second.status_code, 304, url)
+            self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_write_or_other_query_changes_the_etag(self):
+        first, _ = self.revalidate('/api/orders/get/', {}, HTTP_AUTHORIZATION=bearer())
+        other = self.client.get('/api/orders/get/', {'status': 'pending'},
+                                HTTP_IF_NONE_MATCH=first['ETag'], HTTP_AUTHORIZATION=bearer())
+        self.assertEqual(other.status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            versioning.bump_version('C1', versioning.ORDERS)
+        after = self.client.get('/api/orders/get/', HTTP_IF_NONE_MATCH=first['ETag'], HTTP_AUTHORIZATION=bearer())
+        self.assertEqual(after.status_code, 200)
+        self.assertNotEqual(after['ETag'], first['ETag'])
+
+    def test_version_bumps_wait_for_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            versioning.bump_version('C1', versioning.CARTS, versioning.ORDERS)
+            self.assertEqual(versioning.get_version('C1', versioning.CARTS), 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(versioning.get_version('C1', versioning.CARTS), 1)
+        self.assertEqual(versioning.get_version('C1', versioning.ORDERS), 1)
+
+
+class CartProductsMixin(UnmanagedTablesMixin):
+    """Catalog rows for cart tests: P1 has two batches (the dearer one prices), P2 one, P3 none."""
+    unmanaged_models = (AccProduct, AccProductBatch)
+
+    def setUp(self):
+        cart_store.product_cache.clear()
+        for code in ('P1', 'P2', 'P3'):
+            AccProduct.objects.create(code=code, name=f'Product {code}', client_id='C1')
+        for code, price in (('P1', '5.000'), ('P2', '3.000')):
+            AccProductBatch.objects.create(productcode=code, salesprice=Decimal(price), client_id='C1')
+
+    def cart(self):
+        cart = Cart.objects.get(customer_name='Guest', user_id='u1', client_id='C1')
+        return cart, {item.product_code: item for item in cart.items.all()}
+
+
+class CartUpsertTests(CartProductsMixin, TestCase):
+    """add_to_cart increments lines in the database and keeps the cart totals in step."""
+
+    def add(self, code, quantity='1', **body):
+        return self.client.post('/api/cart/add/', dict(
+            body, user_id='u1', client_id='C1', product_code=code, quantity=quantity,
+        ), content_type='application/json')
+
+    def test_repeated_adds_accumulate_on_one_line(self):
+        self.assertEqual(self.add('P1', '2').status_code, 200)
+        self.assertEqual(self.add('P1', '3').status_code, 200)
+        cart, lines = self.cart()
+        self.assertEqual(list(lines), ['P1'])
+        self.assertEqual(lines['P1'].quantity, Decimal('5.000'))
+        self.assertEqual(lines['P1'].unit_price, Decimal('5.00'))
+        self.assertEqual((cart.item_count, cart.total_amount), (1, Decimal('25.00')))
+
+    def test_negative_add_to_zero_removes_the_line(self):
+        self.add('P1', '2')
+        self.add('P1', '-2')
+        cart, lines = self.cart()
+        self.assertEqual(lines, {})
+        self.assertEqual((cart.item_count, cart.total_amount), (0, Decimal('0.00')))
+
+    def test_unknown_or_unbatched_product_is_not_found(self):
+        self.assertEqual(self.add('NOPE').status_code, 404)
+        self.assertEqual(self.add('P3').status_code, 404)
+        self.assertFalse(Cart.objects.exists())
+
+    def store_add(self, code, quantity, price):
+        return cart_store.add_to_cart('C1', 'u1', 'Guest', code, code, Decimal(quantity), Decimal(price))
+
+    def test_add_shifts_totals_in_two_statements(self):
+        self.store_add('P1', '2', '5.00')
+        self.store_add('P2', '1', '3.00')
+        with CaptureQueriesContext(connection) as queries:
+            self.store_add('P1', '1', '6.25')  # repriced: the whole line moves to the new price
+        self.assertEqual(len([q for q in queries if 'SAVEPOINT' not in q['sql']]), 2)
+        cart, lines = self.cart()
+        self.assertEqual((lines['P1'].quantity, lines['P1'].unit_price), (Decimal('3.000'), Decimal('6.25')))
+        self.assertEqual((cart.item_count, cart.total_quantity, cart.total_amount),
+                         (2, Decimal('4.000'), Decimal('21.75')))
+
+    def test_stale_line_read_falls_back_to_a_recount(self):
+        self.store_add('P1', '2', '5.00')
+        upsert = cart_store.upsert_cart_adding
+
+        def concurrent_add(*args, **kwargs):
+            result = upsert(*args, **kwargs)
+            # another add of the same product commits after the cart upsert read its line
+            CartItem.objects.filter(product_code='P1').update(quantity=Decimal('4'))
+            Cart.objects.update(total_quantity=F('total_quantity') + 2, total_amount=F('total_amount') + 10)
+            return result
+
+        with mock.patch.object(cart_store, 'upsert_cart_adding', side_effect=concurrent_add):
+            _, line = self.store_add('P1', '1', '6.00')
+        self.assertEqual(line['quantity'], Decimal('5.000'))
+        cart, _ = self.cart()
+        self.assertEqual((cart.item_count, cart.total_quantity, cart.total_amount),
+                         (1, Decimal('5.000'), Decimal('30.00')))
+
+
+class CartBatchTests(CartProductsMixin, TestCase):
+    """Batched operations fold per product and apply all-or-nothing."""
+
+    def apply(self, *operations):
+        return cart_store.apply_operations('C1', 'u1', 'Guest', list(operations))
+
+    def test_operations_fold_to_one_effect_per_product(self):
+        self.apply({'op': 'add', 'product_code': 'P1', 'quantity': '4'})
+        self.apply(
+            {'op': 'add', 'product_code': 'P1', 'quantity': '1'},
+            {'op': 'add', 'product_code': 'P1', 'quantity': '1'},
+            {'op': 'add', 'product_code': 'P2', 'quantity': '2'},
+            {'op': 'remove', 'product_code': 'P2'},
+            {'op': 'add', 'product_code': 'P2', 'quantity': '3', 'unit_price': '2.50'},
+        )
+        cart, lines = self.cart()
+        self.assertEqual(lines['P1'].quantity, Decimal('6.000'))
+        self.assertEqual((lines['P2'].quantity, lines['P2'].unit_price), (Decimal('3.000'), Decimal('2.50')))
+        self.assertEqual((cart.item_count, cart.total_amount), (2, Decimal('37.50')))
+
+    def test_set_to_zero_removes_and_plain_set_keeps_price(self):
+        self.apply({'op': 'add', 'product_code': 'P1', 'quantity': '1', 'unit_price': '9'},
+                   {'op': 'add', 'product_code': 'P2'})
+        self.apply({'op': 'set', 'product_code': 'P1', 'quantity': '4'},
+                   {'op': 'set', 'product_code': 'P2', 'quantity': '0'})
+        _, lines = self.cart()
+        self.assertEqual(list(lines), ['P1'])
+        self.assertEqual((lines['P1'].quantity, lines['P1'].unit_price), (Decimal('4.000'), Decimal('9.00')))
+
+    def test_bad_operation_reports_its_index_and_writes_nothing(self):
+        response = self.client.post('/api/cart/batch/', {
+            'user_id': 'u1', 'client_id': 'C1',
+            'operations': [{'op': 'add', 'product_code': 'P1'}, {'op': 'add', 'product_code': 'P1', 'quantity': 'x'}],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['operation_index'], 1)
+        with self.assertRaises(cart_store.CartOperationError) as raised:
+            self.apply({'op': 'add', 'product_code': 'P1'}, {'op': 'add', 'product_code': 'P3'})
+        self.assertEqual(raised.exception.status, 404)
+        self.assertFalse(Cart.objects.exists())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'concurrent upserts need row-level locking')
+class ConcurrentCartAddTests(TransactionTestCase):
+    """Parallel adds of the same product never lose an increment."""
+
+    def test_parallel_adds_all_count(self):
+        workers, barrier = 8, threading.Barrier(8)
+
+        def add():
+            barrier.wait()
+            try:
+                cart_store.add_to_cart('C1', 'u1', 'Guest', 'P1', 'Product P1', Decimal('1'), Decimal('5'))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=add) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        cart = Cart.objects.get()
+        self.assertEqual(cart.items.get().quantity, Decimal(workers))
+        self.assertEqual(cart.total_amount, Decimal(workers * 5))
+
+
+class OrderItemEditTests(TestCase):
+    """Line edits cost two statements and keep the order total and rollups in step."""
+
+    def setUp(self):
+        self.order = Order.objects.create(
+            order_number='ORD-E', customer_name='Shop', user_id='u1', client_id='C1', total_amount=Decimal('25.00'),
+        )
+        self.item = OrderItem.objects.create(
+            order=self.order, product_code='P1', product_name='P1',
+            quantity=Decimal('2.000'), unit_price=Decimal('10.50'), total_price=Decimal('21.00'),
+        )
+        OrderItem.objects.create(
+            order=self.order, product_code='P2', product_name='P2',
+            quantity=Decimal('1.000'), unit_price=Decimal('4.00'), total_price=Decimal('4.00'),
+        )
+
+    def statements(self, queries):
+        return [q['sql'] for q in queries if 'SAVEPOINT' not in q['sql']]
+
+    def test_update_and_delete_cost_two_statements(self):
+        Order.objects.filter(id=self.order.id).update(status='cancelled')  # no rollup upserts
+        with CaptureQueriesContext(connection) as queries:
+            result = order_store.update_item(self.item.id, Decimal('3'), client_id='C1')
+        self.assertEqual(len(self.statements(queries)), 2)
+        self.assertEqual(result['total_amount'], Decimal('35.50'))
+        with CaptureQueriesContext(connection) as queries:
+            result = order_store.delete_item(self.item.id, client_id='C1')
+        self.assertEqual(len(self.statements(queries)), 2)
+        self.assertEqual(result['total_amount'], Decimal('4.00'))
+
+    def test_update_shifts_total_and_rollups(self):
+        result = order_store.update_item(self.item.id, Decimal('3'), client_id='C1')
+        self.assertEqual((result['order_id'], result['client_id']), (self.order.id, 'C1'))
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.quantity, self.item.total_price), (Decimal('3.000'), Decimal('31.50')))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount, Decimal('35.50'))
+        product = SalesDailyProduct.objects.get(product_code='P1')
+        self.assertEqual((product.quantity, product.total_amount), (Decimal('1.000'), Decimal('10.50')))
+
+        order_store.delete_item(self.item.id, client_id='C1')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount, Decimal('4.00'))
+        product.refresh_from_db()
+        self.assertEqual((product.quantity, product.total_amount), (Decimal('-2.000'), Decimal('-21.00')))
+
+    def test_completed_and_foreign_orders_are_untouched(self):
+        with self.assertRaises(order_store.OrderNotFound):
+            order_store.update_item(self.item.id, Decimal('3'), client_id='C2')
+        Order.objects.filter(id=self.order.id).update(status='completed')
+        with self.assertRaises(order_store.OrderLocked):
+            order_store.delete_item(self.item.id, client_id='C1')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount, Decimal('25.00'))
+        self.assertTrue(OrderItem.objects.filter(id=self.item.id).exists())
+
+    def test_stale_line_read_is_corrected(self):
+        shift = order_store._shift_for_item
+        calls = []
+
+        def concurrent_edit(*args):
+            result = shift(*args)
+            if not calls:
+                # another edit of the same line commits after the shift read it
+                OrderItem.objects.filter(id=self.item.id).update(quantity=Decimal('5'), total_price=Decimal('52.50'))
+                Order.objects.filter(id=self.order.id).update(total_amount=F('total_amount') + Decimal('31.50'))
+            calls.append(args)
+            return result
+
+        with mock.patch.object(order_store, '_shift_for_item', side_effect=concurrent_edit):
+            result = order_store.update_item(self.item.id, Decimal('3'), client_id='C1')
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(result['total_amount'], Decimal('35.50'))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount, Decimal('35.50'))
+
+
+class PlaceOrderTests(TestCase):
+    """Placing an order merges cart lines in SQL and records the sales rollups in the same transaction."""
+
+    def fill_cart(self, *lines):
+        cart, _ = Cart.objects.get_or_create(customer_name='Shop', user_id='u1', client_id='C1')
+        for code, quantity, price in lines:
+            CartItem.objects.create(cart=cart, product_code=code, product_name=code,
+                                    quantity=Decimal(quantity), unit_price=Decimal(price))
+
+    def place(self, **body):
+        response = self.client.post('/api/orders/place/', dict(
+            body, user_id='u1', client_id='C1', customer_name='Shop',
+        ), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return Order.objects.get(id=response.json()['order_id'])
+
+    def test_reorder_merges_lines_and_totals(self):
+        self.fill_cart(('P1', '2', '10.00'), ('P2', '1', '4.00'))
+        order = self.place(discount='50')
+        self.assertEqual(order.total_amount, Decimal('12.00'))
+        self.assertFalse(Cart.objects.exists())
+
+        self.fill_cart(('P1', '1', '10.00'))
+        order = self.place(order_id=order.id)
+        line = order.items.get(product_code='P1')
+        self.assertEqual((line.quantity, line.total_price), (Decimal('3.000'), Decimal('20.00')))
+        self.assertEqual(order.total_amount, Decimal('22.00'))
+
+        user = SalesDailyUser.objects.get(client_id='C1', user_id='u1')
+        self.assertEqual((user.order_count, user.quantity, user.total_amount), (1, Decimal('4.000'), Decimal('22.00')))
+        self.assertEqual(SalesDailyProduct.objects.get(product_code='P1').total_amount, Decimal('20.00'))
+        self.assertEqual(SalesDailyCustomer.objects.get(customer_name='Shop').order_count, 1)
+
+    def test_cancelling_removes_the_order_from_rollups(self):
+        self.fill_cart(('P1', '2', '10.00'))
+        order = self.place()
+        order_store.set_status(order.id, 'cancelled', client_id='C1')
+        user = SalesDailyUser.objects.get(client_id='C1', user_id='u1')
+        self.assertEqual((user.order_count, user.quantity, user.total_amount), (0, Decimal('0.000'), Decimal('0.00')))
+        self.assertEqual(SalesDailyProduct.objects.get(product_code='P1').quantity, Decimal('0.000'))
+
+    def test_final_orders_cannot_take_more_lines(self):
+        self.fill_cart(('P1', '1', '10.00'))
+        order = self.place()
+        order_store.set_status(order.id, 'completed', client_id='C1')
+        self.fill_cart(('P2', '1', '4.00'))
+        response = self.client.post('/api/orders/place/', {
+            'user_id': 'u1', 'client_id': 'C1', 'customer_name': 'Shop', 'order_id': order.id,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(order.items.filter(product_code='P2').exists())
+
+
+class AsyncViewTests(CartProductsMixin, TestCase):
+    """The async cart views answer exactly like the sync ones."""
+
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+
+    def test_add_and_get_match_the_sync_views(self):
+        body = {'user_id': 'u1', 'client_id': 'C1', 'product_code': 'P1', 'quantity': '2'}
+        request = self.factory.post('/api/cart/add/', body, content_type='application/json')
+        added = async_to_sync(async_views.aadd_to_cart)(request)
+        self.assertEqual(added.status_code, 200)
+        _, lines = self.cart()
+        self.assertEqual(lines['P1'].quantity, Decimal('2.000'))
+
+        params = {'user_id': 'u1', 'client_id': 'C1'}
+        sync = order_views.get_cart(self.factory.get('/api/cart/get/', params))
+        response = async_to_sync(async_views.aget_cart)(self.factory.get('/api/cart/get/', params))
+        self.assertEqual(response.content, sync.content)
+        self.assertEqual(response['ETag'], sync['ETag'])
+        revalidated = async_to_sync(async_views.aget_cart)(
+            self.factory.get('/api/cart/get/', params, HTTP_IF_NONE_MATCH=sync['ETag']))
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_unknown_product_is_not_found(self):
+        body = {'user_id': 'u1', 'client_id': 'C1', 'product_code': 'NOPE'}
+        request = self.factory.post('/api/cart/add/', body, content_type='application/json')
+        self.assertEqual(async_to_sync(async_views.aadd_to_cart)(request).status_code, 404)
+
+
+@skipUnless(settings.SHARD_DATABASES, 'needs a shard database (DB_SHARDS)')
+class MoveTenantTests(UnmanagedTablesMixin, TestCase):
+    """move_tenant copies a client's rows to the target shard exactly as stored, history included."""
+    databases = '__all__'
+    unmanaged_models = (AccMaster, ManualCustomer, AccProduct, AccProductBatch, AccUsers)
+    unmanaged_databases = sharding.database_aliases()
+    moved_models = (Order, OrderItem, Cart, CartItem, ClientLicense, DataVersion)
+
+    def setUp(self):
+        sharding.shard_map.clear()
+        self.addCleanup(sharding.shard_map.clear)
+        self.target = settings.SHARD_DATABASES[0]
+        create_user()
+        order = Order.objects.create(
+            order_number='ORD-1', customer_name='C', user_id='u1', client_id='C1', total_amount=Decimal('10.00'),
+        )
+        OrderItem.objects.create(
+            order=order, product_code='P1', product_name='P1',
+            quantity=Decimal('1.000'), unit_price=Decimal('10.00'), total_price=Decimal('10.00'),
+        )
+        cart = Cart.objects.create(customer_name='C', user_id='u1', client_id='C1')
+        CartItem.objects.create(cart=cart, product_code='P1', product_name='P1', unit_price=1)
+        DataVersion.objects.create(client_id='C1', scope=versioning.ORDERS, version=7)
+        Order.objects.create(order_number='ORD-2', customer_name='C', user_id='u2', client_id='C2')
+        past = timezone.now() - timedelta(days=400)
+        for model in (Order, Cart, ClientLicense):
+            model.objects.filter(client_id='C1').update(created_at=past, updated_at=past)
+        DataVersion.objects.update(updated_at=past)
+
+    def rows(self, alias):
+        return {
+            model: list(
+                model.objects.using(alias).filter(**sharding.client_filter(model, 'C1')).order_by('pk').values()
+            )
+            for model in self.moved_models
+        }
+
+    def test_rows_and_timestamps_survive_the_move(self):
+        before = self.rows(DEFAULT_DB_ALIAS)
+        call_command('move_tenant', 'C1', self.target, '--grace=0', stdout=StringIO())
+
+        self.assertEqual(sharding.route_for('C1', use_cache=False), (self.target, False))
+        self.assertEqual(self.rows(self.target), before)
+        self.assertTrue(all(len(rows) == 1 for rows in before.values()))
+        self.assertFalse(any(self.rows(DEFAULT_DB_ALIAS).values()))
+        self.assertEqual(Order.objects.using(DEFAULT_DB_ALIAS).filter(client_id='C2').count(), 1)
+
+
+@skipUnless(settings.SHARD_DATABASES, 'needs a shard database (DB_SHARDS)')
+class ShardedMaintenanceTests(TestCase):
+    """The cron commands work through every database, not just 'default'."""
+    databases = '__all__'
+
+    def setUp(self):
+        sharding.shard_map.clear()
+        self.addCleanup(sharding.shard_map.clear)
+        self.shard = settings.SHARD_DATABASES[0]
+        TenantShard.objects.create(client_id='FAR', alias=self.shard)
+
+    def test_purge_covers_every_shard(self):
+        for alias, client_id in ((DEFAULT_DB_ALIAS, 'C1'), (self.shard, 'FAR')):
+            cart = Cart.objects.using(alias).create(customer_name='Old', user_id='u1', client_id=client_id)
+            CartItem.objects.using(alias).create(cart=cart, product_code='P1', product_name='P1', unit_price=1)
+            Cart.objects.using(alias).update(updated_at=timezone.now() - timedelta(hours=48))
+
+        out = StringIO()
+        with self.captureOnCommitCallbacks(using=self.shard, execute=True), \
+                self.captureOnCommitCallbacks(execute=True):
+            call_command('purge_stale_carts', '--ttl-hours=24', '--pause=0', stdout=out)
+
+        self.assertIn('Purged 2 carts and 2 cart items in 2 batches', out.getvalue())
+        for alias in sharding.database_aliases():
+            self.assertFalse(Cart.objects.using(alias).exists())
+        self.assertEqual(DataVersion.objects.using(self.shard).get(client_id='FAR').version, 1)
+
+    def test_rollups_rebuilt_on_every_shard(self):
+        order = Order.objects.using(self.shard).create(
+            order_number='ORD-1', customer_name='Shop', user_id='u1', client_id='FAR', total_amount=Decimal('20.00'),
+        )
+        OrderItem.objects.using(self.shard).create(
+            order=order, product_code='P1', product_name='P1',
+            quantity=Decimal('2.000'), unit_price=Decimal('10.00'), total_price=Decimal('20.00'),
+        )
+        out = StringIO()
+        call_command('rebuild_sales_rollups', stdout=out)
+
+        self.assertIn('Rebuilt sales rollups for 1 client(s)', out.getvalue())
+        user = SalesDailyUser.objects.using(self.shard).get(client_id='FAR')
+        self.assertEqual((user.order_count, user.quantity, user.total_amount), (1, Decimal('2.000'), Decimal('20.00')))
+        self.assertFalse(SalesDailyUser.objects.using(DEFAULT_DB_ALIAS).exists())
+
+
+class PendingOrderListTests(UnmanagedTablesMixin, TestCase):
+    """/api/orderlist/orders/ pages by cursor or streams NDJSON, limited to a token's client."""
+    unmanaged_models = (AccUsers, AccProductBatch)
+    url = '/api/orderlist/orders/'
+
+    def setUp(self):
+        principal_cache.clear()
+        create_user()
+        self.ids = {}
+        for n, (client_id, status) in enumerate(
+            [('C1', 'pending'), ('C1', 'pending'), ('C1', 'pending'), ('C1', 'completed'), ('C2', 'pending')]
+        ):
+            order = Order.objects.create(
+                order_number=f'ORD-{n}', customer_name='C', user_id='u1', client_id=client_id, status=status,
+            )
+            OrderItem.objects.create(
+                order=order, product_code='P1', product_name='P1',
+                quantity=Decimal('1.000'), unit_price=Decimal('10.00'), total_price=Decimal('10.00'),
+            )
+            self.ids.setdefault((client_id, status), []).append(order.id)
+        self.c1_pending = set(self.ids[('C1', 'pending')])
+
+    def ndjson(self, response):
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_cursor_pages_cover_every_pending_order_once(self):
+        first = self.client.get(self.url, {'client_id': 'C1', 'limit': 2}).json()
+        self.assertEqual((first['count'], first['has_next']), (2, True))
+        second = self.client.get(self.url, {'client_id': 'C1', 'limit': 2, 'cursor': first['next_cursor']}).json()
+        self.assertEqual((second['count'], second['has_next']), (1, False))
+        ids = [order['id'] for order in first['orders'] + second['orders']]
+        self.assertEqual(sorted(ids, reverse=True), ids)
+        self.assertEqual(set(ids), self.c1_pending)
+        self.assertEqual(self.client.get(self.url, {'limit': 0}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'cursor': 'garbage'}).status_code, 400)
+
+    def test_stream_returns_one_line_per_order(self):
+        response = self.client.get(self.url, {'client_id': 'C1', 'stream': 1})
+        self.assertFalse(response.is_async)
+        orders = self.ndjson(response)
+        self.assertEqual({order['id'] for order in orders}, self.c1_pending)
+        self.assertEqual(orders[0]['items'][0]['product_code'], 'P1')
+
+    def test_token_client_wins_over_the_query(self):
+        auth = {'HTTP_AUTHORIZATION': bearer()}
+        paged = self.client.get(self.url, {'client_id': 'C2', 'limit': 10}, **auth).json()
+        self.assertEqual({order['id'] for order in paged['orders']}, self.c1_pending)
+        streamed = self.ndjson(self.client.get(self.url, {'client_id': 'C2', 'stream': 1}, **auth))
+        self.assertEqual({order['id'] for order in streamed}, self.c1_pending)
+
+    async def test_stream_is_async_under_asgi(self):
+        response = await self.async_client.get(self.url, {'client_id': 'C1', 'stream': 1})
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        orders = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual({order['id'] for order in orders}, self.c1_pending)
+        self.assertEqual(orders[0]['items'][0]['product_code'], 'P1')
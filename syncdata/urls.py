@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 
 # Auth & Core Views
@@ -7,7 +8,7 @@ from syncdata.views.bulk_sync import BulkSyncDataView, cart_view, order_view, in
 
 # Order Management Views
 from syncdata.views.order_views import (
-    add_to_cart, get_cart, update_cart_item, remove_cart_item,
+    add_to_cart, get_cart, update_cart_item, remove_cart_item, batch_update_cart,
     place_order, get_orders, update_order_status, delete_order, clear_cart,
     update_order_item, delete_order_item
 )
@@ -16,6 +17,24 @@ from syncdata.views.app_view import CustomerView, ProductView
 
 # 🆕 License View
 from syncdata.views.license_view import LicenseStatusView
+from syncdata.views.metrics_view import MetricsView
+from syncdata.views.analytics_view import SalesAnalyticsView
+from syncdata.views.events_view import EventTicketView, order_events
+
+# 📚 Read-replica routing for the heavy read endpoints
+from syncdata.db_routing import replica_reads
+
+# 🗂️ Tenant shards: cart / order endpoints refuse requests without a client
+from syncdata.sharding import tenant_scoped
+
+# 🚀 Async variants of the hot endpoints (ASGI deployments, ASYNC_VIEWS=True)
+if settings.ASYNC_VIEWS:
+    from syncdata.views.async_views import (
+        aadd_to_cart as add_to_cart, aget_cart as get_cart, aget_orders as get_orders, aproducts,
+    )
+    products_view = aproducts
+else:
+    products_view = ProductView.as_view()
 
 urlpatterns = [
 
@@ -34,28 +53,39 @@ urlpatterns = [
 
     # 🧾 Customer Routes 
     # (Frontend dropdown & add customer)
-    path('customers/', CustomerView.as_view(), name='customers'),
+    path('customers/', replica_reads(CustomerView.as_view()), name='customers'),
 
     # 📦 Product Routes
-    path('products/', ProductView.as_view(), name='products'),
+    path('products/', replica_reads(products_view), name='products'),
     
     # 🛒 Cart Management API
-    path('api/cart/add/', add_to_cart, name='add_to_cart'),
-    path('api/cart/get/', get_cart, name='get_cart'),
-    path('api/cart/update/', update_cart_item, name='update_cart_item'),
-    path('api/cart/remove/', remove_cart_item, name='remove_cart_item'),
-    path('api/cart/clear/', clear_cart, name='clear_cart'),
+    path('api/cart/add/', tenant_scoped(add_to_cart), name='add_to_cart'),
+    path('api/cart/get/', tenant_scoped(get_cart), name='get_cart'),
+    path('api/cart/update/', tenant_scoped(update_cart_item), name='update_cart_item'),
+    path('api/cart/remove/', tenant_scoped(remove_cart_item), name='remove_cart_item'),
+    path('api/cart/clear/', tenant_scoped(clear_cart), name='clear_cart'),
+    path('api/cart/batch/', tenant_scoped(batch_update_cart), name='batch_update_cart'),
     
     # 📋 Order Management API
-    path('api/orders/place/', place_order, name='place_order'),
-    path('api/orders/get/', get_orders, name='get_orders'),
-    path('api/orders/update-status/', update_order_status, name='update_order_status'),
-    path('api/orders/delete/', delete_order, name='delete_order'),
+    path('api/orders/place/', tenant_scoped(place_order), name='place_order'),
+    path('api/orders/get/', replica_reads(get_orders), name='get_orders'),
+    path('api/orders/update-status/', tenant_scoped(update_order_status), name='update_order_status'),
+    path('api/orders/delete/', tenant_scoped(delete_order), name='delete_order'),
     
     # 📋 Order Item Management API
-    path('api/orders/update-item/', update_order_item, name='update_order_item'),
-    path('api/orders/delete-item/', delete_order_item, name='delete_order_item'),
+    path('api/orders/update-item/', tenant_scoped(update_order_item), name='update_order_item'),
+    path('api/orders/delete-item/', tenant_scoped(delete_order_item), name='delete_order_item'),
 
     # 🆕 License API
     path('api/license/status/', LicenseStatusView.as_view(), name='license_status'),
+
+    # 🔔 Live order / cart change events (SSE, ASGI only)
+    path('api/events/ticket/', EventTicketView.as_view(), name='event_ticket'),
+    path('api/events/', order_events, name='order_events'),
+
+    # 📊 Sales analytics (rollup tables)
+    path('api/analytics/sales/', SalesAnalyticsView.as_view(), name='sales_analytics'),
+
+    # Internal metrics
+    path('api/internal/metrics/', MetricsView.as_view(), name='internal_metrics'),
 ]
\ No newline at end of file
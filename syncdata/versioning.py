@@ -0,0 +1,111 @@
+import hashlib
+import logging
+
+from django.db import connections, router, transaction
+from django.http import HttpResponseNotModified
+from django.utils import timezone
+from django.utils.http import parse_etags
+
+from syncdata.events import broker
+from syncdata.models import DataVersion
+
+logger = logging.getLogger(__name__)
+
+# Data scopes tracked per client
+CUSTOMERS = 'customers'
+CARTS = 'carts'
+ORDERS = 'orders'
+
+# Query params that never change the payload (front-end cache busters)
+IGNORED_PARAMS = ('_',)
+
+
+def bump_version(client_id, *scopes):
+    """
+    Increment the version of each scope for client_id once the current
+    transaction commits (immediately in autocommit mode), then notify this
+    worker's live-event subscribers for that client.
+    """
+    if not client_id or not scopes:
+        return
+
+    alias = router.db_for_write(DataVersion)
+    table = DataVersion._meta.db_table
+
+    def _bump():
+        now = timezone.now()
+        rows = ', '.join(['(%s, %s, 1, %s)'] * len(scopes))
+        params = []
+        for scope in scopes:
+            params.extend([client_id, scope, now])
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (client_id, scope, version, updated_at) VALUES {rows} "
+                f"ON CONFLICT (client_id, scope) DO UPDATE "
+                f"SET version = {table}.version + 1, updated_at = excluded.updated_at "
+                f"RETURNING scope, version",
+                params,
+            )
+            bumped = cursor.fetchall()
+        for scope, version in bumped:
+            broker.publish(client_id, scope, {'version': version})
+
+    transaction.on_commit(_bump, using=alias)
+
+
+def get_version(client_id, scope):
+    """Current version of a scope for client_id (0 if never written)."""
+    version = (
+        DataVersion.objects
+        .filter(client_id=client_id, scope=scope)
+        .values_list('version', flat=True)
+        .first()
+    )
+    return version or 0
+
+
+async def aget_version(client_id, scope):
+    """Async get_version."""
+    version = await (
+        DataVersion.objects
+        .filter(client_id=client_id, scope=scope)
+        .values_list('version', flat=True)
+        .afirst()
+    )
+    return version or 0
+
+
+def current_etag(request, client_id, scope, *vary, version=None):
+    """
+    Build a weak ETag from the scope version plus everything else the payload
+    depends on (path, query params, and any extra `vary` values such as role).
+    Pass `version` when the caller already looked it up.
+    """
+    if version is None:
+        version = get_version(client_id, scope)
+    params = sorted(
+        (key, value)
+        for key, values in request.GET.lists() if key not in IGNORED_PARAMS
+        for value in values
+    )
+    fingerprint = repr((client_id, request.path, params, vary)).encode('utf-8')
+    digest = hashlib.sha1(fingerprint).hexdigest()[:16]
+    return f'W/"{scope}-{version}-{digest}"'
+
+
+def not_modified(request, etag):
+    """Return a 304 response if the client's If-None-Match covers etag, else None."""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return None
+    candidates = parse_etags(header)
+    if '*' in candidates or etag in candidates:
+        return with_etag(HttpResponseNotModified(), etag)
+    return None
+
+
+def with_etag(response, etag):
+    """Attach etag and force clients to revalidate instead of reusing stale copies."""
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,88 @@
+from datetime import timedelta
+
+from django.db.models import Sum
+from django.utils import timezone
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from syncdata.models import SalesDailyCustomer, SalesDailyProduct, SalesDailyUser
+from syncdata.paging import InvalidDate, parse_day
+from syncdata.permissions import TokenOnlyPermission
+
+# Roles allowed to read client-wide sales figures
+ANALYTICS_ROLES = ("level3", "admin")
+DEFAULT_RANGE_DAYS = 30
+MAX_TOP = 100
+
+
+class SalesAnalyticsView(APIView):
+    """
+    Sales figures for the token's client, read from the daily rollup tables
+    (never from order_items), so any date range costs a few index range scans.
+    Query:
+      - from_date / to_date (YYYY-MM-DD, inclusive; default the last 30 days)
+      - user_id  limit daily_by_user and totals to one rep
+      - top      number of products / customers to rank (default 10, max 100)
+    """
+    permission_classes = [TokenOnlyPermission]
+
+    def get(self, request):
+        token = request.auth
+        client_id = str(token.get("client_id") or "").strip() if token else ""
+        role = str(token.get("role") or "").strip().lower() if token else ""
+        if not client_id:
+            return Response({"success": False, "message": "Token with client_id required"}, status=401)
+        if role not in ANALYTICS_ROLES:
+            return Response({"success": False, "message": "Not allowed"}, status=403)
+
+        try:
+            to_day = parse_day(request.GET["to_date"]) if request.GET.get("to_date") else timezone.localdate()
+            from_day = (
+                parse_day(request.GET["from_date"]) if request.GET.get("from_date")
+                else to_day - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+            )
+            top = max(1, min(int(request.GET.get("top") or 10), MAX_TOP))
+        except InvalidDate as e:
+            return Response({"success": False, "message": str(e)}, status=400)
+        except ValueError:
+            return Response({"success": False, "message": "top must be an integer"}, status=400)
+
+        span = {"client_id": client_id, "day__gte": from_day, "day__lte": to_day}
+
+        daily = SalesDailyUser.objects.filter(**span)
+        if request.GET.get("user_id"):
+            daily = daily.filter(user_id=request.GET["user_id"])
+        daily_rows = list(
+            daily.filter(order_count__gt=0)
+            .order_by("day", "user_id")
+            .values("day", "user_id", "order_count", "quantity", "total_amount")
+        )
+
+        totals = daily.aggregate(
+            order_count=Sum("order_count"), quantity=Sum("quantity"), total_amount=Sum("total_amount"),
+        )
+
+        top_products = list(
+            SalesDailyProduct.objects.filter(**span)
+            .values("product_code")
+            .annotate(quantity=Sum("quantity"), total_amount=Sum("total_amount"))
+            .filter(quantity__gt=0)
+            .order_by("-total_amount", "product_code")[:top]
+        )
+
+        top_customers = list(
+            SalesDailyCustomer.objects.filter(**span)
+            .values("customer_name")
+            .annotate(order_count=Sum("order_count"), total_amount=Sum("total_amount"))
+            .filter(order_count__gt=0)
+            .order_by("-total_amount", "customer_name")[:top]
+        )
+
+        return Response({
+            "success": True,
+            "from_date": from_day,
+            "to_date": to_day,
+            "totals": {key: value or 0 for key, value in totals.items()},
+            "daily_by_user": daily_rows,
+            "top_products": top_products,
+            "top_customers": top_customers,
+        })
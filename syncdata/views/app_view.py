@@ -6,6 +6,7 @@ from collections import defaultdict
 from syncdata.permissions import TokenOnlyPermission
 from django.db import models
 from syncdata.models import AccMaster, ManualCustomer, AccProductBatch, AccProduct
+from syncdata import versioning
 
 
 class CustomerView(APIView):
@@ -17,6 +18,11 @@ class CustomerView(APIView):
         if not client_id:
             return Response({"error": "Client ID not found in token"}, status=400)
 
+        etag = versioning.current_etag(request, client_id, versioning.CUSTOMERS)
+        cached = versioning.not_modified(request, etag)
+        if cached:
+            return cached
+
         synced = AccMaster.objects.filter(client_id=client_id).values(
             "code", "name", "phone", "address", "client_id"
         )
@@ -26,7 +32,7 @@ class CustomerView(APIView):
         ).values("code", "name", "phone", "address", "client_id")
 
         customers = list(synced) + list(manual)
-        return Response(customers)
+        return versioning.with_etag(Response(customers), etag)
 
     def post(self, request):
         try:
@@ -54,6 +60,7 @@ class CustomerView(APIView):
                 address=address,
                 phone=phone
             )
+            versioning.bump_version(client_id, versioning.CUSTOMERS)
 
             return Response({"success": True, "message": "Customer added successfully."}, status=201)
 
@@ -61,6 +68,44 @@ class CustomerView(APIView):
             print("❌ Error in POST /customers/:", str(e))
             return Response({"success": False, "message": "Server error"}, status=500)
 
+def product_json(product, batch):
+    """One catalog row with its batch (prices, price names, stock) for the product picker."""
+    return {
+        "code": product.code,
+        "name": product.name,
+        "product": product.product,
+        "brand": product.brand,
+        "unit": product.unit,
+        "taxcode": product.taxcode,
+        "defect": product.defect,
+        "company": product.company,
+        "client_id": product.client_id,
+        "batch": {
+            # ✅ quantity added here
+            "quantity": batch.quantity if batch else None,
+
+            # prices
+            "cost": batch.cost if batch else None,
+            "salesprice": batch.salesprice if batch else None,
+            "bmrp": batch.bmrp if batch else None,
+            "secondprice": batch.secondprice if batch else None,
+            "thirdprice": batch.thirdprice if batch else None,
+            "fourthprice": batch.fourthprice if batch else None,
+
+            # price names
+            "cost_name": batch.cost_name if batch else None,
+            "sales_price_name": batch.sales_price_name if batch else None,
+            "bmrp_name": batch.bmrp_name if batch else None,
+            "secondprice_name": batch.secondprice_name if batch else None,
+            "thirdprice_name": batch.thirdprice_name if batch else None,
+            "fourthprice_name": batch.fourthprice_name if batch else None,
+
+            # other info
+            "barcode": batch.barcode if batch else None,
+        } if batch else None
+    }
+
+
 class ProductView(APIView):
     permission_classes = [TokenOnlyPermission]
 
@@ -81,43 +126,6 @@ class ProductView(APIView):
         batches = AccProductBatch.objects.filter(client_id=client_id)
         batch_map = {batch.productcode: batch for batch in batches}
 
-        final_data = []
-        for product in paginated_products:
-            batch = batch_map.get(product.code)
-
-            final_data.append({
-                "code": product.code,
-                "name": product.name,
-                "product": product.product,
-                "brand": product.brand,
-                "unit": product.unit,
-                "taxcode": product.taxcode,
-                "defect": product.defect,
-                "company": product.company,
-                "client_id": product.client_id,
-                "batch": {
-                    # ✅ quantity added here
-                    "quantity": batch.quantity if batch else None,
-
-                    # prices
-                    "cost": batch.cost if batch else None,
-                    "salesprice": batch.salesprice if batch else None,
-                    "bmrp": batch.bmrp if batch else None,
-                    "secondprice": batch.secondprice if batch else None,
-                    "thirdprice": batch.thirdprice if batch else None,
-                    "fourthprice": batch.fourthprice if batch else None,
-
-                    # price names
-                    "cost_name": batch.cost_name if batch else None,
-                    "sales_price_name": batch.sales_price_name if batch else None,
-                    "bmrp_name": batch.bmrp_name if batch else None,
-                    "secondprice_name": batch.secondprice_name if batch else None,
-                    "thirdprice_name": batch.thirdprice_name if batch else None,
-                    "fourthprice_name": batch.fourthprice_name if batch else None,
-
-                    # other info
-                    "barcode": batch.barcode if batch else None,
-                } if batch else None
-            })
+        final_data = [product_json(product, batch_map.get(product.code)) for product in paginated_products]
 
         return paginator.get_paginated_response(final_data)
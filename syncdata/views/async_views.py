@@ -0,0 +1,184 @@
+"""
+Async variants of the hot endpoints, routed instead of the sync views when
+ASYNC_VIEWS is enabled (ASGI deployments). Request parsing, querysets and
+response shapes are shared with the sync views; only the I/O differs.
+
+Reads use Django's async ORM (aget/afirst/acount/async for). Writes that need
+a transaction (cart upserts) run as one sync_to_async call, since Django's
+async ORM has no async transactions yet.
+"""
+import json
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.utils.encoders import JSONEncoder
+
+from syncdata import cart_store, order_store, paging, versioning
+from syncdata.authentication import aauthenticate
+from syncdata.models import AccProduct, AccProductBatch, Cart
+from syncdata.views.app_view import product_json
+from syncdata.views.order_views import (
+    CART_SUMMARY_FIELDS, added_to_cart_response, cart_payload, cart_summary_payload, cursor_pagination,
+    numbered_page, order_claims, orders_listing, orders_response, parse_decimal,
+    request_identity,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _add_and_bump(client_id, user_id, customer_name, product_code, product_name, quantity, unit_price,
+                  customer_phone, customer_address):
+    result = cart_store.add_to_cart(
+        client_id, user_id, customer_name, product_code, product_name, quantity, unit_price,
+        customer_phone=customer_phone, customer_address=customer_address,
+    )
+    versioning.bump_version(client_id, versioning.CARTS)
+    return result
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def aadd_to_cart(request):
+    """Async add_to_cart: cached product lookups stay on the event loop; the upsert is one thread hop."""
+    t_start = time.time()
+    try:
+        data = json.loads(request.body)
+
+        user_id, client_id = request_identity(request, data)
+        customer_name = data.get('customer_name', 'Guest')
+        product_code = data.get('product_code')
+        quantity = parse_decimal(data.get('quantity', '1'))
+
+        if not user_id or not client_id or not product_code:
+            return JsonResponse({'error': 'user_id, client_id and product_code are required'}, status=400)
+
+        product = await cart_store.aresolve_product(client_id, product_code)
+        if product is None:
+            return JsonResponse({'error': f'Product with code "{product_code}" not found in database'}, status=404)
+        if not product['has_batch']:
+            return JsonResponse({'error': f'Product batch with code "{product_code}" not found in database'}, status=404)
+
+        frontend_unit_price = data.get('unit_price')
+        if frontend_unit_price is not None:
+            unit_price = parse_decimal(frontend_unit_price, '0')
+        else:
+            unit_price = cart_store.pick_unit_price(product['prices'], data.get('price_key'))
+
+        cart_id, cart_item = await sync_to_async(_add_and_bump)(
+            client_id, user_id, customer_name, product_code, product['name'], quantity, unit_price,
+            data.get('customer_phone', ''), data.get('customer_address', ''),
+        )
+
+        logger.info("aadd_to_cart total time: %.3fs", time.time() - t_start)
+        return added_to_cart_response(cart_id, cart_item, product)
+
+    except Exception as e:
+        logger.exception("Unhandled exception in aadd_to_cart")
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+async def aget_cart(request):
+    """Async get_cart (same ETag and ?summary=1 behaviour)."""
+    try:
+        user_id, client_id = request_identity(request, request.GET)
+        customer_name = request.GET.get('customer_name', 'Guest')
+
+        version = await versioning.aget_version(client_id, versioning.CARTS)
+        etag = versioning.current_etag(request, client_id, versioning.CARTS, version=version)
+        cached = versioning.not_modified(request, etag)
+        if cached:
+            return cached
+
+        carts = Cart.objects.filter(customer_name=customer_name, user_id=user_id, client_id=client_id)
+
+        if request.GET.get('summary') in ('1', 'true'):
+            summary = await carts.values(*CART_SUMMARY_FIELDS).afirst()
+            return versioning.with_etag(JsonResponse({
+                'success': True,
+                'cart': cart_summary_payload(summary, customer_name)
+            }), etag)
+
+        cart = await carts.prefetch_related('items').afirst()
+        return versioning.with_etag(JsonResponse({
+            'success': True,
+            'cart': cart_payload(cart, customer_name)
+        }), etag)
+
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+async def aget_orders(request):
+    """Async get_orders (same filters, role rules, pagination modes and ETag)."""
+    try:
+        claims, error = order_claims(request)
+        if error:
+            return error
+        user_id, client_id, role = claims
+
+        version = await versioning.aget_version(client_id, versioning.ORDERS)
+        etag = versioning.current_etag(request, client_id, versioning.ORDERS, role, user_id, version=version)
+        cached = versioning.not_modified(request, etag)
+        if cached:
+            return cached
+
+        listing, error = orders_listing(request, user_id, client_id, role)
+        if error:
+            return error
+
+        pagination = None
+        if listing['order_id']:
+            rows = [row async for row in listing['rows_qs']]
+        elif listing['cursor'] is not None:
+            try:
+                rows, next_cursor = await paging.akeyset_page(
+                    listing['rows_qs'], listing['cursor'], listing['per_page'], 'updated_at'
+                )
+            except paging.InvalidCursor:
+                return JsonResponse({'error': 'Invalid cursor'}, status=400)
+            pagination = cursor_pagination(listing, next_cursor)
+            if listing['include_total']:
+                pagination['total_count'] = await paging.acached_count(
+                    listing['orders_qs'], client_id, version, listing['count_key']
+                )
+        else:
+            count = await paging.acached_count(listing['orders_qs'], client_id, version, listing['count_key'])
+            page_obj, pagination = numbered_page(listing, count)
+            rows = [row async for row in page_obj.object_list]
+
+        items = await order_store.aitems_by_order([row['id'] for row in rows])
+        return orders_response(rows, items, pagination, etag)
+    except Exception as e:
+        logger.exception("Unhandled exception in aget_orders")
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET"])
+async def aproducts(request):
+    """Async ProductView.get: same response shape (one page holding every product)."""
+    if not request.headers.get("Authorization"):
+        return JsonResponse({"error": "Client ID not found in token"}, status=400)
+    try:
+        claims = await aauthenticate(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({'detail': str(e.detail)}, status=401)
+    client_id = str(claims.get("client_id"))
+
+    products = [product async for product in AccProduct.objects.filter(client_id=client_id).order_by("code")]
+    batch_map = {batch.productcode: batch async for batch in AccProductBatch.objects.filter(client_id=client_id)}
+
+    return JsonResponse({
+        "count": len(products),
+        "next": None,
+        "previous": None,
+        "results": [product_json(product, batch_map.get(product.code)) for product in products],
+    }, encoder=JSONEncoder)
@@ -8,7 +8,10 @@ from rest_framework import status
 from rest_framework_simplejwt.tokens import AccessToken
 
 from syncdata.models import AccUsers, ClientLicense
-from syncdata.license_check import sync_licenses_from_server, validate_client_license
+from django.conf import settings
+from syncdata import sharding
+from syncdata.authentication import license_claims
+from syncdata.license_check import validate_client_license
 
 logger = logging.getLogger(__name__)
 
@@ -52,54 +55,59 @@ class LoginView(APIView):
                     "message": "user_id, password, and client_id are required."
                 }, status=status.HTTP_400_BAD_REQUEST)
 
-            try:
-                # Note: AccUsers.pass_field maps to DB column 'pass'
-                user = AccUsers.objects.get(id=user_id, pass_field=password, client_id=client_id)
-            except AccUsers.DoesNotExist:
-                logger.debug("Login failed for user_id=%s client_id=%s", user_id, client_id)
-                return Response({
-                    "success": False,
-                    "message": "Invalid credentials."
-                }, status=status.HTTP_401_UNAUTHORIZED)
-
-            # ENFORCE: user must have a non-empty role
-            if not user.role or str(user.role).strip() == "":
-                logger.info("Login blocked: user %s (client %s) has no role set", user_id, client_id)
-                return Response({
-                    "success": False,
-                    "message": "No role assigned. Contact administrator."
-                }, status=status.HTTP_403_FORBIDDEN)
-
-            # 🆕 LICENSE CHECK: sync from activation server first, then check locally
-            sync_licenses_from_server()  # pull latest from activate.imcbs.com
+            # the user and license rows live in the client's shard (see syncdata.sharding)
+            with sharding.tenant(client_id):
+                try:
+                    # Note: AccUsers.pass_field maps to DB column 'pass'
+                    user = AccUsers.objects.get(id=user_id, pass_field=password, client_id=client_id)
+                except AccUsers.DoesNotExist:
+                    logger.debug("Login failed for user_id=%s client_id=%s", user_id, client_id)
+                    return Response({
+                        "success": False,
+                        "message": "Invalid credentials."
+                    }, status=status.HTTP_401_UNAUTHORIZED)
+
+                # ENFORCE: user must have a non-empty role
+                if not user.role or str(user.role).strip() == "":
+                    logger.info("Login blocked: user %s (client %s) has no role set", user_id, client_id)
+                    return Response({
+                        "success": False,
+                        "message": "No role assigned. Contact administrator."
+                    }, status=status.HTTP_403_FORBIDDEN)
+
+                # 🆕 LICENSE CHECK: local table only; `manage.py refresh_licenses`
+                # keeps it in sync with activate.imcbs.com in the background
+                is_valid, lic_message = validate_client_license(client_id)
+                if not is_valid:
+                    logger.warning("Login blocked for client_id=%s: %s", client_id, lic_message)
+                    return Response({
+                        "success": False,
+                        "message": f"License error: {lic_message}. Please contact support."
+                    }, status=status.HTTP_403_FORBIDDEN)
+
+                # Normalize role: remove spaces, lowercase (ex: "Level 3" → "level3")
+                normalized_role = str(user.role).strip().lower().replace(" ", "")
+
+                # Create JWT and include claims
+                token = AccessToken()
+                token["user_id"] = str(user.id).strip()
+                token["client_id"] = str(client_id).strip()
+                token["role"] = normalized_role
+                if settings.STATELESS_AUTH:
+                    # lets CustomJWTAuthentication skip the user / license lookups
+                    for claim, value in license_claims(ClientLicense.objects.get(client_id=client_id)).items():
+                        token[claim] = value
+
+                logger.info("Created token for %s: role=%s, client=%s", user.id, token["role"], token["client_id"])
 
-            is_valid, lic_message = validate_client_license(client_id)
-            if not is_valid:
-                logger.warning("Login blocked for client_id=%s: %s", client_id, lic_message)
                 return Response({
-                    "success": False,
-                    "message": f"License error: {lic_message}. Please contact support."
-                }, status=status.HTTP_403_FORBIDDEN)
-
-            # Normalize role: remove spaces, lowercase (ex: "Level 3" → "level3")
-            normalized_role = str(user.role).strip().lower().replace(" ", "")
-
-            # Create JWT and include claims
-            token = AccessToken()
-            token["user_id"] = str(user.id).strip()
-            token["client_id"] = str(client_id).strip()
-            token["role"] = normalized_role
-
-            logger.info("Created token for %s: role=%s, client=%s", user.id, token["role"], token["client_id"])
-
-            return Response({
-                "success": True,
-                "message": "Login successful",
-                "access": str(token),          # <-- IMPORTANT FIX (was: token)
-                "user_id": str(user.id).strip(),
-                "client_id": str(user.client_id).strip(),
-                "role": normalized_role        # <-- return normalized role
-            }, status=status.HTTP_200_OK)
+                    "success": True,
+                    "message": "Login successful",
+                    "access": str(token),          # <-- IMPORTANT FIX (was: token)
+                    "user_id": str(user.id).strip(),
+                    "client_id": str(user.client_id).strip(),
+                    "role": normalized_role        # <-- return normalized role
+                }, status=status.HTTP_200_OK)
 
         except Exception as exc:
             logger.exception("Unhandled exception during login: %s", exc)
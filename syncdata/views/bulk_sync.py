@@ -1,5 +1,5 @@
 from django.db import transaction
-from django.db import connection
+from django.db import connection, router
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -7,6 +7,8 @@ from django.shortcuts import render
 import logging
 
 from syncdata.models import AccProduct, AccMaster, AccProductBatch, AccUsers
+from syncdata import cart_store, sharding, versioning
+from syncdata.authentication import invalidate_client_principals
 from syncdata.serializers import (
     AccMasterSerializer, AccProductBatchSerializer, AccUsersSerializer, AccProductSerializer
 )
@@ -116,12 +118,30 @@ class BulkSyncDataView(APIView):
                     'error': 'No table data provided'
                 }, status=status.HTTP_400_BAD_REQUEST)
 
+            # the synced tables live in the client's database; the body is parsed once, by DRF
+            with sharding.tenant(client_id):
+                paused = sharding.writes_paused(request, client_id) if sharding.sharding_enabled() else None
+                if paused:
+                    return paused
+                return self._sync(client_id, tables_data)
+
+        except Exception as e:
+            logger.exception(f"Bulk sync failed: {str(e)}")
+            return Response({
+                'success': False,
+                'error': f'Internal server error: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def _sync(self, client_id, tables_data):
+        try:
             sync_order = ['products', 'batches', 'customers', 'users']
 
             results = {}
             total_processed = 0
 
-            with transaction.atomic():
+            # every synced table lives in the client's database (see syncdata.sharding)
+            alias = router.db_for_write(AccProduct)
+            with transaction.atomic(using=alias):
                 for table_name in sync_order:
                     if table_name not in tables_data:
                         continue
@@ -164,6 +184,13 @@ class BulkSyncDataView(APIView):
                     }
                     total_processed += inserted_count
 
+                if 'customers' in results:
+                    versioning.bump_version(client_id, versioning.CUSTOMERS)
+                if 'users' in results:
+                    transaction.on_commit(lambda: invalidate_client_principals(client_id), using=alias)
+                if 'products' in results or 'batches' in results:
+                    transaction.on_commit(lambda: cart_store.invalidate_client_products(client_id), using=alias)
+
             return Response({
                 'success': True,
                 'message': f'Successfully synced {total_processed} records for client {client_id}',
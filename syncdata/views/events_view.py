@@ -0,0 +1,85 @@
+import asyncio
+import json
+import logging
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_http_methods
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import TokenError
+
+from syncdata import sharding
+from syncdata.authentication import StreamTicket, aauthenticate
+from syncdata.events import broker
+from syncdata.permissions import ClientTokenPermission
+
+logger = logging.getLogger(__name__)
+
+
+def _frame(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventTicketView(APIView):
+    """
+    POST with the access token in the Authorization header; returns a
+    short-lived stream ticket for /api/events/?ticket=..., so the long-lived
+    access token never appears in a URL.
+    """
+    permission_classes = [ClientTokenPermission]
+
+    def post(self, request):
+        ticket = StreamTicket.for_access_token(request.auth)
+        return Response({"ticket": str(ticket), "expires_in": int(StreamTicket.lifetime.total_seconds())})
+
+
+@require_http_methods(["GET"])
+async def order_events(request):
+    """
+    Server-sent events for the ticket's client. After every committed change
+    the server sends an event named after the data scope ("orders", "carts",
+    "customers") with its new version; dashboards refetch on receipt instead
+    of polling. "resync" means events were dropped and a full reload is due.
+    Requires the ASGI entry point (config.asgi). Events published in other
+    worker processes are not delivered (see events.Broker).
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Live events require the ASGI server'}, status=501)
+
+    try:
+        ticket = StreamTicket((request.GET.get("ticket") or "").strip())
+    except TokenError:
+        return JsonResponse({'error': 'Invalid or expired stream ticket'}, status=401)
+    try:
+        # the ticket is not a Bearer token, so TenantMiddleware did not route this request
+        with sharding.tenant(ticket.get("client_id")):
+            claims = await aauthenticate(request, token=ticket)
+    except AuthenticationFailed as e:
+        return JsonResponse({'error': str(e.detail)}, status=401)
+    client_id = str(claims.get("client_id"))
+
+    heartbeat = settings.EVENTS_HEARTBEAT_SECONDS
+
+    async def stream():
+        subscription = broker.subscribe(client_id)
+        try:
+            yield "retry: 3000\n\n"
+            yield _frame("ready", {"client_id": client_id})
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(subscription.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    # keeps proxies from closing an idle connection
+                    yield ": ping\n\n"
+                    continue
+                yield _frame(event, data)
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx: flush each event
+    return response
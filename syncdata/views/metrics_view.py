@@ -0,0 +1,30 @@
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from syncdata.authentication import license_revisions
+from syncdata.cache import cache_stats
+from syncdata.db_pool import pool_stats
+from syncdata.events import broker
+from syncdata.license_check import license_sync_status
+from syncdata.permissions import TokenOnlyPermission
+
+# Roles allowed to read internal metrics
+METRICS_ROLES = ("level3", "admin")
+
+
+class MetricsView(APIView):
+    """Internal per-process metrics (cache hit/miss counters, live event subscribers, DB pools, license refresh)."""
+    permission_classes = [TokenOnlyPermission]
+
+    def get(self, request):
+        role = (request.auth.get("role") or "").strip().lower() if request.auth else ""
+        if role not in METRICS_ROLES:
+            return Response({"success": False, "message": "Not allowed"}, status=403)
+
+        return Response({
+            "success": True,
+            "caches": cache_stats(),
+            "events": broker.stats(),
+            "db_pools": pool_stats(),
+            "license_sync": license_sync_status(),
+            "stateless_auth": license_revisions.stats(),
+        })
@@ -9,12 +9,12 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse, HttpResponseBadRequest
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.db import transaction
-from django.db.models import F
+from django.db import router, transaction
 from django.utils import timezone
 from django.core.paginator import Paginator
 
-from syncdata.models import Order, OrderItem, Cart, CartItem, AccProduct, AccProductBatch, ManualCustomer
+from syncdata.models import Order, OrderItem, Cart, CartItem, ManualCustomer
+from syncdata import cart_store, order_store, paging, versioning
 
 logger = logging.getLogger(__name__)
 
@@ -35,177 +35,154 @@ def dec_to_json(d):
     return d
 
 
+def request_identity(request, params):
+    """
+    (user_id, client_id) of a cart/order call: the claims TokenClaimsMiddleware
+    decoded from the Bearer token. Requests with an invalid token never get
+    here (401); only requests without an Authorization header take the
+    legacy_identity path.
+    """
+    claims = getattr(request, 'claims', None)
+    if claims:
+        return claims['user_id'], claims['client_id']
+    return legacy_identity(params)
+
+
+def legacy_identity(params):
+    """
+    (user_id, client_id) sent in params (JSON body or query string), for app
+    builds that predate tokens. The caller controls these values, so only
+    token-less requests may use them.
+    """
+    return params.get('user_id'), params.get('client_id')
+
+
+def client_required():
+    return JsonResponse({'error': 'client_id is required (token or request body)'}, status=400)
+
+
+def cart_payload(cart, customer_name='Guest'):
+    """Serialize a cart and its items for JSON responses (empty cart when cart is None)."""
+    if cart is None:
+        return {
+            'id': None,
+            'customer_name': customer_name,
+            'customer_phone': '',
+            'customer_address': '',
+            'items': [],
+            'item_count': 0,
+            'total_quantity': '0.000',
+            'total_amount': 0
+        }
+
+    cart_items = []
+    for item in cart.items.all():
+        cart_items.append({
+            'id': item.id,
+            'product_code': item.product_code,
+            'product_name': item.product_name,
+            'quantity': str(item.quantity),
+            'unit_price': dec_to_json(item.unit_price),
+            'total_price': dec_to_json((item.unit_price or Decimal('0')) * (item.quantity or Decimal('0')))
+        })
+
+    return {
+        'id': cart.id,
+        'customer_name': cart.customer_name,
+        'customer_phone': cart.customer_phone,
+        'customer_address': cart.customer_address,
+        'items': cart_items,
+        'item_count': cart.item_count,
+        'total_quantity': str(cart.total_quantity),
+        'total_amount': dec_to_json(cart.total_amount)
+    }
+
+
+def added_to_cart_response(cart_id, cart_item, product):
+    """Response for a successful add_to_cart (cart_item=None when the line was removed)."""
+    if cart_item is None:
+        logger.debug("CartItem removed because quantity <= 0")
+        return JsonResponse({'success': True, 'message': 'Product removed from cart'})
+
+    # --- Compute line total (Decimal) ---
+    line_total = (cart_item['unit_price'] or Decimal('0')) * (cart_item['quantity'] or Decimal('0'))
+
+    return JsonResponse({
+        'success': True,
+        'message': 'Product added to cart',
+        'cart_id': cart_id,
+        'cart_item': {
+            'id': cart_item['id'],
+            'product_code': cart_item['product_code'],
+            'product_name': cart_item['product_name'],
+            'quantity': str(cart_item['quantity']),              # preserve 3dp
+            'unit_price': dec_to_json(cart_item['unit_price']),  # -> float with 2dp
+            'line_total': dec_to_json(line_total),               # -> float with 2dp
+            'barcode': product['barcode'],
+        },
+    })
+
+
+CART_SUMMARY_FIELDS = ('id', 'item_count', 'total_quantity', 'total_amount')
+
+
+def cart_summary_payload(summary, customer_name='Guest'):
+    """Totals-only cart JSON for get_cart?summary=1 (summary is a CART_SUMMARY_FIELDS row or None)."""
+    return {
+        'id': summary['id'] if summary else None,
+        'customer_name': customer_name,
+        'item_count': summary['item_count'] if summary else 0,
+        'total_quantity': str(summary['total_quantity']) if summary else '0.000',
+        'total_amount': dec_to_json(summary['total_amount']) if summary else 0
+    }
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def add_to_cart(request):
-    """Add product to cart (Decimal-safe, robust to custom PK names, optimized)."""
+    """Add product to cart (one product/price query plus a single upsert for the cart line)."""
     t_start = time.time()
     try:
         data = json.loads(request.body)
 
-        user_id = data.get('user_id')
-        client_id = data.get('client_id')
+        user_id, client_id = request_identity(request, data)
         customer_name = data.get('customer_name', 'Guest')
         customer_phone = data.get('customer_phone', '')
         customer_address = data.get('customer_address', '')
 
-        # We don't create an Order when adding to cart
-        order = None
-
         product_code = data.get('product_code')
         quantity = parse_decimal(data.get('quantity', '1'))
 
         if not user_id or not client_id or not product_code:
             return JsonResponse({'error': 'user_id, client_id and product_code are required'}, status=400)
 
-        # Determine safe PK field names (models may use custom PK names)
-        accprod_pk = AccProduct._meta.pk.name
-        accbatch_pk = AccProductBatch._meta.pk.name
-
-        # --- Product lookup (fetch minimal fields safely) ---
-        t0 = time.time()
-        product = (
-            AccProduct.objects
-            .filter(code=product_code, client_id=client_id)
-            .only(accprod_pk, 'code', 'name', 'client_id')
-            .first()
-        )
-        if not product:
-            product = (
-                AccProduct.objects
-                .filter(code=product_code)
-                .only(accprod_pk, 'code', 'name', 'client_id')
-                .first()
-            )
-            if not product:
-                return JsonResponse({'error': f'Product with code "{product_code}" not found in database'}, status=404)
-            if product.client_id != client_id:
-                return JsonResponse({'error': f'Product found but belongs to client {product.client_id}, not {client_id}'}, status=404)
-        logger.debug("Product lookup took %.3fs", time.time() - t0)
-
-        # --- Batch lookup (highest price preferred) ---
+        # --- Product + price tiers (single client-scoped query) ---
         t0 = time.time()
-        try:
-            product_batch = (
-                AccProductBatch.objects
-                .filter(productcode=product_code, client_id=client_id)
-                .only(accbatch_pk, 'productcode', 'client_id', 'salesprice', 'cost',
-                      'bmrp', 'secondprice', 'thirdprice', 'fourthprice', 'barcode')
-                .order_by('-salesprice')
-                .first()
-            )
-            if not product_batch:
-                product_batch = (
-                    AccProductBatch.objects
-                    .filter(productcode=product_code)
-                    .only(accbatch_pk, 'productcode', 'client_id', 'salesprice', 'cost',
-                          'bmrp', 'secondprice', 'thirdprice', 'fourthprice', 'barcode')
-                    .order_by('-salesprice')
-                    .first()
-                )
-                if not product_batch:
-                    return JsonResponse({'error': f'Product batch with code "{product_code}" not found in database'}, status=404)
-                if product_batch.client_id != client_id:
-                    return JsonResponse({'error': f'Product batch found but belongs to client {product_batch.client_id}, not {client_id}'}, status=404)
-        except Exception as e:
-            logger.exception("Error during product_batch lookup")
-            return JsonResponse({'error': f'Error finding product batch: {str(e)}'}, status=500)
-        logger.debug("Batch lookup took %.3fs", time.time() - t0)
+        product = cart_store.resolve_product(client_id, product_code)
+        if product is None:
+            return JsonResponse({'error': f'Product with code "{product_code}" not found in database'}, status=404)
+        if not product['has_batch']:
+            return JsonResponse({'error': f'Product batch with code "{product_code}" not found in database'}, status=404)
+        logger.debug("Product/price lookup took %.3fs", time.time() - t0)
 
         # --- Determine unit price (prefer frontend, else fallback by key order) ---
-        price_key = data.get('price_key')
         frontend_unit_price = data.get('unit_price')
-
         if frontend_unit_price is not None:
             unit_price = parse_decimal(frontend_unit_price, '0')
         else:
-            def get_batch_price(batch, key):
-                if not batch or not key:
-                    return None
-                return getattr(batch, key, None)
-
-            preferred_order = (
-                [price_key, 'cost', 'salesprice', 'bmrp', 'secondprice', 'thirdprice', 'fourthprice']
-                if price_key and price_key != 'all'
-                else ['cost', 'salesprice', 'bmrp', 'secondprice', 'thirdprice', 'fourthprice']
-            )
-
-            unit_price_val = None
-            for k in preferred_order:
-                val = get_batch_price(product_batch, k)
-                if val is not None:
-                    unit_price_val = val
-                    break
-
-            unit_price = parse_decimal(unit_price_val, '0')
-
-        # --- Get or create cart ---
-        t0 = time.time()
-        cart, _ = Cart.objects.get_or_create(
-            customer_name=customer_name,
-            user_id=user_id,
-            client_id=client_id,
-            defaults={
-                'customer_phone': customer_phone,
-                'customer_address': customer_address,
-            },
-        )
-        logger.debug("Cart get_or_create took %.3fs", time.time() - t0)
+            unit_price = cart_store.pick_unit_price(product['prices'], data.get('price_key'))
 
-        # --- Add or update cart item (upsert + atomic increment if exists) ---
+        # --- Upsert cart + cart line (atomic increment on conflict) ---
         t0 = time.time()
-        cart_item, created = CartItem.objects.update_or_create(
-            cart=cart,
-            product_code=product_code,
-            defaults={
-                'product_name': product.name or '',
-                'quantity': quantity,     # initial quantity for created rows
-                'unit_price': unit_price,
-            },
+        cart_id, cart_item = cart_store.add_to_cart(
+            client_id, user_id, customer_name, product_code, product['name'], quantity, unit_price,
+            customer_phone=customer_phone, customer_address=customer_address,
         )
-
-        if not created:
-            # increment quantity atomically and update unit_price
-            CartItem.objects.filter(pk=cart_item.pk).update(
-                quantity=F('quantity') + quantity,
-                unit_price=unit_price
-            )
-            cart_item.refresh_from_db()
-
-            if (cart_item.quantity or Decimal('0')) <= 0:
-                cart_item.delete()
-                logger.debug("CartItem removed because quantity <= 0 after update")
-                return JsonResponse({'success': True, 'message': 'Product removed from cart'})
-        else:
-            # guard against zero/negative quantity on creation
-            if (cart_item.quantity or Decimal('0')) <= 0:
-                cart_item.delete()
-                logger.debug("CartItem removed because quantity <= 0 on create")
-                return JsonResponse({'success': True, 'message': 'Product removed from cart'})
-
-        logger.debug("CartItem upsert took %.3fs", time.time() - t0)
-
-        # --- Compute line total (Decimal) ---
-        line_total = (cart_item.unit_price or Decimal('0')) * (cart_item.quantity or Decimal('0'))
-
-        # --- Response ---
-        barcode_val = getattr(product_batch, 'barcode', None) if product_batch else None
+        versioning.bump_version(client_id, versioning.CARTS)
+        logger.debug("Cart upsert took %.3fs", time.time() - t0)
 
         logger.info("add_to_cart total time: %.3fs", time.time() - t_start)
-        return JsonResponse({
-            'success': True,
-            'message': 'Product added to cart',
-            'cart_id': cart.id,
-            'cart_item': {
-                'id': cart_item.id,
-                'product_code': cart_item.product_code,
-                'product_name': cart_item.product_name,
-                'quantity': str(cart_item.quantity),              # preserve 3dp
-                'unit_price': dec_to_json(cart_item.unit_price),  # -> float with 2dp
-                'line_total': dec_to_json(line_total),            # -> float with 2dp
-                'barcode': barcode_val,
-            },
-        })
+        return added_to_cart_response(cart_id, cart_item, product)
 
     except Exception as e:
         logger.exception("Unhandled exception in add_to_cart")
@@ -215,61 +192,40 @@ def add_to_cart(request):
 @csrf_exempt
 @require_http_methods(["GET"])
 def get_cart(request):
-    """Get cart items for a customer"""
+    """
+    Get cart items for a customer.
+    With ?summary=1 only the maintained totals row is read (header badge).
+    """
     try:
-        user_id = request.GET.get('user_id')
-        client_id = request.GET.get('client_id')
+        user_id, client_id = request_identity(request, request.GET)
         customer_name = request.GET.get('customer_name', 'Guest')
-        
-        try:
-            cart = Cart.objects.get(
-                customer_name=customer_name,
-                user_id=user_id,
-                client_id=client_id
-            )
-            
-            cart_items = []
-            for item in cart.items.all():
-                cart_items.append({
-                    'id': item.id,
-                    'product_code': item.product_code,
-                    'product_name': item.product_name,
-                    'quantity': str(item.quantity),
-                    'unit_price': dec_to_json(item.unit_price),
-                    'total_price': dec_to_json((item.unit_price or Decimal('0')) * (item.quantity or Decimal('0')))
-                })
-
-            total_amount = sum(
-                (item['total_price'] if isinstance(item['total_price'], (int, float)) else float(item['total_price']))
-                for item in cart_items
-            ) if cart_items else 0.0
 
-            return JsonResponse({
-                'success': True,
-                'cart': {
-                    'id': cart.id,
-                    'customer_name': cart.customer_name,
-                    'customer_phone': cart.customer_phone,
-                    'customer_address': cart.customer_address,
-                    'items': cart_items,
-                    'total_amount': total_amount
-                }
-            })
+        # Conditional GET: answer from the version table when nothing changed
+        etag = versioning.current_etag(request, client_id, versioning.CARTS)
+        cached = versioning.not_modified(request, etag)
+        if cached:
+            return cached
 
-            
-        except Cart.DoesNotExist:
-            return JsonResponse({
+        carts = Cart.objects.filter(
+            customer_name=customer_name,
+            user_id=user_id,
+            client_id=client_id
+        )
+
+        if request.GET.get('summary') in ('1', 'true'):
+            summary = carts.values(*CART_SUMMARY_FIELDS).first()
+            return versioning.with_etag(JsonResponse({
                 'success': True,
-                'cart': {
-                    'id': None,
-                    'customer_name': customer_name,
-                    'customer_phone': '',
-                    'customer_address': '',
-                    'items': [],
-                    'total_amount': 0
-                }
-            })
-            
+                'cart': cart_summary_payload(summary, customer_name)
+            }), etag)
+
+        cart = carts.first()
+
+        return versioning.with_etag(JsonResponse({
+            'success': True,
+            'cart': cart_payload(cart, customer_name)
+        }), etag)
+
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -281,16 +237,19 @@ def update_cart_item(request):
         data = json.loads(request.body)
         item_id = data.get('item_id')
         quantity = parse_decimal(data.get('quantity', '1'))
+        _, client_id = request_identity(request, data)
+        if not client_id:
+            return client_required()
 
-        
         if quantity <= 0:
             # Remove item if quantity is 0 or negative
             return remove_cart_item(request)
         
-        cart_item = CartItem.objects.get(id=item_id)
-        cart_item.quantity = quantity
-        cart_item.save()
-        
+        client_id = cart_store.set_line_quantity(item_id, quantity, client_id=client_id)
+        if client_id is None:
+            return JsonResponse({'error': 'Cart item not found'}, status=404)
+        versioning.bump_version(client_id, versioning.CARTS)
+
         return JsonResponse({
             'success': True,
             'message': 'Cart item updated'
@@ -308,9 +267,8 @@ def remove_cart_item(request):
     try:
         data = json.loads(request.body)
 
-        item_id = data.get('product_code')
-        client_id = data.get('client_id')
-        user_id = data.get('user_id')
+        product_code = data.get('product_code')
+        user_id, client_id = request_identity(request, data)
         customer_name = data.get('customer_name')
 
         cart = Cart.objects.get(
@@ -319,12 +277,10 @@ def remove_cart_item(request):
             client_id=client_id
         )
 
-        print(cart)
-            
-        for item in cart.items.all():
-            if (item.product_code == item_id):
-                item.delete()
-        
+        # Single DELETE instead of loading every line to find one product_code
+        cart_store.remove_lines(cart.id, [product_code])
+        versioning.bump_version(client_id, versioning.CARTS)
+
         return JsonResponse({
             'success': True,
             'message': 'Item removed from cart'
@@ -341,8 +297,7 @@ def clear_cart(request):
     """Clear entire cart"""
     try:
         data = json.loads(request.body)
-        user_id = data.get('user_id')
-        client_id = data.get('client_id')
+        user_id, client_id = request_identity(request, data)
         customer_name = data.get('customer_name', 'Guest')
         
         try:
@@ -353,6 +308,7 @@ def clear_cart(request):
             )
             cart.items.all().delete()
             cart.delete()
+            versioning.bump_version(client_id, versioning.CARTS)
         except Cart.DoesNotExist:
             pass
         
@@ -364,14 +320,61 @@ def clear_cart(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def batch_update_cart(request):
+    """
+    Apply an ordered list of cart operations in one transaction and return the cart.
+
+    Expected JSON body:
+    {
+        "user_id": "...", "client_id": "...", "customer_name": "...",
+        "operations": [
+            {"op": "add", "product_code": "P1", "quantity": "2", "price_key": "salesprice"},
+            {"op": "set", "product_code": "P2", "quantity": "5"},
+            {"op": "remove", "product_code": "P3"}
+        ]
+    }
+    """
+    try:
+        data = json.loads(request.body)
+        user_id, client_id = request_identity(request, data)
+        customer_name = data.get('customer_name', 'Guest')
+
+        if not user_id or not client_id:
+            return JsonResponse({'error': 'user_id and client_id are required'}, status=400)
+
+        try:
+            cart_id = cart_store.apply_operations(
+                client_id, user_id, customer_name, data.get('operations'),
+                customer_phone=data.get('customer_phone', ''),
+                customer_address=data.get('customer_address', ''),
+            )
+        except cart_store.CartOperationError as e:
+            return JsonResponse({'error': str(e), 'operation_index': e.index}, status=e.status)
+
+        versioning.bump_version(client_id, versioning.CARTS)
+
+        cart = Cart.objects.filter(id=cart_id).prefetch_related('items').first() if cart_id else None
+        return JsonResponse({
+            'success': True,
+            'message': 'Cart updated',
+            'cart': cart_payload(cart, customer_name)
+        })
+
+    except Exception as e:
+        logger.exception("Unhandled exception in batch_update_cart")
+        return JsonResponse({'error': str(e)}, status=500)
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def place_order(request):
     """Place order from cart (PERCENT discount fixed — stores correct discount_pct)"""
     try:
         data = json.loads(request.body)
-        user_id = data.get('user_id')
-        client_id = data.get('client_id')
+        user_id, client_id = request_identity(request, data)
         customer_name = data.get('customer_name', 'Guest')
         customer_phone = data.get('customer_phone', '')
         customer_address = data.get('customer_address', '')
@@ -381,7 +384,7 @@ def place_order(request):
         discount_client = Decimal(str(data.get('discount') or '0'))  # THIS IS % NOW
         final_total_client = Decimal(str(data.get('final_total') or '0'))
 
-        with transaction.atomic():
+        with transaction.atomic(using=router.db_for_write(Cart)):
 
             # -------- GET CART --------
             try:
@@ -393,25 +396,6 @@ def place_order(request):
             except Cart.DoesNotExist:
                 return JsonResponse({'error': 'Cart not found'}, status=404)
 
-            # -------- BUILD LINES --------
-            server_subtotal = Decimal('0.00')
-            lines = []
-
-            for ci in cart.items.all():
-                qty = ci.quantity or Decimal('0')
-                price = ci.unit_price or Decimal('0')
-                orig_total = (qty * price).quantize(Decimal('0.01'))
-
-                lines.append({
-                    "code": ci.product_code,
-                    "name": ci.product_name,
-                    "qty": qty,
-                    "unit": price,
-                    "orig_total": orig_total,
-                })
-
-                server_subtotal += orig_total
-
             # -------- FIXED: DISCOUNT = PERCENT --------
             # If user enters 20 → means 20%
             discount_pct_value = discount_client.quantize(Decimal('0.01'))  # store directly
@@ -433,7 +417,7 @@ def place_order(request):
 
             # 🔴 If order_id is provided at all, always load that order
             if order_id:
-                order = Order.objects.filter(id=order_id, client_id=client_id).first()
+                order = Order.objects.select_for_update().filter(id=order_id, client_id=client_id).first()
 
                 # If order exists and is NOT pending → block any modification
                 if order and order.status.strip().lower() != "pending":
@@ -443,7 +427,8 @@ def place_order(request):
                     )
 
             # If we didn't find an order (no order_id, or invalid id) → create new one
-            if order is None:
+            new_order = order is None
+            if new_order:
                 order_number = f"ORD-{timezone.localdate().strftime('%Y%m%d')}-{uuid.uuid4().hex[:8].upper()}"
                 order = Order.objects.create(
                     order_number=order_number,
@@ -457,37 +442,11 @@ def place_order(request):
                 )
 
 
-            # -------- SAVE ORDER ITEMS WITH CORRECT DISCOUNT --------
-            for ln in lines:
-                discounted_line = (
-                    ln['orig_total'] * (Decimal('1') - ratio)
-                ).quantize(Decimal('0.01'))
-
-                oi = OrderItem.objects.filter(order=order, product_code=ln['code']).first()
-
-                if oi:
-                    oi.quantity = oi.quantity + ln['qty']
-                    oi.unit_price = ln['unit']
-                    oi.total_price = discounted_line
-                    oi.discount_pct = discount_pct_value
-                    oi.save()
-                else:
-                    OrderItem.objects.create(
-                        order=order,
-                        product_code=ln['code'],
-                        product_name=ln['name'],
-                        quantity=ln['qty'],
-                        unit_price=ln['unit'],
-                        total_price=discounted_line,
-                        discount_pct=discount_pct_value
-                    )
-
-            # -------- UPDATE ORDER TOTAL --------
-            order.total_amount = sum(i.total_price for i in order.items.all())
-            order.save()
-
-            # -------- CLEAR CART --------
-            cart.delete()
+            # -------- MERGE CART LINES, SUM TOTAL IN SQL, CLEAR CART --------
+            # (one bulk upsert keyed by (order, product_code); query count is
+            # independent of the number of lines)
+            order.total_amount = order_store.place_from_cart(order, cart, discount_pct_value, ratio, new_order)
+            versioning.bump_version(client_id, versioning.CARTS, versioning.ORDERS)
 
             return JsonResponse({
                 'success': True,
@@ -502,145 +461,195 @@ def place_order(request):
 
 
 
+def _order_json(row, item_rows):
+    """JSON shape of one order row from order_store.with_item_stats / items_by_order."""
+    return {
+        'id': row['id'],
+        'order_number': row['order_number'],
+        'customer_name': row['customer_name'],
+        'customer_phone': row['customer_phone'],
+        'customer_address': row['customer_address'],
+        'total_amount': float(row['total_amount']),
+        'status': row['status'],
+        'created_at': timezone.localtime(row['created_at']).isoformat() if row['created_at'] else None,
+        'updated_at': timezone.localtime(row['updated_at']).isoformat() if row['updated_at'] else None,
+        'items': [
+            {
+                'id': item_id,
+                'product_code': product_code,
+                'product_name': product_name,
+                'quantity': float(quantity),
+                'unit_price': float(unit_price),
+                'total_price': float(total_price)
+            }
+            for _, item_id, product_code, product_name, quantity, unit_price, total_price in item_rows
+        ],
+        'item_count': row['item_count'],
+        'total_quantity': float(row['total_quantity']),
+        'user_id': row['user_id'],
+    }
+
+
+def order_claims(request):
+    """
+    (user_id, client_id, role) for an order listing: the Bearer token's claims
+    (decoded once by TokenClaimsMiddleware), or the query params on the
+    token-less legacy path. Returns ((user_id, client_id, role), None) or
+    (None, error JsonResponse).
+    """
+    claims = getattr(request, "claims", None)
+    if claims:
+        user_id, client_id, token_role = claims["user_id"], claims["client_id"], claims["role"]
+    else:
+        # Query params (trimmed)
+        user_id, client_id = ((value or "").strip() for value in legacy_identity(request.GET))
+        token_role = ""
+
+    # Require client_id at least
+    if not client_id:
+        return None, JsonResponse({'error': 'client_id is required (token or query param).'}, status=400)
+
+    # If token provided, require role to be present (defense-in-depth)
+    if claims and not token_role:
+        return None, JsonResponse({'error': 'No role assigned. Access denied.'}, status=403)
+
+    return (user_id, client_id, token_role), None
+
+
+def orders_listing(request, user_id, client_id, role):
+    """
+    Filtered, ordered (lazy) querysets and paging parameters for get_orders.
+    Returns (listing dict, None) or (None, error JsonResponse).
+    """
+    # Determine permissions
+    full_access_roles = ("level3", "admin")
+    can_view_all_client_orders = role in full_access_roles
+
+    # Build base queryset
+    if can_view_all_client_orders:
+        orders_qs = Order.objects.filter(client_id=client_id)
+    else:
+        if not user_id:
+            return None, JsonResponse({'error': 'user_id is required for non-admin users'}, status=400)
+        orders_qs = Order.objects.filter(client_id=client_id, user_id=user_id)
+
+    # Optional filters
+    order_id = request.GET.get('order_id')
+    status_filter = request.GET.get('status', '')
+    from_date = request.GET.get('from_date')
+    to_date = request.GET.get('to_date')
+
+    if order_id:
+        orders_qs = orders_qs.filter(id=order_id)
+    if status_filter:
+        orders_qs = orders_qs.filter(status=status_filter)
+    try:
+        orders_qs = orders_qs.filter(**paging.day_range('updated_at', from_date, to_date))
+    except paging.InvalidDate as e:
+        return None, JsonResponse({'error': str(e)}, status=400)
+
+    orders_qs = orders_qs.order_by('-updated_at', '-id')
+    return {
+        'orders_qs': orders_qs,
+        # rows are values() dicts with SQL-side item_count / total_quantity
+        'rows_qs': order_store.with_item_stats(orders_qs),
+        'order_id': order_id,
+        'cursor': request.GET.get('cursor'),
+        'include_total': request.GET.get('include_total') in ('1', 'true'),
+        'page': int(request.GET.get('page', 1)),
+        'per_page': int(request.GET.get('per_page', 20)),
+        'count_key': (role, user_id, status_filter, from_date, to_date),
+    }, None
+
+
+def numbered_page(listing, count):
+    """Lazy Page for ?page=N with the (cached) total count preset, plus its pagination JSON."""
+    paginator = Paginator(listing['rows_qs'], listing['per_page'])
+    paginator.count = count
+    page_obj = paginator.get_page(listing['page'])
+    return page_obj, {
+        'current_page': page_obj.number,
+        'total_pages': paginator.num_pages,
+        'total_count': paginator.count,
+        'has_next': page_obj.has_next(),
+        'has_previous': page_obj.has_previous()
+    }
+
+
+def cursor_pagination(listing, next_cursor):
+    return {
+        'per_page': listing['per_page'],
+        'next_cursor': next_cursor,
+        'has_next': next_cursor is not None,
+    }
+
+
+def orders_response(rows, items, pagination, etag):
+    orders_data = [_order_json(row, items[row['id']]) for row in rows]
+    if pagination is None:
+        return versioning.with_etag(JsonResponse({'success': True, 'orders': orders_data}), etag)
+    return versioning.with_etag(JsonResponse({
+        'success': True,
+        'orders': orders_data,
+        'pagination': pagination
+    }), etag)
+
+
 @csrf_exempt
 @require_http_methods(["GET"])
 def get_orders(request):
     """
     Get orders with filtering and pagination (role-based visibility).
+    Pagination:
+      - ?cursor=<token> (empty for the first page) -> keyset pages on (updated_at, id)
+        with pagination.next_cursor; add include_total=1 for an exact (cached) total
+      - ?page=N -> numbered pages; the total count is cached per data version
     Role rules:
       - 'level3' or 'admin' -> can view all orders for the token client_id
       - other roles -> can only view orders where user_id == token user_id and client_id matches
       - missing/empty role -> access denied
     """
     try:
-        # 1) Extract token claims (preferred) or decode Bearer token fallback
-        token = getattr(request, "auth", None)
-        token_user_id = None
-        token_client_id = None
-        token_role = None
-
-        if token and isinstance(token, dict):
-            token_user_id = (token.get("user_id") or "").strip()
-            token_client_id = (token.get("client_id") or "").strip()
-            token_role = (token.get("role") or "").strip().lower()
-        else:
-            # Attempt to decode Bearer token from Authorization header
-            auth_header = request.META.get("HTTP_AUTHORIZATION", "")
-            if auth_header.startswith("Bearer "):
-                raw = auth_header.split(" ", 1)[1].strip()
-                try:
-                    from rest_framework_simplejwt.tokens import AccessToken as _AT
-                    claims = _AT(raw)
-                    token_user_id = str(claims.get("user_id") or "").strip()
-                    token_client_id = str(claims.get("client_id") or "").strip()
-                    token_role = str((claims.get("role") or "")).strip().lower()
-                except Exception:
-                    token_user_id = None
-                    token_client_id = None
-                    token_role = None
-
-        # 2) Query params (trimmed). Token claims authoritative when present.
-        q_user_id = (request.GET.get("user_id") or "").strip()
-        q_client_id = (request.GET.get("client_id") or "").strip()
-
-        user_id = token_user_id or q_user_id
-        client_id = token_client_id or q_client_id
-
-        # Require client_id at least
-        if not client_id:
-            return JsonResponse({'error': 'client_id is required (token or query param).'}, status=400)
-
-        # If token provided, require role to be present (defense-in-depth)
-        if token_user_id or token_client_id or token_role:
-            if not token_role:
-                return JsonResponse({'error': 'No role assigned. Access denied.'}, status=403)
-
-        role = (token_role or "").lower()
-
-        # Determine permissions
-        full_access_roles = ("level3", "admin")
-        can_view_all_client_orders = role in full_access_roles
-
-        # Build base queryset
-        if can_view_all_client_orders:
-            orders_qs = Order.objects.filter(client_id=client_id)
-        else:
-            if not user_id:
-                return JsonResponse({'error': 'user_id is required for non-admin users'}, status=400)
-            orders_qs = Order.objects.filter(client_id=client_id, user_id=user_id)
-
-        # Optional filters
-        order_id = request.GET.get('order_id')
-        status_filter = request.GET.get('status', '')
-        from_date = request.GET.get('from_date')
-        to_date = request.GET.get('to_date')
-        page = int(request.GET.get('page', 1))
-        per_page = int(request.GET.get('per_page', 20))
-
-        if order_id:
-            orders_qs = orders_qs.filter(id=order_id)
-        if status_filter:
-            orders_qs = orders_qs.filter(status=status_filter)
-        if from_date:
-            orders_qs = orders_qs.filter(updated_at__date__gte=from_date)
-        if to_date:
-            orders_qs = orders_qs.filter(updated_at__date__lte=to_date)
-
-        orders_qs = orders_qs.order_by('-updated_at')
-
-        # Pagination
-        if order_id:
-            page_obj = list(orders_qs)
-        else:
-            paginator = Paginator(orders_qs, per_page)
-            page_obj = paginator.get_page(page)
-
-        # Serialize
-        orders_data = []
-        for order in page_obj:
-            order_items = []
-            for item in order.items.all():
-                order_items.append({
-                    'id': item.id,
-                    'product_code': item.product_code,
-                    'product_name': item.product_name,
-                    'quantity': float(item.quantity) if hasattr(item, 'quantity') else item.quantity,
-                    'unit_price': float(item.unit_price),
-                    'total_price': float(item.total_price)
-                })
-
-            orders_data.append({
-            'id': order.id,
-            'order_number': order.order_number,
-            'customer_name': order.customer_name,
-            'customer_phone': order.customer_phone,
-            'customer_address': order.customer_address,
-            'total_amount': float(order.total_amount),
-            'status': order.status,
-            'created_at': timezone.localtime(order.created_at).isoformat() if order.created_at else None,
-            'updated_at': timezone.localtime(order.updated_at).isoformat() if order.updated_at else None,
-            'items': order_items,
-            'item_count': len(order_items),
-            'total_quantity': float(sum(item.quantity for item in order.items.all())),
-            'user_id': order.user_id,   # 👈 add this line
-        })
-
-
-        # Return
-        if order_id:
-            return JsonResponse({'success': True, 'orders': orders_data})
+        claims, error = order_claims(request)
+        if error:
+            return error
+        user_id, client_id, role = claims
+
+        # Conditional GET: visibility depends on role/user, so fold them into the ETag
+        version = versioning.get_version(client_id, versioning.ORDERS)
+        etag = versioning.current_etag(request, client_id, versioning.ORDERS, role, user_id, version=version)
+        cached = versioning.not_modified(request, etag)
+        if cached:
+            return cached
+
+        listing, error = orders_listing(request, user_id, client_id, role)
+        if error:
+            return error
+
+        pagination = None
+        if listing['order_id']:
+            rows = list(listing['rows_qs'])
+        elif listing['cursor'] is not None:
+            try:
+                rows, next_cursor = paging.keyset_page(
+                    listing['rows_qs'], listing['cursor'], listing['per_page'], 'updated_at'
+                )
+            except paging.InvalidCursor:
+                return JsonResponse({'error': 'Invalid cursor'}, status=400)
+            pagination = cursor_pagination(listing, next_cursor)
+            if listing['include_total']:
+                pagination['total_count'] = paging.cached_count(
+                    listing['orders_qs'], client_id, version, listing['count_key']
+                )
         else:
-            return JsonResponse({
-                'success': True,
-                'orders': orders_data,
-                'pagination': {
-                    'current_page': page_obj.number,
-                    'total_pages': page_obj.paginator.num_pages,
-                    'total_count': page_obj.paginator.count,
-                    'has_next': page_obj.has_next(),
-                    'has_previous': page_obj.has_previous()
-                }
-            })
+            # COUNT(*) is reused until the next write to this client's orders
+            count = paging.cached_count(listing['orders_qs'], client_id, version, listing['count_key'])
+            page_obj, pagination = numbered_page(listing, count)
+            rows = list(page_obj.object_list)
+
+        # Serialize (all items for the page in one query)
+        items = order_store.items_by_order([row['id'] for row in rows])
+        return orders_response(rows, items, pagination, etag)
     except Exception as e:
         logger.exception("Unhandled exception in get_orders")
         return JsonResponse({'error': str(e)}, status=500)
@@ -649,22 +658,27 @@ def get_orders(request):
 @csrf_exempt
 @require_http_methods(["POST"])
 def update_order_status(request):
-    """Update order status"""
+    """Update order status (single UPDATE)"""
     try:
         data = json.loads(request.body)
         order_id = data.get('order_id')
         new_status = data.get('status')
-        
-        order = Order.objects.get(id=order_id)
-        order.status = new_status
-        order.save()
-        
+
+        _, client_id = request_identity(request, data)
+        if not client_id:
+            return client_required()
+
+        order_store.set_status(order_id, new_status, client_id=client_id)
+        versioning.bump_version(client_id, versioning.ORDERS)
+
         return JsonResponse({
             'success': True,
             'message': 'Order status updated'
         })
-        
-    except Order.DoesNotExist:
+
+    except order_store.InvalidOrderId:
+        return JsonResponse({'error': 'order_id must be an integer'}, status=400)
+    except order_store.OrderNotFound:
         return JsonResponse({'error': 'Order not found'}, status=404)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
@@ -676,70 +690,58 @@ def delete_order(request):
     try:
         data = json.loads(request.body)
         order_id = data.get('order_id')
+        _, client_id = request_identity(request, data)
+        if not client_id:
+            return client_required()
 
-        order = Order.objects.get(id=order_id)
-
-        # 🔒 Block delete if completed
-        if order.status == 'completed':
-            return JsonResponse(
-                {'error': 'Completed orders cannot be deleted'},
-                status=400
-            )
-
-        order.delete()
+        # 🔒 Blocked if completed (checked under a row lock)
+        order_store.delete_order(order_id, client_id=client_id)
+        versioning.bump_version(client_id, versioning.ORDERS)
 
         return JsonResponse({
             'success': True,
             'message': 'Order deleted'
         })
 
-    except Order.DoesNotExist:
+    except order_store.OrderNotFound:
         return JsonResponse({'error': 'Order not found'}, status=404)
+    except order_store.OrderLocked:
+        return JsonResponse({'error': 'Completed orders cannot be deleted'}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
-    
+
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
 def update_order_item(request):
-    """Update order item quantity"""
+    """Update order item quantity (order total adjusted by the line delta)"""
     try:
         data = json.loads(request.body)
         item_id = data.get('item_id')
         quantity = parse_decimal(data.get('quantity', '1'))
+        _, client_id = request_identity(request, data)
+        if not client_id:
+            return client_required()
 
         if quantity <= 0:
             return delete_order_item(request)
 
-        # 🔒 Load item + its order
-        order_item = OrderItem.objects.select_related('order').get(id=item_id)
-        order = order_item.order
-
-        # 🔒 Block changes if order is completed
-        if order.status == 'completed':
-            return JsonResponse(
-                {'error': 'Completed orders cannot be modified'},
-                status=400
-            )
-
-        order_item.quantity = quantity
-        order_item.total_price = (order_item.unit_price or Decimal('0')) * (quantity or Decimal('0'))
-        order_item.save()
-
-        # Update order total
-        order.total_amount = sum(item.total_price for item in order.items.all())
-        order.save()
+        # 🔒 "not completed" is enforced by the same UPDATE that moves the total
+        result = order_store.update_item(item_id, quantity, client_id=client_id)
+        versioning.bump_version(result['client_id'], versioning.ORDERS)
 
         return JsonResponse({
             'success': True,
-            'totalAmount': order.total_amount,
+            'totalAmount': result['total_amount'],
             'message': 'Order item updated'
         })
 
-    except OrderItem.DoesNotExist:
+    except order_store.OrderNotFound:
         return JsonResponse({'error': 'Order item not found'}, status=404)
+    except order_store.OrderLocked:
+        return JsonResponse({'error': 'Completed orders cannot be modified'}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -751,30 +753,21 @@ def delete_order_item(request):
     try:
         data = json.loads(request.body)
         item_id = data.get('item_id')
+        _, client_id = request_identity(request, data)
+        if not client_id:
+            return client_required()
 
-        order_item = OrderItem.objects.select_related('order').get(id=item_id)
-        order = order_item.order
-
-        # 🔒 Block changes if order is completed
-        if order.status == 'completed':
-            return JsonResponse(
-                {'error': 'Completed orders cannot be modified'},
-                status=400
-            )
-
-        order_item.delete()
-
-        # Update order total
-        order.total_amount = sum(item.total_price for item in order.items.all())
-        order.save()
+        result = order_store.delete_item(item_id, client_id=client_id)
+        versioning.bump_version(result['client_id'], versioning.ORDERS)
 
         return JsonResponse({
             'success': True,
             'message': 'Order item deleted'
         })
 
-    except OrderItem.DoesNotExist:
+    except order_store.OrderNotFound:
         return JsonResponse({'error': 'Order item not found'}, status=404)
+    except order_store.OrderLocked:
+        return JsonResponse({'error': 'Completed orders cannot be modified'}, status=400)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
-
+        return JsonResponse({'error': str(e)}, status=500)
\ No newline at end of file